@@ -91,6 +91,15 @@ del _py2_b2x
 del _py2_lx
 del _py2_b2lx
 
+# Precompiled codecs for the fixed-width fields of the core primitives. Where
+# several fixed-width fields are adjacent they're packed and unpacked together
+# in a single call.
+_int32 = struct.Struct(b'<i')
+_uint32 = struct.Struct(b'<I')
+_int64 = struct.Struct(b'<q')
+_outpoint_struct = struct.Struct(b'<32sI')
+_block_header_struct = struct.Struct(b'<i32s32sIII')
+
 
 def str_money_value(value):
     """Convert an integer money value to a fixed point string"""
@@ -110,12 +119,13 @@ class ValidationError(Exception):
 
 def __make_mutable(cls):
     # For speed we use a class decorator that removes the immutable
-    # restrictions directly. In addition the modified behavior of GetHash() and
-    # hash() is undone.
+    # restrictions directly. In addition the modified behavior of GetHash(),
+    # hash() and serialize() is undone.
     cls.__setattr__ = object.__setattr__
     cls.__delattr__ = object.__delattr__
     cls.GetHash = Serializable.GetHash
     cls.__hash__ = Serializable.__hash__
+    cls.serialize = Serializable.serialize
     return cls
 
 
@@ -133,14 +143,23 @@ class COutPoint(ImmutableSerializable):
 
     @classmethod
     def stream_deserialize(cls, f):
-        hash = ser_read(f,32)
-        n = struct.unpack(b"<I", ser_read(f,4))[0]
+        (hash, n) = _outpoint_struct.unpack(ser_read(f,36))
         return cls(hash, n)
 
+    @classmethod
+    def view_deserialize(cls, view, offset=0):
+        try:
+            (hash, n) = _outpoint_struct.unpack_from(view, offset)
+        except struct.error:
+            raise view_truncation_error(view, offset, 36)
+        return (cls(hash, n), offset + 36)
+
     def stream_serialize(self, f):
         assert len(self.hash) == 32
-        f.write(self.hash)
-        f.write(struct.pack(b"<I", self.n))
+        f.write(_outpoint_struct.pack(self.hash, self.n))
+
+    def get_serialize_size(self):
+        return 36
 
     def is_null(self):
         return ((self.hash == b'\x00'*32) and (self.n == 0xffffffff))
@@ -197,13 +216,27 @@ class CTxIn(ImmutableSerializable):
     def stream_deserialize(cls, f):
         prevout = COutPoint.stream_deserialize(f)
         scriptSig = script.CScript(BytesSerializer.stream_deserialize(f))
-        nSequence = struct.unpack(b"<I", ser_read(f,4))[0]
+        nSequence = _uint32.unpack(ser_read(f,4))[0]
         return cls(prevout, scriptSig, nSequence)
 
+    @classmethod
+    def view_deserialize(cls, view, offset=0):
+        (prevout, offset) = COutPoint.view_deserialize(view, offset)
+        (l, offset) = VarIntSerializer.view_deserialize(view, offset)
+        (scriptSig, offset) = view_read(view, offset, l)
+        try:
+            nSequence = _uint32.unpack_from(view, offset)[0]
+        except struct.error:
+            raise view_truncation_error(view, offset, 4)
+        return (cls(prevout, script.CScript(scriptSig), nSequence), offset + 4)
+
     def stream_serialize(self, f):
         COutPoint.stream_serialize(self.prevout, f)
         BytesSerializer.stream_serialize(self.scriptSig, f)
-        f.write(struct.pack(b"<I", self.nSequence))
+        f.write(_uint32.pack(self.nSequence))
+
+    def get_serialize_size(self):
+        return 36 + BytesSerializer.get_serialize_size(self.scriptSig) + 4
 
     def is_final(self):
         return (self.nSequence == 0xffffffff)
@@ -260,14 +293,27 @@ class CTxOut(ImmutableSerializable):
 
     @classmethod
     def stream_deserialize(cls, f):
-        nValue = struct.unpack(b"<q", ser_read(f,8))[0]
+        nValue = _int64.unpack(ser_read(f,8))[0]
         scriptPubKey = script.CScript(BytesSerializer.stream_deserialize(f))
         return cls(nValue, scriptPubKey)
 
+    @classmethod
+    def view_deserialize(cls, view, offset=0):
+        try:
+            nValue = _int64.unpack_from(view, offset)[0]
+        except struct.error:
+            raise view_truncation_error(view, offset, 8)
+        (l, offset) = VarIntSerializer.view_deserialize(view, offset + 8)
+        (scriptPubKey, offset) = view_read(view, offset, l)
+        return (cls(nValue, script.CScript(scriptPubKey)), offset)
+
     def stream_serialize(self, f):
-        f.write(struct.pack(b"<q", self.nValue))
+        f.write(_int64.pack(self.nValue))
         BytesSerializer.stream_serialize(self.scriptPubKey, f)
 
+    def get_serialize_size(self):
+        return 8 + BytesSerializer.get_serialize_size(self.scriptPubKey)
+
     def is_valid(self):
         if not MoneyRange(self.nValue):
             return False
@@ -325,17 +371,59 @@ class CTransaction(ImmutableSerializable):
 
     @classmethod
     def stream_deserialize(cls, f):
-        nVersion = struct.unpack(b"<i", ser_read(f,4))[0]
+        nVersion = _int32.unpack(ser_read(f,4))[0]
         vin = VectorSerializer.stream_deserialize(CTxIn, f)
         vout = VectorSerializer.stream_deserialize(CTxOut, f)
-        nLockTime = struct.unpack(b"<I", ser_read(f,4))[0]
+        nLockTime = _uint32.unpack(ser_read(f,4))[0]
         return cls(vin, vout, nLockTime, nVersion)
 
+    @classmethod
+    def view_deserialize(cls, view, offset=0):
+        start = offset
+        try:
+            nVersion = _int32.unpack_from(view, offset)[0]
+        except struct.error:
+            raise view_truncation_error(view, offset, 4)
+        (vin, offset) = VectorSerializer.view_deserialize(CTxIn, view, offset + 4)
+        (vout, offset) = VectorSerializer.view_deserialize(CTxOut, view, offset)
+        try:
+            nLockTime = _uint32.unpack_from(view, offset)[0]
+        except struct.error:
+            raise view_truncation_error(view, offset, 4)
+        offset += 4
+
+        self = cls(vin, vout, nLockTime, nVersion)
+        if not isinstance(self, CMutableTransaction) and cls._is_canonical(self, offset - start):
+            # Keep the original bytes so that serialize(), GetHash() and size
+            # checks never have to re-encode the transaction.
+            object.__setattr__(self, '_cached_serialize', view[start:offset].tobytes())
+        return (self, offset)
+
+    @staticmethod
+    def _is_canonical(tx, size):
+        # True if size bytes is what serializing tx produces. Varints that
+        # aren't minimally encoded deserialize fine, but take more bytes.
+        varint_bytes = size - 8 - 40*len(tx.vin) - 8*len(tx.vout)
+        varint_bytes -= sum(len(txin.scriptSig) for txin in tx.vin)
+        varint_bytes -= sum(len(txout.scriptPubKey) for txout in tx.vout)
+        if varint_bytes == 2 + len(tx.vin) + len(tx.vout):
+            # Every varint is a single byte
+            return True
+        return size == (4 + VectorSerializer.get_serialize_size(CTxIn, tx.vin)
+                          + VectorSerializer.get_serialize_size(CTxOut, tx.vout) + 4)
+
     def stream_serialize(self, f):
-        f.write(struct.pack(b"<i", self.nVersion))
+        f.write(_int32.pack(self.nVersion))
         VectorSerializer.stream_serialize(CTxIn, self.vin, f)
         VectorSerializer.stream_serialize(CTxOut, self.vout, f)
-        f.write(struct.pack(b"<I", self.nLockTime))
+        f.write(_uint32.pack(self.nLockTime))
+
+    def get_serialize_size(self):
+        try:
+            return len(self._cached_serialize)
+        except AttributeError:
+            return (4 + VectorSerializer.get_serialize_size(CTxIn, self.vin)
+                      + VectorSerializer.get_serialize_size(CTxOut, self.vout) + 4)
 
     def is_coinbase(self):
         return len(self.vin) == 1 and self.vin[0].prevout.is_null()
@@ -385,6 +473,96 @@ class CMutableTransaction(CTransaction):
         return cls(vin, vout, tx.nLockTime, tx.nVersion)
 
 
+# Slot descriptors of CTransaction, which _LazyTransaction shadows with
+# properties.
+_tx_vin_slot = CTransaction.vin
+_tx_vout_slot = CTransaction.vout
+
+class _LazyTransaction(CTransaction):
+    """A transaction whose inputs and outputs are parsed on first access
+
+    Created by CBlock.deserialize(buf, lazy=True). Only the raw serialized
+    transaction, nVersion and nLockTime are stored up front; serialize(),
+    GetHash() and equality work directly on the raw bytes.
+    """
+    __slots__ = []
+
+    @staticmethod
+    def scan(view, offset):
+        """Return (end, canonical) for the transaction starting at offset
+
+        end is the offset just past the transaction. canonical is False if any
+        of its varints isn't minimally encoded, in which case serialize()
+        wouldn't reproduce the raw bytes. Walks the varints and script lengths
+        without creating any objects.
+        """
+        read_varint = VarIntSerializer.view_deserialize
+        varint_size = VarIntSerializer.get_serialize_size
+        canonical = True
+
+        (n, end) = read_varint(view, offset + 4)
+        if end - offset - 4 > 1 and end - offset - 4 != varint_size(n):
+            canonical = False
+        offset = end
+        for i in range(n):
+            (l, end) = read_varint(view, offset + 36)
+            if end - offset - 36 > 1 and end - offset - 36 != varint_size(l):
+                canonical = False
+            offset = end + l + 4
+        (n, end) = read_varint(view, offset)
+        if end - offset > 1 and end - offset != varint_size(n):
+            canonical = False
+        offset = end
+        for i in range(n):
+            (l, end) = read_varint(view, offset + 8)
+            if end - offset - 8 > 1 and end - offset - 8 != varint_size(l):
+                canonical = False
+            offset = end + l
+        offset += 4
+        if offset > len(view):
+            raise SerializationTruncationError('Transaction truncated; needed %i bytes, but only got %i' %
+                                                   (offset, len(view)))
+        return (offset, canonical)
+
+    @classmethod
+    def view_deserialize(cls, view, offset=0):
+        start = offset
+        (offset, canonical) = cls.scan(view, start)
+        if not canonical:
+            # The raw bytes can't stand in for the transaction
+            return CTransaction.view_deserialize(view, start)
+
+        self = object.__new__(cls)
+        object.__setattr__(self, '_cached_serialize', view[start:offset].tobytes())
+        object.__setattr__(self, 'nVersion', _int32.unpack_from(view, start)[0])
+        object.__setattr__(self, 'nLockTime', _uint32.unpack_from(view, offset - 4)[0])
+        return (self, offset)
+
+    def _materialize(self):
+        view = memoryview(self._cached_serialize)
+        (vin, offset) = VectorSerializer.view_deserialize(CTxIn, view, 4)
+        (vout, offset) = VectorSerializer.view_deserialize(CTxOut, view, offset)
+        _tx_vin_slot.__set__(self, tuple(vin))
+        _tx_vout_slot.__set__(self, tuple(vout))
+
+    @property
+    def vin(self):
+        try:
+            return _tx_vin_slot.__get__(self, CTransaction)
+        except AttributeError:
+            self._materialize()
+            return _tx_vin_slot.__get__(self, CTransaction)
+
+    @property
+    def vout(self):
+        try:
+            return _tx_vout_slot.__get__(self, CTransaction)
+        except AttributeError:
+            self._materialize()
+            return _tx_vout_slot.__get__(self, CTransaction)
+
+    def stream_serialize(self, f):
+        f.write(self._cached_serialize)
 
 
 class CBlockHeader(ImmutableSerializable):
@@ -403,23 +581,28 @@ class CBlockHeader(ImmutableSerializable):
 
     @classmethod
     def stream_deserialize(cls, f):
-        nVersion = struct.unpack(b"<i", ser_read(f,4))[0]
-        hashPrevBlock = ser_read(f,32)
-        hashMerkleRoot = ser_read(f,32)
-        nTime = struct.unpack(b"<I", ser_read(f,4))[0]
-        nBits = struct.unpack(b"<I", ser_read(f,4))[0]
-        nNonce = struct.unpack(b"<I", ser_read(f,4))[0]
-        return cls(nVersion, hashPrevBlock, hashMerkleRoot, nTime, nBits, nNonce)
+        return cls(*_block_header_struct.unpack(ser_read(f,80)))
+
+    @classmethod
+    def view_deserialize(cls, view, offset=0):
+        try:
+            fields = _block_header_struct.unpack_from(view, offset)
+        except struct.error:
+            raise view_truncation_error(view, offset, 80)
+        return (cls(*fields), offset + 80)
 
     def stream_serialize(self, f):
-        f.write(struct.pack(b"<i", self.nVersion))
+        f.write(self._serialize_header())
+
+    def get_serialize_size(self):
+        return 80
+
+    def _serialize_header(self):
+        # Only the 80 header bytes, even for a CBlock
         assert len(self.hashPrevBlock) == 32
-        f.write(self.hashPrevBlock)
         assert len(self.hashMerkleRoot) == 32
-        f.write(self.hashMerkleRoot)
-        f.write(struct.pack(b"<I", self.nTime))
-        f.write(struct.pack(b"<I", self.nBits))
-        f.write(struct.pack(b"<I", self.nNonce))
+        return _block_header_struct.pack(self.nVersion, self.hashPrevBlock, self.hashMerkleRoot,
+                                         self.nTime, self.nBits, self.nNonce)
 
     @staticmethod
     def calc_difficulty(nBits):
@@ -442,7 +625,7 @@ class CBlockHeader(ImmutableSerializable):
 
 class CBlock(CBlockHeader):
     """A block including all transactions in it"""
-    __slots__ = ['vtx', 'vMerkleTree']
+    __slots__ = ['vtx', '_cached_vMerkleTree']
 
     @staticmethod
     def build_merkle_tree_from_txids(txids):
@@ -463,40 +646,163 @@ class CBlock(CBlockHeader):
         """
         merkle_tree = list(txids)
 
-        size = len(txids)
+        level = merkle_tree
+        while len(level) > 1:
+            level = hash_pairs(level)
+            merkle_tree.extend(level)
+
+        return merkle_tree
+
+    @staticmethod
+    def build_merkle_tree_from_txs(txs, executor=None):
+        """Build a full merkle tree from transactions
+
+        executor - Optional concurrent.futures.Executor used to calculate the
+                   txids; see Hash_many()
+        """
+        txids = Hash_many([tx.serialize() for tx in txs], executor)
+        return CBlock.build_merkle_tree_from_txids(txids)
+
+    @staticmethod
+    def update_merkle_tree(merkle_tree, size, index, txid):
+        """Update a merkle tree after the txid at index changed
+
+        merkle_tree - merkle tree as returned by build_merkle_tree_from_txids()
+        size        - number of txids the tree was built from
+        index       - index of the changed txid
+        txid        - the new txid
+
+        Returns a new merkle tree. Only the hashes on the path from the changed
+        txid to the root are recalculated.
+        """
+        if not (0 <= index < size):
+            raise IndexError('merkle tree index out of range')
+        merkle_tree = list(merkle_tree)
+        merkle_tree[index] = txid
+
         j = 0
         while size > 1:
-            for i in range(0, size, 2):
-                i2 = min(i+1, size-1)
-                merkle_tree.append(Hash(merkle_tree[j+i] + merkle_tree[j+i2]))
+            i = index & ~1
+            i2 = min(i+1, size-1)
+            merkle_tree[j + size + index//2] = Hash(merkle_tree[j+i] + merkle_tree[j+i2])
 
+            index //= 2
             j += size
             size = (size + 1) // 2
 
         return merkle_tree
 
     @staticmethod
-    def build_merkle_tree_from_txs(txs):
-        """Build a full merkle tree from transactions"""
-        txids = [tx.GetHash() for tx in txs]
-        return CBlock.build_merkle_tree_from_txids(txids)
+    def build_merkle_branch(merkle_tree, size, index):
+        """Build the merkle branch for the txid at index
+
+        merkle_tree - merkle tree as returned by build_merkle_tree_from_txids()
+        size        - number of txids the tree was built from
+        index       - index of the txid
+
+        Returns a list of hashes, deepest first, that check_merkle_branch()
+        combines with the txid to arrive at the merkle root.
+        """
+        if not (0 <= index < size):
+            raise IndexError('merkle tree index out of range')
+        branch = []
+
+        j = 0
+        while size > 1:
+            i = min(index^1, size-1)
+            branch.append(merkle_tree[j+i])
+
+            index //= 2
+            j += size
+            size = (size + 1) // 2
+
+        return branch
+
+    @staticmethod
+    def check_merkle_branch(txid, branch, index):
+        """Calculate the merkle root implied by a merkle branch
+
+        txid   - txid being proven
+        branch - merkle branch as returned by build_merkle_branch()
+        index  - index of the txid in the block
+
+        Returns the merkle root; compare it against the hashMerkleRoot of the
+        block header to check the proof.
+        """
+        h = txid
+        for otherside in branch:
+            if index & 1:
+                h = Hash(otherside + h)
+            else:
+                h = Hash(h + otherside)
+            index >>= 1
+        return h
+
+    @property
+    def vMerkleTree(self):
+        """The full merkle tree of the block, built on first use"""
+        try:
+            return self._cached_vMerkleTree
+        except AttributeError:
+            vMerkleTree = tuple(CBlock.build_merkle_tree_from_txs(self.vtx))
+            object.__setattr__(self, '_cached_vMerkleTree', vMerkleTree)
+            return vMerkleTree
 
     def calc_merkle_root(self):
         """Calculate the merkle root
 
-        The calculated merkle root is not cached; every invocation
-        re-calculates it from scratch.
+        The merkle tree is built on the first invocation and cached along with
+        the block.
         """
         if not len(self.vtx):
             raise ValueError('Block contains no transactions')
-        return self.build_merkle_tree_from_txs(self.vtx)[-1]
+        return self.vMerkleTree[-1]
+
+    def get_merkle_branch(self, index):
+        """Return the merkle branch for vtx[index]
+
+        Use check_merkle_branch() to verify the branch against
+        hashMerkleRoot.
+        """
+        return self.build_merkle_branch(self.vMerkleTree, len(self.vtx), index)
+
+    def replace_tx(self, index, tx):
+        """Return a copy of the block with vtx[index] replaced by tx
+
+        The merkle tree of the new block is derived from this one by
+        recalculating only the changed path, and hashMerkleRoot is set to the
+        new root. Useful for e.g. changing the coinbase of a block template.
+        The other transactions are shared with this block as they are, so
+        transactions of a lazily deserialized block stay unparsed.
+        """
+        vtx = list(self.vtx)
+        vtx[index] = CTransaction.from_tx(tx)
+        vMerkleTree = tuple(CBlock.update_merkle_tree(self.vMerkleTree, len(vtx), index % len(vtx),
+                                                      vtx[index].GetHash()))
+
+        # A shallow copy keeps the class and any attributes of subclasses;
+        # only what depends on the merkle root has to go.
+        cls = self.__class__
+        r = object.__new__(cls)
+        for klass in cls.__mro__:
+            for name in klass.__dict__.get('__slots__', ()):
+                if name in ('_cached_GetHash', '_cached__hash__', '_cached_serialize'):
+                    continue
+                try:
+                    object.__setattr__(r, name, object.__getattribute__(self, name))
+                except AttributeError:
+                    pass
+        if hasattr(self, '__dict__'):
+            r.__dict__.update(self.__dict__)
+        object.__setattr__(r, 'vtx', tuple(vtx))
+        object.__setattr__(r, '_cached_vMerkleTree', vMerkleTree)
+        object.__setattr__(r, 'hashMerkleRoot', vMerkleTree[-1])
+        return r
 
     def __init__(self, nVersion=2, hashPrevBlock=b'\x00'*32, hashMerkleRoot=b'\x00'*32, nTime=0, nBits=0, nNonce=0, vtx=()):
         """Create a new block"""
         super(CBlock, self).__init__(nVersion, hashPrevBlock, hashMerkleRoot, nTime, nBits, nNonce)
 
-        vMerkleTree = tuple(CBlock.build_merkle_tree_from_txs(vtx))
-        object.__setattr__(self, 'vMerkleTree', vMerkleTree)
         object.__setattr__(self, 'vtx', tuple(CTransaction.from_tx(tx) for tx in vtx))
 
     @classmethod
@@ -504,15 +810,57 @@ class CBlock(CBlockHeader):
         self = super(CBlock, cls).stream_deserialize(f)
 
         vtx = VectorSerializer.stream_deserialize(CTransaction, f)
-        vMerkleTree = tuple(CBlock.build_merkle_tree_from_txs(vtx))
-        object.__setattr__(self, 'vMerkleTree', vMerkleTree)
         object.__setattr__(self, 'vtx', tuple(vtx))
 
         return self
 
+    @classmethod
+    def view_deserialize(cls, view, offset=0, lazy=False):
+        (self, offset) = super(CBlock, cls).view_deserialize(view, offset)
+
+        tx_cls = _LazyTransaction if lazy else CTransaction
+        (vtx, offset) = VectorSerializer.view_deserialize(tx_cls, view, offset)
+        object.__setattr__(self, 'vtx', tuple(vtx))
+
+        return (self, offset)
+
+    @classmethod
+    def deserialize(cls, buf, allow_padding=False, lazy=False):
+        """Deserialize bytes, returning a block
+
+        allow_padding - Allow buf to include extra padding. (default False)
+
+        lazy          - Only record the boundaries and raw bytes of each
+                        transaction; inputs and outputs are parsed the first
+                        time vtx[i].vin or vtx[i].vout is accessed. Block hash,
+                        txids and the merkle tree come straight from the raw
+                        bytes. (default False)
+        """
+        if not lazy:
+            return super(CBlock, cls).deserialize(buf, allow_padding=allow_padding)
+
+        with memoryview(buf) as view:
+            (r, offset) = cls.view_deserialize(view, 0, lazy=True)
+            if not allow_padding and offset != len(view):
+                raise DeserializationExtraDataError('Not all bytes consumed during deserialization',
+                                                    r, view[offset:].tobytes())
+        return r
+
     def stream_serialize(self, f):
-        super(CBlock, self).stream_serialize(f)
-        VectorSerializer.stream_serialize(CTransaction, self.vtx, f)
+        f.write(self.serialize())
+
+    def serialize(self):
+        """Serialize, returning bytes
+
+        Assembled from the header and the transactions' own (cached)
+        serializations; the block itself is not cached to avoid holding a
+        second copy of every transaction.
+        """
+        return b''.join([self._serialize_header(), VarIntSerializer.serialize(len(self.vtx))] +
+                        [tx.serialize() for tx in self.vtx])
+
+    def get_serialize_size(self):
+        return 80 + VectorSerializer.get_serialize_size(CTransaction, self.vtx)
 
     def get_header(self):
         """Return the block header
@@ -535,7 +883,7 @@ class CBlock(CBlockHeader):
         try:
             return self._cached_GetHash
         except AttributeError:
-            _cached_GetHash = self.get_header().GetHash()
+            _cached_GetHash = Hash(self._serialize_header())
             object.__setattr__(self, '_cached_GetHash', _cached_GetHash)
             return _cached_GetHash
 
@@ -544,6 +892,10 @@ class CoreChainParams(object):
     MAX_MONEY = None
     GENESIS_BLOCK = None
     PROOF_OF_WORK_LIMIT = None
+    POW_TARGET_TIMESPAN = None
+    POW_TARGET_SPACING = None
+    POW_ALLOW_MIN_DIFFICULTY_BLOCKS = None
+    POW_NO_RETARGETING = None
     SUBSIDY_HALVING_INTERVAL = None
     NAME = None
 
@@ -553,9 +905,14 @@ class CoreMainParams(CoreChainParams):
     GENESIS_BLOCK = CBlock.deserialize(x('0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c0101000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000'))
     SUBSIDY_HALVING_INTERVAL = 210000
     PROOF_OF_WORK_LIMIT = 2**256-1 >> 32
+    POW_TARGET_TIMESPAN = 14 * 24 * 60 * 60 # two weeks
+    POW_TARGET_SPACING = 10 * 60
+    POW_ALLOW_MIN_DIFFICULTY_BLOCKS = False
+    POW_NO_RETARGETING = False
 
 class CoreTestNetParams(CoreMainParams):
     NAME = 'testnet'
+    POW_ALLOW_MIN_DIFFICULTY_BLOCKS = True
     GENESIS_BLOCK = CBlock.deserialize(x('0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4adae5494dffff001d1aa4ae180101000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000'))
 
 class CoreRegTestParams(CoreTestNetParams):
@@ -563,6 +920,7 @@ class CoreRegTestParams(CoreTestNetParams):
     GENESIS_BLOCK = CBlock.deserialize(x('0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4adae5494dffff7f20020000000101000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000'))
     SUBSIDY_HALVING_INTERVAL = 150
     PROOF_OF_WORK_LIMIT = 2**256-1 >> 1
+    POW_NO_RETARGETING = True
 
 """Master global setting for what core chain params we're using"""
 coreparams = CoreMainParams()
@@ -600,7 +958,7 @@ def CheckTransaction(tx):
         raise CheckTransactionError("CheckTransaction() : vout empty")
 
     # Size limits
-    if len(tx.serialize()) > MAX_BLOCK_SIZE:
+    if tx.get_serialize_size() > MAX_BLOCK_SIZE:
         raise CheckTransactionError("CheckTransaction() : size limits failed")
 
     # Check for negative or overflow output values
@@ -640,15 +998,20 @@ class CheckBlockHeaderError(ValidationError):
 class CheckProofOfWorkError(CheckBlockHeaderError):
     pass
 
-def CheckProofOfWork(hash, nBits):
+def CheckProofOfWork(hash, nBits, params=None):
     """Check a proof-of-work
 
+    params - Chain params to check against. Defaults to coreparams.
+
     Raises CheckProofOfWorkError
     """
+    if not params:
+        params = coreparams
+
     target = uint256_from_compact(nBits)
 
     # Check range
-    if not (0 < target <= coreparams.PROOF_OF_WORK_LIMIT):
+    if not (0 < target <= params.PROOF_OF_WORK_LIMIT):
         raise CheckProofOfWorkError("CheckProofOfWork() : nBits below minimum work")
 
     # Check proof of work matches claimed amount
@@ -657,13 +1020,15 @@ def CheckProofOfWork(hash, nBits):
         raise CheckProofOfWorkError("CheckProofOfWork() : hash doesn't match nBits")
 
 
-def CheckBlockHeader(block_header, fCheckPoW = True, cur_time=None):
+def CheckBlockHeader(block_header, fCheckPoW = True, cur_time=None, params=None):
     """Context independent CBlockHeader checks.
 
     fCheckPoW - Check proof-of-work.
 
     cur_time  - Current time. Defaults to time.time()
 
+    params    - Chain params to check against. Defaults to coreparams.
+
     Raises CBlockHeaderError if block header is invalid.
     """
     if cur_time is None:
@@ -671,7 +1036,7 @@ def CheckBlockHeader(block_header, fCheckPoW = True, cur_time=None):
 
     # Check proof-of-work matches claimed amount
     if fCheckPoW:
-        CheckProofOfWork(block_header.GetHash(), block_header.nBits)
+        CheckProofOfWork(block_header.GetHash(), block_header.nBits, params)
 
     # Check timestamp
     if block_header.nTime > cur_time + 2 * 60 * 60:
@@ -690,7 +1055,27 @@ def GetLegacySigOpCount(tx):
     return nSigOps
 
 
-def CheckBlock(block, fCheckPoW = True, fCheckMerkleRoot = True, cur_time=None):
+def _CheckBlockTx(tx):
+    """Context independent checks of a single non-coinbase block transaction
+
+    Returns (is_coinbase, err, txid, nSigOps); err is the
+    CheckTransactionError raised by CheckTransaction(), if any. CheckBlock()
+    decides which of these results is the first error.
+    """
+    err = None
+    try:
+        CheckTransaction(tx)
+    except CheckTransactionError as e:
+        err = e
+    return (tx.is_coinbase(), err, tx.GetHash(), GetLegacySigOpCount(tx))
+
+def _CheckBlockTxs(serialized_txs):
+    """CheckBlock() worker: _CheckBlockTx() for a chunk of serialized txs"""
+    return [_CheckBlockTx(CTransaction.deserialize(serialized_tx)) for serialized_tx in serialized_txs]
+
+_CHECKBLOCK_CHUNK_SIZE = 64
+
+def CheckBlock(block, fCheckPoW = True, fCheckMerkleRoot = True, cur_time=None, executor=None):
     """Context independent CBlock checks.
 
     CheckBlockHeader() is called first, which may raise a CheckBlockHeader
@@ -702,6 +1087,13 @@ def CheckBlock(block, fCheckPoW = True, fCheckMerkleRoot = True, cur_time=None):
     fCheckMerkleRoot - Check merkle root matches transactions.
 
     cur_time         - Current time. Defaults to time.time()
+
+    executor         - Optional concurrent.futures.Executor. If given the
+                       per-transaction checks are spread over it in chunks,
+                       with the transactions sent to the workers in serialized
+                       form, so a ProcessPoolExecutor works. The results are
+                       merged in block order, so the first error raised is the
+                       same as without an executor.
     """
 
     # Block header checks
@@ -710,7 +1102,7 @@ def CheckBlock(block, fCheckPoW = True, fCheckMerkleRoot = True, cur_time=None):
     # Size limits
     if not block.vtx:
         raise CheckBlockError("CheckBlock() : vtx empty")
-    if len(block.serialize()) > MAX_BLOCK_SIZE:
+    if block.get_serialize_size() > MAX_BLOCK_SIZE:
         raise CheckBlockError("CheckBlock() : block larger than MAX_BLOCK_SIZE")
 
     # First transaction must be coinbase
@@ -722,29 +1114,46 @@ def CheckBlock(block, fCheckPoW = True, fCheckMerkleRoot = True, cur_time=None):
 
     # For unique txid uniqueness testing. If coinbase tx is included twice
     # it'll be caught by the "more than one coinbase" test.
+    if executor is None:
+        tx_results = (_CheckBlockTx(tx) for tx in block.vtx[1:])
+    else:
+        serialized_txs = [tx.serialize() for tx in block.vtx[1:]]
+        chunks = [serialized_txs[i:i+_CHECKBLOCK_CHUNK_SIZE]
+                  for i in range(0, len(serialized_txs), _CHECKBLOCK_CHUNK_SIZE)]
+        tx_results = [tx_result for chunk_results in executor.map(_CheckBlockTxs, chunks)
+                                for tx_result in chunk_results]
+
     unique_txids = set()
     nSigOps = 0
-    for tx in block.vtx[1:]:
-        if tx.is_coinbase():
+    for (is_coinbase, err, txid, tx_nSigOps) in tx_results:
+        if is_coinbase:
             raise CheckBlockError("CheckBlock() : more than one coinbase")
 
-        CheckTransaction(tx)
+        if err is not None:
+            raise err
 
-        txid = tx.GetHash()
         if txid in unique_txids:
             raise CheckBlockError("CheckBlock() : duplicate transaction")
         unique_txids.add(txid)
 
-        nSigOps += GetLegacySigOpCount(tx)
+        nSigOps += tx_nSigOps
         if nSigOps > MAX_BLOCK_SIGOPS:
             raise CheckBlockError("CheckBlock() : out-of-bounds SigOpCount")
 
     # Check merkle root
-    if fCheckMerkleRoot and block.hashMerkleRoot != block.calc_merkle_root():
-        raise CheckBlockError("CheckBlock() : hashMerkleRoot mismatch")
+    if fCheckMerkleRoot:
+        if executor is None:
+            hashMerkleRoot = block.calc_merkle_root()
+        else:
+            # The workers already calculated every txid but the coinbase's
+            txids = [block.vtx[0].GetHash()] + [tx_result[2] for tx_result in tx_results]
+            hashMerkleRoot = CBlock.build_merkle_tree_from_txids(txids)[-1]
+        if block.hashMerkleRoot != hashMerkleRoot:
+            raise CheckBlockError("CheckBlock() : hashMerkleRoot mismatch")
 
 __all__ = (
         'Hash',
+        'Hash_many',
         'Hash160',
         'COIN',
         'MAX_BLOCK_SIZE',
@@ -0,0 +1,630 @@
+# Copyright (C) 2012-2016 The python-bitcoinlib developers
+#
+# This file is part of python-bitcoinlib.
+#
+# It is subject to the license terms in the LICENSE file found in the top-level
+# directory of this distribution.
+#
+# No part of python-bitcoinlib, including this file, may be copied, modified,
+# propagated, or distributed except according to the terms contained in the
+# LICENSE file.
+
+"""Block header chains
+
+HeaderStore keeps a chain of serialized headers in one contiguous buffer,
+optionally a memory-mapped file. HeaderChain builds on it to keep track of the
+best chain of block headers, checking linkage, proof-of-work and difficulty
+retargeting as headers are added. Like the rest of python-bitcoinlib this is
+not a consensus-grade implementation; think carefully before relying on it.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import array
+import itertools
+import mmap
+import os
+import struct
+import time
+
+import bitcoin.core
+from bitcoin.core import CBlockHeader, CheckBlockHeader, ValidationError, b2lx
+from bitcoin.core.serialize import Hash, uint256_from_compact, compact_from_uint256
+
+# Number of previous blocks used to calculate the median time past
+MEDIAN_TIME_SPAN = 11
+
+# Default limit on how far below the tip a side branch may fork off. Pruned
+# Bitcoin Core nodes keep no more than this many blocks (MIN_BLOCKS_TO_KEEP),
+# so they can't reorganize deeper either.
+MAX_REORG_DEPTH = 288
+
+# nTime and nBits, which are adjacent at offset 68 of a serialized header
+_time_bits = struct.Struct(b'<II')
+
+# HeaderStore hash index slots hold height+1; 0 is an empty slot
+_INDEX_EMPTY = 0
+_INDEX_DELETED = 0xffffffff
+_index_slot = struct.Struct(b'<Q')
+
+_NULL_HEADER = b'\x00' * 80
+
+
+class HeaderChainError(ValidationError):
+    pass
+
+
+def GetBlockProof(nBits):
+    """Return the amount of work a header with the given nBits represents
+
+    This is the expected number of hashes needed to find a block at that
+    target.
+    """
+    target = uint256_from_compact(nBits)
+    if target <= 0:
+        return 0
+    return (1 << 256) // (target + 1)
+
+def CalculateNextWorkRequired(nBits, nFirstBlockTime, nLastBlockTime, params=None):
+    """Calculate nBits for the first block of a new retarget period
+
+    nBits           - nBits of the last block of the previous period
+    nFirstBlockTime - nTime of the first block of the previous period
+    nLastBlockTime  - nTime of the last block of the previous period
+    params          - Chain params. Defaults to coreparams.
+    """
+    if not params:
+        params = bitcoin.core.coreparams
+
+    nActualTimespan = nLastBlockTime - nFirstBlockTime
+    nActualTimespan = max(nActualTimespan, params.POW_TARGET_TIMESPAN // 4)
+    nActualTimespan = min(nActualTimespan, params.POW_TARGET_TIMESPAN * 4)
+
+    target = uint256_from_compact(nBits) * nActualTimespan // params.POW_TARGET_TIMESPAN
+    target = min(target, params.PROOF_OF_WORK_LIMIT)
+    return compact_from_uint256(target)
+
+
+class HeaderStore(object):
+    """A chain of serialized block headers, indexed by height and hash
+
+    The 80 byte headers are stored back to back in a single buffer, either in
+    memory or, if a path is given, in a memory-mapped file that persists
+    between runs. Header objects are only created on demand.
+
+    The hash index is an open-addressing hash table of heights in an
+    array.array, kept at most half full: 8 to 16 bytes per header. Header
+    hashes are not stored at all: each header's hash is the hashPrevBlock of
+    the header after it, so only the hash of the tip is kept separately. For
+    the same reason every header appended must extend the previous one.
+    """
+
+    def __init__(self, path=None):
+        """Create a header store
+
+        path - File to store the headers in. Any headers already in the file
+               are loaded. If None, headers are kept in memory only.
+        """
+        self._file = None
+        self._buf = None
+        self._count = 0
+        self._tip_hash = None
+        self._closed = False
+
+        if path is None:
+            self._buf = bytearray()
+        else:
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            self._file = open(path, 'r+b')
+
+            size = os.fstat(self._file.fileno()).st_size
+            self._count = size // 80
+            self._map(max(self._count * 80, 80 * 1024))
+
+            # The file is grown ahead of the headers actually written; an
+            # unclean shutdown leaves the unused space zeroed.
+            while self._count and self._buf[(self._count-1)*80:self._count*80] == _NULL_HEADER:
+                self._count -= 1
+            if self._count:
+                self._tip_hash = Hash(self._buf[(self._count-1)*80:self._count*80])
+
+        self._build_index(self._count)
+
+    def __len__(self):
+        self._check_open()
+        return self._count
+
+    def __getitem__(self, height):
+        """Return the header at the given height as a CBlockHeader"""
+        return CBlockHeader.deserialize(self.get_serialized(height))
+
+    def __contains__(self, hash):
+        return self._find(hash) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def tip_hash(self):
+        """Hash of the last header, or None if the store is empty"""
+        self._check_open()
+        return self._tip_hash
+
+    def get_serialized(self, height):
+        """Return the serialized header at the given height"""
+        height = self._check_height(height)
+        return bytes(self._buf[height*80:height*80+80])
+
+    def get_hash(self, height):
+        """Return the hash of the header at the given height"""
+        height = self._check_height(height)
+        if height == self._count - 1:
+            return self._tip_hash
+        return bytes(self._buf[height*80+84:height*80+116])
+
+    def get_height(self, hash):
+        """Return the height of the header with the given hash
+
+        Raises KeyError if there is no such header.
+        """
+        height = self._find(hash)
+        if height is None:
+            raise KeyError(hash)
+        return height
+
+    def get_time_bits(self, height):
+        """Return (nTime, nBits) of the header at the given height
+
+        Cheaper than creating the header when only these fields are needed.
+        """
+        return _time_bits.unpack_from(self._buf, self._check_height(height)*80 + 68)
+
+    def append(self, serialized_header):
+        """Append a serialized header
+
+        Raises ValueError if the header doesn't extend the last one.
+        """
+        if len(serialized_header) != 80:
+            raise ValueError('Serialized header must be exactly 80 bytes; got %d bytes' % len(serialized_header))
+        self._check_open()
+        if self._count and serialized_header[4:36] != self._tip_hash:
+            raise ValueError('Header does not extend the last header in the store')
+
+        end = (self._count + 1) * 80
+        if self._file is None:
+            self._buf += serialized_header
+        else:
+            if end > len(self._buf):
+                self._map(len(self._buf) * 2)
+            self._buf[end-80:end] = serialized_header
+
+        self._tip_hash = Hash(serialized_header)
+        self._count += 1
+
+        if (self._index_used + 1) * 2 > len(self._index):
+            self._build_index(self._count)
+        else:
+            self._index_insert(self._tip_hash, self._count - 1)
+
+    def truncate(self, count):
+        """Remove all but the first count headers"""
+        self._check_open()
+        if not (0 <= count <= self._count):
+            raise ValueError('count out of range')
+
+        for height in range(count, self._count):
+            self._index[self._find_slot(self.get_hash(height))] = _INDEX_DELETED
+
+        if self._file is None:
+            del self._buf[count*80:]
+        else:
+            self._buf[count*80:self._count*80] = b'\x00' * ((self._count - count) * 80)
+
+        self._count = count
+        self._tip_hash = Hash(self._buf[(count-1)*80:count*80]) if count else None
+
+    def flush(self):
+        """Flush headers to disk, if the store is backed by a file"""
+        self._check_open()
+        if self._file is not None:
+            self._buf.flush()
+
+    def close(self):
+        """Close the store, trimming the backing file to the headers stored
+
+        Like a file, a closed store raises ValueError on any further use.
+        Closing it again has no effect.
+        """
+        if self._closed:
+            return
+        if self._file is not None:
+            self._buf.flush()
+            self._buf.close()
+            self._file.truncate(self._count * 80)
+            self._file.close()
+            self._file = None
+        self._closed = True
+        self._buf = None
+        self._index = None
+
+    def _check_open(self):
+        if self._closed:
+            raise ValueError('I/O operation on closed HeaderStore')
+
+    def _check_height(self, height):
+        self._check_open()
+        if height < 0:
+            height += self._count
+        if not (0 <= height < self._count):
+            raise IndexError('height out of range')
+        return height
+
+    def _map(self, size):
+        # (Re)map the backing file, growing it to size bytes
+        if self._buf is not None:
+            self._buf.flush()
+            self._buf.close()
+        self._file.truncate(size)
+        self._buf = mmap.mmap(self._file.fileno(), size)
+
+    def _build_index(self, count):
+        size = 1024
+        while size < count * 2:
+            size *= 2
+        self._index = array.array(str('I'), [_INDEX_EMPTY]) * size
+        self._index_used = 0
+        for height in range(count):
+            self._index_insert(self.get_hash(height), height)
+
+    def _index_insert(self, hash, height):
+        index = self._index
+        mask = len(index) - 1
+        i = _index_slot.unpack_from(hash)[0] & mask
+        while index[i] != _INDEX_EMPTY:
+            i = (i + 1) & mask
+        index[i] = height + 1
+        self._index_used += 1
+
+    def _find_slot(self, hash):
+        index = self._index
+        mask = len(index) - 1
+        i = _index_slot.unpack_from(hash)[0] & mask
+        while True:
+            v = index[i]
+            if v == _INDEX_EMPTY:
+                return None
+            elif v != _INDEX_DELETED and self.get_hash(v - 1) == hash:
+                return i
+            i = (i + 1) & mask
+
+    def _find(self, hash):
+        self._check_open()
+        i = self._find_slot(hash)
+        if i is None:
+            return None
+        return self._index[i] - 1
+
+
+class _SideHeader(object):
+    """A header on a side branch, with its height and total chain work"""
+    __slots__ = ['header', 'height', 'chainwork']
+
+    def __init__(self, header, height, chainwork):
+        self.header = header
+        self.height = height
+        self.chainwork = chainwork
+
+
+class HeaderChain(object):
+    """The best chain of block headers, starting at the genesis block
+
+    Headers on the best chain are kept in a HeaderStore. Headers that don't
+    extend the best chain are kept as CBlockHeader objects on side branches and
+    become part of the best chain if their branch ends up with more work. Side
+    branches forking off more than max_reorg_depth headers below the tip are
+    rejected, and those left that far behind are forgotten.
+    """
+
+    def __init__(self, genesis=None, params=None, store=None, max_reorg_depth=MAX_REORG_DEPTH):
+        """Create a new header chain
+
+        genesis         - Genesis block header. Defaults to the genesis block
+                          of params.
+        params          - Chain params. Defaults to coreparams.
+        store           - HeaderStore to keep the best chain in; if it already
+                          holds headers the chain continues from them.
+                          Defaults to a new in-memory store.
+        max_reorg_depth - Deepest reorganization side branches are kept for.
+        """
+        if not params:
+            params = bitcoin.core.coreparams
+        if genesis is None:
+            genesis = params.GENESIS_BLOCK
+        if store is None:
+            store = HeaderStore()
+
+        self.params = params
+        self.store = store
+        self.max_reorg_depth = max_reorg_depth
+
+        self._side = {}
+        self._chainwork = 0
+        if not len(store):
+            self._append(genesis._serialize_header(), genesis.nBits)
+
+        else:
+            if store.get_hash(0) != genesis.GetHash():
+                raise ValueError('HeaderStore does not start with the genesis block')
+
+            # Only a few distinct nBits values occur in practice
+            block_proofs = {}
+            for height in range(len(store)):
+                nBits = store.get_time_bits(height)[1]
+                try:
+                    self._chainwork += block_proofs[nBits]
+                except KeyError:
+                    block_proofs[nBits] = GetBlockProof(nBits)
+                    self._chainwork += block_proofs[nBits]
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, height):
+        """Return the header at the given height on the best chain"""
+        return self.store[height]
+
+    def __contains__(self, hash):
+        """True if the header with the given hash is on the best chain"""
+        return hash in self.store
+
+    @property
+    def height(self):
+        """Height of the tip of the best chain"""
+        return len(self) - 1
+
+    @property
+    def tip(self):
+        """Header at the tip of the best chain"""
+        return self[-1]
+
+    @property
+    def tip_hash(self):
+        """Hash of the header at the tip of the best chain"""
+        return self.store.tip_hash
+
+    @property
+    def chainwork(self):
+        """Total work of the best chain, including the genesis block"""
+        return self._chainwork
+
+    def get_hash(self, height):
+        """Return the hash of the header at the given height"""
+        return self.store.get_hash(height)
+
+    def get_height(self, hash):
+        """Return the height of the header with the given hash
+
+        Raises KeyError if it is not on the best chain.
+        """
+        return self.store.get_height(hash)
+
+    def get_locator(self):
+        """Return block locator hashes for the best chain
+
+        Suitable for the vHave of a CBlockLocator in getheaders/getblocks
+        messages: the last ten hashes, then exponentially further apart, always
+        ending with the genesis block.
+        """
+        r = []
+        height = self.height
+        step = 1
+        while height > 0:
+            r.append(self.get_hash(height))
+            if len(r) >= 10:
+                step *= 2
+            height -= step
+        r.append(self.get_hash(0))
+        return r
+
+    def add_headers(self, headers, fCheckPoW=True, cur_time=None):
+        """Add headers to the chain
+
+        headers   - Iterable of CBlockHeader instances in chain order, for
+                    example the headers of a msg_headers message. Headers
+                    already known are skipped.
+        fCheckPoW - Check proof-of-work.
+        cur_time  - Current time. Defaults to time.time()
+
+        Headers extending the tip are appended to the best chain; others are
+        added to a side branch, which replaces the best chain once it has more
+        work. A header forking off more than max_reorg_depth headers below the
+        tip is invalid, as is one on a side branch that has been forgotten for
+        falling that far behind. Every header is checked with CheckBlockHeader() as well as
+        against its predecessors for linkage, nBits and timestamp.
+
+        Returns the number of new headers added.
+
+        Raises HeaderChainError, or the CheckBlockHeaderError raised by
+        CheckBlockHeader(), on the first invalid header; headers before it
+        remain added.
+        """
+        if cur_time is None:
+            cur_time = time.time()
+
+        n = 0
+        try:
+            for header in headers:
+                hash = header.GetHash()
+                if hash in self._side or hash in self.store:
+                    continue
+
+                if header.hashPrevBlock == self.store.tip_hash:
+                    self._check_header(header, len(self), None, fCheckPoW, cur_time)
+                    self._append(header._serialize_header(), header.nBits)
+
+                else:
+                    self._add_side_header(hash, header, fCheckPoW, cur_time)
+
+                n += 1
+        finally:
+            self._prune_side()
+        return n
+
+    def _append(self, serialized_header, nBits):
+        self.store.append(serialized_header)
+        self._chainwork += GetBlockProof(nBits)
+
+    def _add_side_header(self, hash, header, fCheckPoW, cur_time):
+        prev = self._side.get(header.hashPrevBlock)
+        if prev is not None:
+            height = prev.height + 1
+            chainwork = prev.chainwork
+        else:
+            try:
+                base = self.store.get_height(header.hashPrevBlock)
+            except KeyError:
+                raise HeaderChainError("HeaderChain.add_headers() : previous header %s not found" %
+                                       b2lx(header.hashPrevBlock))
+            if base < self.height - self.max_reorg_depth:
+                raise HeaderChainError("HeaderChain.add_headers() : header %s forks off more than %d headers below the tip" %
+                                       (b2lx(hash), self.max_reorg_depth))
+            height = base + 1
+            chainwork = self._get_chainwork(base)
+
+        self._check_header(header, height, prev, fCheckPoW, cur_time)
+        side_header = _SideHeader(header, height, chainwork + GetBlockProof(header.nBits))
+        self._side[hash] = side_header
+        if side_header.chainwork > self._chainwork:
+            self._reorganize(side_header)
+
+    def _iter_time_bits(self, height, prev):
+        # Yield (nTime, nBits) at height, height - 1, ..., 0 on the chain ending
+        # with prev, a _SideHeader, or on the best chain if prev is None. A
+        # side branch starts right after a best chain header, so once the walk
+        # leaves the side branches the rest comes from the store.
+        side = self._side
+        while prev is not None and prev.height > height:
+            prev = side.get(prev.header.hashPrevBlock)
+        while prev is not None:
+            yield (prev.header.nTime, prev.header.nBits)
+            height -= 1
+            prev = side.get(prev.header.hashPrevBlock)
+        for h in range(height, -1, -1):
+            yield self.store.get_time_bits(h)
+
+    def _get_chainwork(self, height):
+        # Work of the best chain up to and including height. Forks are usually
+        # close to the tip, so walk back from there.
+        chainwork = self._chainwork
+        for h in range(len(self) - 1, height, -1):
+            chainwork -= GetBlockProof(self.store.get_time_bits(h)[1])
+        return chainwork
+
+    def _get_median_time_past(self, height, prev):
+        times = sorted(nTime for (nTime, nBits) in
+                       itertools.islice(self._iter_time_bits(height, prev), MEDIAN_TIME_SPAN))
+        return times[len(times) // 2]
+
+    def _get_next_work_required(self, height, nTime, prev):
+        # nBits required of a header with nTime at height, following prev
+        params = self.params
+        interval = params.POW_TARGET_TIMESPAN // params.POW_TARGET_SPACING
+        prev_time_bits = self._iter_time_bits(height - 1, prev)
+        (nLastTime, nLastBits) = next(prev_time_bits)
+
+        if height % interval != 0:
+            if params.POW_ALLOW_MIN_DIFFICULTY_BLOCKS:
+                nProofOfWorkLimit = compact_from_uint256(params.PROOF_OF_WORK_LIMIT)
+
+                # Testnet special rule: a block more than twice the target
+                # spacing after the previous one may have minimum difficulty.
+                if nTime > nLastTime + params.POW_TARGET_SPACING * 2:
+                    return nProofOfWorkLimit
+
+                # Otherwise the difficulty is that of the last block that
+                # wasn't mined under the special rule.
+                h = height - 1
+                nBits = nLastBits
+                while h > 0 and h % interval != 0 and nBits == nProofOfWorkLimit:
+                    h -= 1
+                    nBits = next(prev_time_bits)[1]
+                return nBits
+
+            return nLastBits
+
+        if params.POW_NO_RETARGETING:
+            return nLastBits
+
+        nFirstTime = next(self._iter_time_bits(height - interval, prev))[0]
+        return CalculateNextWorkRequired(nLastBits, nFirstTime, nLastTime, params)
+
+    def _check_header(self, header, height, prev, fCheckPoW, cur_time):
+        CheckBlockHeader(header, fCheckPoW=fCheckPoW, cur_time=cur_time, params=self.params)
+
+        nBits = self._get_next_work_required(height, header.nTime, prev)
+        if header.nBits != nBits:
+            raise HeaderChainError("HeaderChain.add_headers() : incorrect nBits 0x%08x at height %d; expected 0x%08x" %
+                                   (header.nBits, height, nBits))
+
+        if header.nTime <= self._get_median_time_past(height - 1, prev):
+            raise HeaderChainError("HeaderChain.add_headers() : block timestamp too early at height %d" % height)
+
+    def _reorganize(self, tip):
+        # Make the side branch ending with tip part of the best chain. The
+        # disconnected headers become a side branch.
+        branch = []
+        while tip is not None:
+            branch.append(tip)
+            tip = self._side.get(tip.header.hashPrevBlock)
+        branch.reverse()
+
+        base = branch[0].height - 1
+        chainwork = branch[0].chainwork - GetBlockProof(branch[0].header.nBits)
+        disconnected_chainwork = chainwork
+        for height in range(base + 1, len(self)):
+            header = self[height]
+            disconnected_chainwork += GetBlockProof(header.nBits)
+            self._side[header.GetHash()] = _SideHeader(header, height, disconnected_chainwork)
+
+        self.store.truncate(base + 1)
+        self._chainwork = chainwork
+
+        for side_header in branch:
+            header = side_header.header
+            del self._side[header.GetHash()]
+            self._append(header._serialize_header(), header.nBits)
+
+    def _prune_side(self):
+        # Forget side branches with less work than the best chain had
+        # max_reorg_depth headers ago, along with the headers they share with
+        # no other branch.
+        if not self._side:
+            return
+
+        min_chainwork = self._get_chainwork(max(self.height - self.max_reorg_depth, 0))
+        keep = set()
+        for (hash, side_header) in self._side.items():
+            if side_header.chainwork < min_chainwork:
+                continue
+            while hash in self._side and hash not in keep:
+                keep.add(hash)
+                hash = self._side[hash].header.hashPrevBlock
+
+        if len(keep) < len(self._side):
+            self._side = dict((hash, side_header) for (hash, side_header) in self._side.items()
+                              if hash in keep)
+
+
+__all__ = (
+        'MEDIAN_TIME_SPAN',
+        'MAX_REORG_DEPTH',
+        'HeaderChainError',
+        'GetBlockProof',
+        'CalculateNextWorkRequired',
+        'HeaderStore',
+        'HeaderChain',
+)
@@ -15,12 +15,14 @@
 WARNING: This module does not mlock() secrets; your private keys may end up on
 disk in swap! Use with caution!
 """
+import collections
 import ctypes
 import ctypes.util
 import hashlib
+import os
 import sys
+import threading
 import bitcoin
-import bitcoin.signature
 
 _bchr = chr
 _bord = ord
@@ -52,6 +54,9 @@ _ssl.BN_add.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
 _ssl.BN_bin2bn.restype = ctypes.c_void_p
 _ssl.BN_bin2bn.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p]
 
+_ssl.BN_clear_free.restype = None
+_ssl.BN_clear_free.argtypes = [ctypes.c_void_p]
+
 _ssl.BN_cmp.restype = ctypes.c_int
 _ssl.BN_cmp.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 
@@ -61,6 +66,9 @@ _ssl.BN_copy.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 _ssl.BN_free.restype = None
 _ssl.BN_free.argtypes = [ctypes.c_void_p]
 
+_ssl.BN_is_bit_set.restype = ctypes.c_int
+_ssl.BN_is_bit_set.argtypes = [ctypes.c_void_p, ctypes.c_int]
+
 _ssl.BN_mod_inverse.restype = ctypes.c_void_p
 _ssl.BN_mod_inverse.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
 
@@ -99,6 +107,12 @@ _ssl.BN_CTX_new.errcheck = _check_res_void_p
 _ssl.BN_CTX_new.restype = ctypes.c_void_p
 _ssl.BN_CTX_new.argtypes = []
 
+_ssl.BN_CTX_end.restype = None
+_ssl.BN_CTX_end.argtypes = [ctypes.c_void_p]
+
+_ssl.BN_CTX_start.restype = None
+_ssl.BN_CTX_start.argtypes = [ctypes.c_void_p]
+
 _ssl.EC_GROUP_get_curve_GFp.restype = ctypes.c_int
 _ssl.EC_GROUP_get_curve_GFp.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
 
@@ -108,6 +122,10 @@ _ssl.EC_GROUP_get_degree.argtypes = [ctypes.c_void_p]
 _ssl.EC_GROUP_get_order.restype = ctypes.c_int
 _ssl.EC_GROUP_get_order.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
 
+_ssl.EC_GROUP_new_by_curve_name.errcheck = _check_res_void_p
+_ssl.EC_GROUP_new_by_curve_name.restype = ctypes.c_void_p
+_ssl.EC_GROUP_new_by_curve_name.argtypes = [ctypes.c_int]
+
 _ssl.EC_KEY_free.restype = None
 _ssl.EC_KEY_free.argtypes = [ctypes.c_void_p]
 
@@ -133,6 +151,9 @@ _ssl.EC_KEY_set_public_key.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 _ssl.EC_POINT_free.restype = None
 _ssl.EC_POINT_free.argtypes = [ctypes.c_void_p]
 
+_ssl.EC_POINT_get_affine_coordinates_GFp.restype = ctypes.c_int
+_ssl.EC_POINT_get_affine_coordinates_GFp.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+
 _ssl.EC_POINT_is_at_infinity.restype = ctypes.c_int
 _ssl.EC_POINT_is_at_infinity.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 
@@ -191,11 +212,122 @@ _NID_secp256k1 = 714 # from openssl/obj_mac.h
 # test that OpenSSL supports secp256k1
 _ssl.EC_KEY_new_by_curve_name(_NID_secp256k1)
 
+class _BNContext(object):
+    """A BN_CTX, freed along with the object"""
+
+    def __init__(self):
+        self.ctx = _ssl.BN_CTX_new()
+
+    def __del__(self):
+        if _ssl:
+            _ssl.BN_CTX_free(self.ctx)
+        self.ctx = None
+
+_bn_contexts = threading.local()
+
+def _get_bn_ctx():
+    """Return this thread's BN_CTX
+
+    BN_CTX isn't thread-safe, so rather than allocating one for every
+    operation each thread reuses its own. Bracket BN_CTX_get() calls with
+    BN_CTX_start() and BN_CTX_end().
+    """
+    try:
+        return _bn_contexts.bn_ctx.ctx
+    except AttributeError:
+        _bn_contexts.bn_ctx = _BNContext()
+        return _bn_contexts.bn_ctx.ctx
+
+# Curve constants, computed once; treat as read-only
+_ec_group = _ssl.EC_GROUP_new_by_curve_name(_NID_secp256k1)
+_ec_order = _ssl.BN_new()
+_ec_halforder = _ssl.BN_new()
+_ec_field = _ssl.BN_new()
+_ssl.EC_GROUP_get_order(_ec_group, _ec_order, _get_bn_ctx())
+_ssl.BN_rshift1(_ec_halforder, _ec_order)
+_ssl.EC_GROUP_get_curve_GFp(_ec_group, _ec_field, None, None, _get_bn_ctx())
+
 # From openssl/ecdsa.h
 class ECDSA_SIG_st(ctypes.Structure):
     _fields_ = [("r", ctypes.c_void_p),
                 ("s", ctypes.c_void_p)]
 
+# libsecp256k1 is optional; if it's installed it's used for signing and
+# verification instead of OpenSSL. See SelectBackend()
+_secp256k1 = None
+_secp256k1_has_recovery = False
+try:
+    _secp256k1 = ctypes.cdll.LoadLibrary(ctypes.util.find_library('secp256k1') or 'libsecp256k1')
+except OSError:
+    pass
+
+# From secp256k1.h
+_SECP256K1_CONTEXT_VERIFY = (1 << 0) | (1 << 8)
+_SECP256K1_CONTEXT_SIGN = (1 << 0) | (1 << 9)
+_SECP256K1_EC_COMPRESSED = (1 << 1) | (1 << 8)
+_SECP256K1_EC_UNCOMPRESSED = (1 << 1)
+
+if _secp256k1 is not None:
+    try:
+        _secp256k1.secp256k1_context_create.restype = ctypes.c_void_p
+        _secp256k1.secp256k1_context_create.argtypes = [ctypes.c_uint]
+
+        _secp256k1.secp256k1_context_randomize.restype = ctypes.c_int
+        _secp256k1.secp256k1_context_randomize.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+
+        _secp256k1.secp256k1_ec_pubkey_create.restype = ctypes.c_int
+        _secp256k1.secp256k1_ec_pubkey_create.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+
+        _secp256k1.secp256k1_ec_pubkey_parse.restype = ctypes.c_int
+        _secp256k1.secp256k1_ec_pubkey_parse.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t]
+
+        _secp256k1.secp256k1_ec_pubkey_serialize.restype = ctypes.c_int
+        _secp256k1.secp256k1_ec_pubkey_serialize.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_size_t), ctypes.c_char_p, ctypes.c_uint]
+
+        _secp256k1.secp256k1_ec_seckey_verify.restype = ctypes.c_int
+        _secp256k1.secp256k1_ec_seckey_verify.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+
+        _secp256k1.secp256k1_ecdsa_sign.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_sign.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p]
+
+        _secp256k1.secp256k1_ecdsa_signature_normalize.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_signature_normalize.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+
+        _secp256k1.secp256k1_ecdsa_signature_parse_compact.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_signature_parse_compact.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+
+        _secp256k1.secp256k1_ecdsa_signature_serialize_der.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_signature_serialize_der.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_size_t), ctypes.c_char_p]
+
+        _secp256k1.secp256k1_ecdsa_verify.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_verify.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]
+
+        _secp256k1_ctx = _secp256k1.secp256k1_context_create(_SECP256K1_CONTEXT_SIGN | _SECP256K1_CONTEXT_VERIFY)
+        _secp256k1.secp256k1_context_randomize(_secp256k1_ctx, os.urandom(32))
+
+    except AttributeError:
+        # Too old to have the API we use
+        _secp256k1 = None
+
+if _secp256k1 is not None:
+    # Compact signatures need the optional recovery module
+    try:
+        _secp256k1.secp256k1_ecdsa_recover.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_recover.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]
+
+        _secp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+
+        _secp256k1.secp256k1_ecdsa_recoverable_signature_serialize_compact.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_recoverable_signature_serialize_compact.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_int), ctypes.c_char_p]
+
+        _secp256k1.secp256k1_ecdsa_sign_recoverable.restype = ctypes.c_int
+        _secp256k1.secp256k1_ecdsa_sign_recoverable.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p]
+
+        _secp256k1_has_recovery = True
+    except AttributeError:
+        pass
+
 class CECKey:
     """Wrapper around OpenSSL's EC_KEY"""
 
@@ -214,14 +346,14 @@ class CECKey:
         priv_key = _ssl.BN_bin2bn(secret, 32, _ssl.BN_new())
         group = _ssl.EC_KEY_get0_group(self.k)
         pub_key = _ssl.EC_POINT_new(group)
-        ctx = _ssl.BN_CTX_new()
-        if not _ssl.EC_POINT_mul(group, pub_key, priv_key, None, None, ctx):
-            raise ValueError("Could not derive public key from the supplied secret.")
-        _ssl.EC_POINT_mul(group, pub_key, priv_key, None, None, ctx)
-        _ssl.EC_KEY_set_private_key(self.k, priv_key)
-        _ssl.EC_KEY_set_public_key(self.k, pub_key)
-        _ssl.EC_POINT_free(pub_key)
-        _ssl.BN_CTX_free(ctx)
+        try:
+            if not _ssl.EC_POINT_mul(group, pub_key, priv_key, None, None, _get_bn_ctx()):
+                raise ValueError("Could not derive public key from the supplied secret.")
+            _ssl.EC_KEY_set_private_key(self.k, priv_key)
+            _ssl.EC_KEY_set_public_key(self.k, pub_key)
+        finally:
+            _ssl.EC_POINT_free(pub_key)
+            _ssl.BN_clear_free(priv_key)
         return self.k
 
     def set_privkey(self, key):
@@ -291,53 +423,65 @@ class CECKey:
         else:
             sig = self.signature_to_low_s(mb_sig.raw[:sig_size0.value])
 
-        sig = bitcoin.signature.DERSignature.deserialize(sig)
-
-        r_val = sig.r
-        s_val = sig.s
-
-        # assert that the r and s are less than 32 long, excluding leading 0s
-        assert len(r_val) <= 32 or r_val[0:-32] == b'\x00'
-        assert len(s_val) <= 32 or s_val[0:-32] == b'\x00'
+        # r and s, zero-padded to 32 bytes each
+        sig = _ParseDERSignatureLax(sig)
 
-        # ensure r and s are always 32 chars long by 0padding
-        r_val = ((b'\x00' * 32) + r_val)[-32:]
-        s_val = ((b'\x00' * 32) + s_val)[-32:]
+        return sig, self._get_recid(hash, sig)
 
-        # tmp pubkey of self, but always compressed
-        pubkey = CECKey()
-        pubkey.set_pubkey(self.get_pubkey())
-        pubkey.set_compressed(True)
+    def _get_recid(self, hash, sig): # pylint: disable=redefined-builtin
+        """Find the recovery id of a compact signature made with this key
 
-        # bitcoin core does <4, but I've seen other places do <2 and I've never seen a i > 1 so far
-        for i in range(0, 4):
-            cec_key = CECKey()
-            cec_key.set_compressed(True)
+        Rather than trying every recovery id until recover() returns our own
+        pubkey, the nonce point R = (e*G + r*Q)/s is computed directly. The
+        recovery id is the parity of R.y, plus 2 if R.x was reduced mod n to
+        get r.
+        """
+        group = _ssl.EC_KEY_get0_group(self.k)
+        pub_key = _ssl.EC_KEY_get0_public_key(self.k)
+        if not pub_key:
+            raise ValueError('Key has no public key')
 
-            result = cec_key.recover(r_val, s_val, hash, len(hash), i, 1)
-            if result == 1:
-                if cec_key.get_pubkey() == pubkey.get_pubkey():
-                    return r_val + s_val, i
+        ctx = _get_bn_ctx()
+        _ssl.BN_CTX_start(ctx)
+        R = None
+        try:
+            r = _ssl.BN_CTX_get(ctx)
+            s = _ssl.BN_CTX_get(ctx)
+            e = _ssl.BN_CTX_get(ctx)
+            _ssl.BN_bin2bn(sig[0:32], 32, r)
+            _ssl.BN_bin2bn(sig[32:64], 32, s)
+            _ssl.BN_bin2bn(hash, len(hash), e)
+
+            sinv = _ssl.BN_CTX_get(ctx)
+            u1 = _ssl.BN_CTX_get(ctx)
+            u2 = _ssl.BN_CTX_get(ctx)
+            if not _ssl.BN_mod_inverse(sinv, s, _ec_order, ctx):
+                raise ValueError('Invalid signature')
+            _ssl.BN_mod_mul(u1, e, sinv, _ec_order, ctx)
+            _ssl.BN_mod_mul(u2, r, sinv, _ec_order, ctx)
 
-        raise ValueError
+            R = _ssl.EC_POINT_new(group)
+            x = _ssl.BN_CTX_get(ctx)
+            y = _ssl.BN_CTX_get(ctx)
+            if not (_ssl.EC_POINT_mul(group, R, u1, pub_key, u2, ctx) and
+                    _ssl.EC_POINT_get_affine_coordinates_GFp(group, R, x, y, ctx)):
+                raise ValueError('Could not compute the nonce point')
+
+            recid = _ssl.BN_is_bit_set(y, 0)
+            if _ssl.BN_cmp(x, r) != 0:
+                recid |= 2
+            return recid
+        finally:
+            if R: _ssl.EC_POINT_free(R)
+            _ssl.BN_CTX_end(ctx)
 
     def signature_to_low_s(self, sig):
         der_sig = ECDSA_SIG_st()
         _ssl.d2i_ECDSA_SIG(ctypes.byref(ctypes.pointer(der_sig)), ctypes.byref(ctypes.c_char_p(sig)), len(sig))
-        group = _ssl.EC_KEY_get0_group(self.k)
-        order = _ssl.BN_new()
-        halforder = _ssl.BN_new()
-        ctx = _ssl.BN_CTX_new()
-        _ssl.EC_GROUP_get_order(group, order, ctx)
-        _ssl.BN_rshift1(halforder, order)
 
         # Verify that s is over half the order of the curve before we actually subtract anything from it
-        if _ssl.BN_cmp(der_sig.s, halforder) > 0:
-          _ssl.BN_sub(der_sig.s, order, der_sig.s)
-
-        _ssl.BN_free(halforder)
-        _ssl.BN_free(order)
-        _ssl.BN_CTX_free(ctx)
+        if _ssl.BN_cmp(der_sig.s, _ec_halforder) > 0:
+          _ssl.BN_sub(der_sig.s, _ec_order, der_sig.s)
 
         derlen = _ssl.i2d_ECDSA_SIG(ctypes.pointer(der_sig), 0)
         if derlen == 0:
@@ -355,18 +499,14 @@ class CECKey:
         if not sig:
           return False
 
-        # New versions of OpenSSL will reject non-canonical DER signatures. de/re-serialize first.
-        norm_sig = ctypes.c_void_p(0)
-        _ssl.d2i_ECDSA_SIG(ctypes.byref(norm_sig), ctypes.byref(ctypes.c_char_p(sig)), len(sig))
-
-        derlen = _ssl.i2d_ECDSA_SIG(norm_sig, 0)
-        if derlen == 0:
-            _ssl.ECDSA_SIG_free(norm_sig)
+        # New versions of OpenSSL reject non-canonical DER signatures, which
+        # were valid before BIP66. Parse leniently and re-encode as strict DER,
+        # so the same signatures are accepted as with libsecp256k1.
+        compact_sig = _ParseDERSignatureLax(sig)
+        if compact_sig is None:
             return False
-
-        norm_der = ctypes.create_string_buffer(derlen)
-        _ssl.i2d_ECDSA_SIG(norm_sig, ctypes.byref(ctypes.pointer(norm_der)))
-        _ssl.ECDSA_SIG_free(norm_sig)
+        norm_der = _EncodeDERSignature(compact_sig[0:32], compact_sig[32:64])
+        derlen = len(norm_der)
 
         # -1 = error, 0 = bad sig, 1 = good
         return _ssl.ECDSA_verify(0, hash, len(hash), norm_der, derlen, self.k) == 1
@@ -403,12 +543,9 @@ class CECKey:
             s = _ssl.BN_bin2bn(bytes(   sigS), len(sigS), _ssl.BN_new())
 
             group = _ssl.EC_KEY_get0_group(self.k)
-            ctx = _ssl.BN_CTX_new()
-            order = _ssl.BN_CTX_get(ctx)
-            ctx = _ssl.BN_CTX_new()
-
-            if not _ssl.EC_GROUP_get_order(group, order, ctx):
-                return -2
+            ctx = _get_bn_ctx()
+            _ssl.BN_CTX_start(ctx)
+            order = _ec_order
 
             x = _ssl.BN_CTX_get(ctx)
             if not _ssl.BN_copy(x, order):
@@ -418,11 +555,7 @@ class CECKey:
             if not _ssl.BN_add(x, x, r):
                 return -1
 
-            field = _ssl.BN_CTX_get(ctx)
-            if not _ssl.EC_GROUP_get_curve_GFp(group, field, None, None, ctx):
-                return -2
-
-            if _ssl.BN_cmp(x, field) >= 0:
+            if _ssl.BN_cmp(x, _ec_field) >= 0:
                 return 0
 
             R = _ssl.EC_POINT_new(group)
@@ -476,11 +609,402 @@ class CECKey:
         finally:
             if r: _ssl.BN_free(r)
             if s: _ssl.BN_free(s)
-            if ctx: _ssl.BN_CTX_free(ctx)
+            if ctx: _ssl.BN_CTX_end(ctx)
             if R: _ssl.EC_POINT_free(R)
             if O: _ssl.EC_POINT_free(O)
             if Q: _ssl.EC_POINT_free(Q)
 
+def _ParseDERSignatureLax(sig):
+    """Parse a DER signature as leniently as OpenSSL used to
+
+    A port of ecdsa_signature_parse_der_lax() from Bitcoin Core, which
+    accepts the non-DER signatures found in the blockchain before BIP66.
+
+    Returns r and s as 64 bytes, or None if the signature can't be parsed.
+    r or s too large to fit in 32 bytes are returned as zero, which no
+    signature verifies against.
+    """
+    sig = bytearray(sig)
+    siglen = len(sig)
+    pos = 0
+
+    def read_length(pos, skip_content):
+        if pos == siglen:
+            return (None, pos)
+        lenbyte = sig[pos]
+        pos += 1
+        if not lenbyte & 0x80:
+            return (lenbyte, pos)
+
+        lenbyte -= 0x80
+        if lenbyte > siglen - pos:
+            return (None, pos)
+        if skip_content:
+            # Sequence lengths aren't checked
+            return (0, pos + lenbyte)
+        while lenbyte > 0 and sig[pos] == 0:
+            pos += 1
+            lenbyte -= 1
+        if lenbyte >= 8:
+            return (None, pos)
+        length = 0
+        while lenbyte > 0:
+            length = (length << 8) + sig[pos]
+            pos += 1
+            lenbyte -= 1
+        return (length, pos)
+
+    # Sequence tag and length
+    if pos == siglen or sig[pos] != 0x30:
+        return None
+    (length, pos) = read_length(pos + 1, True)
+    if length is None:
+        return None
+
+    ints = []
+    for _ in range(2):
+        # Integer tag and length
+        if pos == siglen or sig[pos] != 0x02:
+            return None
+        (length, pos) = read_length(pos + 1, False)
+        if length is None or length > siglen - pos:
+            return None
+        ints.append(sig[pos:pos + length])
+        pos += length
+
+    r = b''
+    for n in ints:
+        n = bytes(n.lstrip(b'\x00'))
+        if len(n) > 32:
+            return b'\x00' * 64
+        r += b'\x00' * (32 - len(n)) + n
+    return r
+
+
+def _EncodeDERSignature(r, s):
+    """Encode big-endian r and s as a strict DER signature"""
+    def encode_int(n):
+        n = n.lstrip(b'\x00')
+        if not n or _bord(n[0]) & 0x80:
+            n = b'\x00' + n
+        return b'\x02' + bytes(bytearray([len(n)])) + n
+
+    r = encode_int(r) + encode_int(s)
+    return b'\x30' + bytes(bytearray([len(r)])) + r
+
+
+class _OpenSSLBackend(object):
+    """ECDSA implemented with OpenSSL, via CECKey"""
+
+    name = 'openssl'
+
+    def parse_pubkey(self, pubkey):
+        """Parse a serialized pubkey
+
+        Returns an object with a verify(hash, sig) method, or None if the
+        pubkey is invalid.
+        """
+        key = CECKey()
+        if key.set_pubkey(pubkey) is None:
+            return None
+        return key
+
+    def new_key(self, secret, compressed):
+        """Create a private key from a 32-byte secret
+
+        Returns an object with get_pubkey(), sign(hash) and sign_compact(hash)
+        methods.
+        """
+        key = CECKey()
+        key.set_secretbytes(secret)
+        key.set_compressed(compressed)
+        return key
+
+    def recover_compact(self, hash, sig, recid, compressed): # pylint: disable=redefined-builtin
+        """Recover the serialized pubkey from a 64 byte r+s signature
+
+        Returns None if recovery fails.
+        """
+        key = CECKey()
+        key.set_compressed(compressed)
+        if key.recover(sig[0:32], sig[32:64], hash, len(hash), recid, 0) < 1:
+            return None
+        return key.get_pubkey()
+
+
+class _Secp256k1PubKey(object):
+    """Parsed pubkey for the libsecp256k1 backend"""
+    __slots__ = ['_pubkey']
+
+    def __init__(self, pubkey):
+        self._pubkey = pubkey
+
+    def verify(self, hash, sig): # pylint: disable=redefined-builtin
+        """Verify a DER signature"""
+        if len(hash) != 32:
+            return False
+        compact_sig = _ParseDERSignatureLax(sig)
+        if compact_sig is None:
+            return False
+
+        parsed_sig = ctypes.create_string_buffer(64)
+        if not _secp256k1.secp256k1_ecdsa_signature_parse_compact(_secp256k1_ctx, parsed_sig, compact_sig):
+            return False
+
+        # libsecp256k1 only accepts low-S signatures; whether high-S are
+        # acceptable is up to the caller, as with OpenSSL.
+        _secp256k1.secp256k1_ecdsa_signature_normalize(_secp256k1_ctx, parsed_sig, parsed_sig)
+        return _secp256k1.secp256k1_ecdsa_verify(_secp256k1_ctx, parsed_sig, hash, self._pubkey) == 1
+
+
+class _Secp256k1Key(object):
+    """Private key for the libsecp256k1 backend"""
+    __slots__ = ['_secret', '_compressed']
+
+    def __init__(self, secret, compressed):
+        if len(secret) != 32 or not _secp256k1.secp256k1_ec_seckey_verify(_secp256k1_ctx, secret):
+            raise ValueError("Could not derive public key from the supplied secret.")
+        self._secret = secret
+        self._compressed = compressed
+
+    @property
+    def _cec_key(self):
+        return _openssl_backend.new_key(self._secret, self._compressed)
+
+    def get_pubkey(self):
+        pubkey = ctypes.create_string_buffer(64)
+        if not _secp256k1.secp256k1_ec_pubkey_create(_secp256k1_ctx, pubkey, self._secret):
+            raise ValueError("Could not derive public key from the supplied secret.")
+
+        size = ctypes.c_size_t(65)
+        mb = ctypes.create_string_buffer(size.value)
+        flags = _SECP256K1_EC_COMPRESSED if self._compressed else _SECP256K1_EC_UNCOMPRESSED
+        _secp256k1.secp256k1_ec_pubkey_serialize(_secp256k1_ctx, mb, ctypes.byref(size), pubkey, flags)
+        return mb.raw[:size.value]
+
+    def sign(self, hash): # pylint: disable=redefined-builtin
+        if not isinstance(hash, bytes):
+            raise TypeError('Hash must be bytes instance; got %r' % hash.__class__)
+        if len(hash) != 32:
+            raise ValueError('Hash must be exactly 32 bytes long')
+
+        # Signatures are always low-S, with RFC6979 nonces
+        sig = ctypes.create_string_buffer(64)
+        result = _secp256k1.secp256k1_ecdsa_sign(_secp256k1_ctx, sig, hash, self._secret, None, None)
+        assert 1 == result
+
+        size = ctypes.c_size_t(72)
+        mb_sig = ctypes.create_string_buffer(size.value)
+        _secp256k1.secp256k1_ecdsa_signature_serialize_der(_secp256k1_ctx, mb_sig, ctypes.byref(size), sig)
+        return mb_sig.raw[:size.value]
+
+    def sign_compact(self, hash): # pylint: disable=redefined-builtin
+        if not isinstance(hash, bytes):
+            raise TypeError('Hash must be bytes instance; got %r' % hash.__class__)
+        if len(hash) != 32:
+            raise ValueError('Hash must be exactly 32 bytes long')
+
+        if not _secp256k1_has_recovery:
+            return self._cec_key.sign_compact(hash)
+
+        sig = ctypes.create_string_buffer(65)
+        result = _secp256k1.secp256k1_ecdsa_sign_recoverable(_secp256k1_ctx, sig, hash, self._secret, None, None)
+        assert 1 == result
+
+        recid = ctypes.c_int()
+        mb_sig = ctypes.create_string_buffer(64)
+        _secp256k1.secp256k1_ecdsa_recoverable_signature_serialize_compact(_secp256k1_ctx, mb_sig, ctypes.byref(recid), sig)
+        return mb_sig.raw, recid.value
+
+
+class _Secp256k1Backend(object):
+    """ECDSA implemented with libsecp256k1"""
+
+    name = 'secp256k1'
+
+    def parse_pubkey(self, pubkey):
+        parsed = ctypes.create_string_buffer(64)
+        if not _secp256k1.secp256k1_ec_pubkey_parse(_secp256k1_ctx, parsed, pubkey, len(pubkey)):
+            return None
+        return _Secp256k1PubKey(parsed)
+
+    def new_key(self, secret, compressed):
+        return _Secp256k1Key(secret, compressed)
+
+    def recover_compact(self, hash, sig, recid, compressed): # pylint: disable=redefined-builtin
+        if not _secp256k1_has_recovery or len(hash) != 32:
+            return _openssl_backend.recover_compact(hash, sig, recid, compressed)
+
+        parsed_sig = ctypes.create_string_buffer(65)
+        if not _secp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact(_secp256k1_ctx, parsed_sig, sig, recid):
+            return None
+        pubkey = ctypes.create_string_buffer(64)
+        if not _secp256k1.secp256k1_ecdsa_recover(_secp256k1_ctx, pubkey, parsed_sig, hash):
+            return None
+
+        size = ctypes.c_size_t(65)
+        mb = ctypes.create_string_buffer(size.value)
+        flags = _SECP256K1_EC_COMPRESSED if compressed else _SECP256K1_EC_UNCOMPRESSED
+        _secp256k1.secp256k1_ec_pubkey_serialize(_secp256k1_ctx, mb, ctypes.byref(size), pubkey, flags)
+        return mb.raw[:size.value]
+
+
+_openssl_backend = _OpenSSLBackend()
+_backends = {'openssl': _openssl_backend}
+if _secp256k1 is not None:
+    _backends['secp256k1'] = _Secp256k1Backend()
+
+"""The ECDSA backend used by CPubKey and CKey
+
+libsecp256k1 if it's installed, otherwise OpenSSL. Don't set this directly,
+use SelectBackend() instead.
+"""
+backend = _backends.get('secp256k1', _openssl_backend)
+
+def SelectBackend(name):
+    """Select the ECDSA implementation to use
+
+    name is one of 'secp256k1' or 'openssl'
+
+    Keys already created keep using the backend they were created with.
+    Raises ValueError if the backend isn't available. CECKey always uses
+    OpenSSL.
+    """
+    global backend
+    try:
+        backend = _backends[name]
+    except KeyError:
+        if name == 'secp256k1':
+            raise ValueError('libsecp256k1 is not available')
+        raise ValueError('Unknown ECDSA backend %r' % name)
+
+
+class PubKeyCache(object):
+    """Cache of parsed public keys
+
+    Parsing a pubkey, especially decompressing a compressed one, costs about
+    as much as a signature verification. CPubKey looks pubkeys up here first,
+    so a pubkey seen over and over is only parsed once. Once max_size pubkeys
+    are stored the least recently used are evicted, and their parsed form is
+    freed once no CPubKey uses it anymore. Safe to share between threads.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def parse(self, pubkey, backend): # pylint: disable=redefined-outer-name
+        """Return backend.parse_pubkey(pubkey), from the cache if possible"""
+        key = (backend.name, bytes(pubkey))
+        with self._lock:
+            try:
+                parsed = self._entries[key] = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                return parsed
+
+        parsed = backend.parse_pubkey(pubkey)
+
+        with self._lock:
+            self._entries[key] = parsed
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return parsed
+
+    def clear(self):
+        """Remove all pubkeys and reset the hit and miss counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Consulted by every CPubKey created. Replace it to change the size, or set it
+# to None to disable caching.
+pubkey_cache = PubKeyCache()
+
+
+def _VerifyBatch(items, backend, stop_on_invalid): # pylint: disable=redefined-outer-name
+    """Verify a list of (pubkey, hash, sig), parsing each pubkey once"""
+    parsed = {}
+    results = []
+    for (pubkey, hash, sig) in items: # pylint: disable=redefined-builtin
+        try:
+            key = parsed[pubkey]
+        except KeyError:
+            key = parsed[pubkey] = backend.parse_pubkey(pubkey)
+        ok = key is not None and key.verify(hash, sig)
+        results.append(ok)
+        if stop_on_invalid and not ok:
+            break
+    return results
+
+_VERIFY_BATCH_CHUNK_SIZE = 64
+
+def verify_batch(items, all_valid=False, workers=None, executor=None):
+    """Verify many DER signatures at once
+
+    items     - Iterable of (pubkey, hash, sig) tuples, with pubkey serialized
+
+    all_valid - Return True if every signature is valid, otherwise False,
+                stopping at the first invalid signature found.
+
+    workers   - Verify in a thread pool of this many workers, created for the
+                call. Both backends release the GIL while verifying.
+
+    executor  - Alternatively an existing concurrent.futures.Executor. Items
+                are sent to it in chunks.
+
+    Each distinct pubkey is parsed once per chunk, or once overall without
+    workers. Returns a list with a bool for every item unless all_valid is
+    set.
+    """
+    items = [(bytes(pubkey), hash, sig) for (pubkey, hash, sig) in items]
+
+    shutdown = False
+    if executor is None and workers is not None and workers > 1:
+        import concurrent.futures
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        shutdown = True
+
+    try:
+        if executor is None:
+            results = _VerifyBatch(items, backend, all_valid)
+
+        else:
+            futures = [executor.submit(_VerifyBatch, items[i:i + _VERIFY_BATCH_CHUNK_SIZE], backend, all_valid)
+                       for i in range(0, len(items), _VERIFY_BATCH_CHUNK_SIZE)]
+            results = []
+            try:
+                for future in futures:
+                    results.extend(future.result())
+                    if all_valid and not all(results):
+                        break
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        if shutdown:
+            executor.shutdown()
+
+    if all_valid:
+        return all(results)
+    return results
+
+
+# Serialized pubkey length for each prefix byte. Hybrid 0x06/0x07 encodings
+# are accepted, as by Bitcoin Core. A lone 0x00, the point at infinity, has
+# always been fully valid here because OpenSSL accepts it; nothing verifies
+# against it.
+_PUBKEY_SIZES = {0x00: 1, 0x02: 33, 0x03: 33, 0x04: 65, 0x06: 65, 0x07: 65}
+
 class CPubKey(bytes):
     """An encapsulated public key
 
@@ -493,12 +1017,24 @@ class CPubKey(bytes):
     is_compressed - Corresponds to CPubKey.IsCompressed()
     """
 
-    def __new__(cls, buf, _cec_key=None):
+    def __new__(cls, buf):
         self = super(CPubKey, cls).__new__(cls, buf)
-        if _cec_key is None:
-            _cec_key = CECKey()
-        self._cec_key = _cec_key
-        self.is_fullyvalid = _cec_key.set_pubkey(self) is not None
+
+        # Decide the encoding rules here rather than leaving them to the
+        # backend, so validity doesn't depend on which one is in use.
+        if not self or _PUBKEY_SIZES.get(_bord(self[0])) != len(self):
+            self._key = None
+            self.is_fullyvalid = False
+        elif len(self) == 1:
+            self._key = None
+            self.is_fullyvalid = True
+        else:
+            cache = pubkey_cache
+            if cache is None:
+                self._key = backend.parse_pubkey(self)
+            else:
+                self._key = cache.parse(self, backend)
+            self.is_fullyvalid = self._key is not None
         return self
 
     @classmethod
@@ -510,20 +1046,11 @@ class CPubKey(bytes):
         recid = (_bord(sig[0]) - 27) & 3
         compressed = (_bord(sig[0]) - 27) & 4 != 0
 
-        cec_key = CECKey()
-        cec_key.set_compressed(compressed)
-
-        sigR = sig[1:33]
-        sigS = sig[33:65]
-
-        result = cec_key.recover(sigR, sigS, hash, len(hash), recid, 0)
-
-        if result < 1:
+        pubkey = backend.recover_compact(hash, sig[1:65], recid, compressed)
+        if pubkey is None:
             return False
 
-        pubkey = cec_key.get_pubkey()
-
-        return CPubKey(pubkey, _cec_key=cec_key)
+        return CPubKey(pubkey)
 
     @property
     def is_valid(self):
@@ -533,8 +1060,22 @@ class CPubKey(bytes):
     def is_compressed(self):
         return len(self) == 33
 
+    @property
+    def _cec_key(self):
+        """A new OpenSSL CECKey for this pubkey
+
+        Kept for code written before the libsecp256k1 backend. The parsed key
+        used by verify() may be shared with other CPubKeys through
+        pubkey_cache, so it's never handed out for callers to modify.
+        """
+        cec_key = CECKey()
+        cec_key.set_pubkey(self)
+        return cec_key
+
     def verify(self, hash, sig): # pylint: disable=redefined-builtin
-        return self._cec_key.verify(hash, sig)
+        if self._key is None:
+            return False
+        return self._key.verify(hash, sig)
 
     def __str__(self):
         return repr(self)
@@ -549,5 +1090,8 @@ class CPubKey(bytes):
 
 __all__ = (
         'CECKey',
+        'SelectBackend',
+        'PubKeyCache',
+        'verify_batch',
         'CPubKey',
 )
@@ -25,7 +25,10 @@ if sys.version > '3':
     _bchr = lambda x: bytes([x])
     _bord = lambda x: x
 
+import collections
+import hashlib
 import struct
+import threading
 
 import bitcoin.core
 import bitcoin.core._bignum
@@ -502,6 +505,17 @@ class CScriptTruncatedPushDataError(CScriptInvalidError):
         self.data = data
         super(CScriptTruncatedPushDataError, self).__init__(msg)
 
+# Scripts parsed by CScript._parse(), oldest first. Only the scriptPubKey and
+# redeemScript templates that repeat are worth caching, so scripts longer than
+# _PARSED_SCRIPT_MAX_SIZE and push-only scripts, i.e. scriptSigs, are parsed
+# every time without touching the cache. That bounds it to a few MB.
+#
+# Lookups don't take the lock; entries are never modified once added.
+_parsed_scripts = collections.OrderedDict()
+_parsed_scripts_lock = threading.Lock()
+_PARSED_SCRIPTS_SIZE = 10000
+_PARSED_SCRIPT_MAX_SIZE = 256
+
 class CScript(bytes):
     """Serialized script
 
@@ -544,7 +558,7 @@ class CScript(bytes):
         raise NotImplementedError
 
     def __new__(cls, value=b''):
-        if isinstance(value, bytes) or isinstance(value, bytearray):
+        if isinstance(value, (bytes, bytearray, memoryview)):
             return super(CScript, cls).__new__(cls, value)
         else:
             def coerce_iterable(iterable):
@@ -554,62 +568,100 @@ class CScript(bytes):
             # returns a bytes instance even when subclassed.
             return super(CScript, cls).__new__(cls, b''.join(coerce_iterable(value)))
 
-    def raw_iter(self):
-        """Raw iteration
+    def _parse(self):
+        """Parse the script into a tuple of raw_iter() tuples
 
-        Yields tuples of (opcode, data, sop_idx) so that the different possible
-        PUSHDATA encodings can be accurately distinguished, as well as
-        determining the exact opcode byte indexes. (sop_idx)
+        Returns (ops, err): ops are the (opcode, data, sop_idx) tuples up to
+        the first invalid pushdata, and err is None, or the (class, args) of
+        the CScriptInvalidError to raise after them. Parsing stops at the
+        error, so consumers see exactly what raw_iter() would have yielded
+        before raising.
+
+        Short scripts that aren't push-only are cached by script bytes, so
+        scripts that repeat, such as common scriptPubKey templates, are only
+        parsed once.
         """
+        cacheable = len(self) <= _PARSED_SCRIPT_MAX_SIZE
+        if cacheable:
+            r = _parsed_scripts.get(self)
+            if r is not None:
+                return r
+
+        ops = []
+        err = None
         i = 0
-        while i < len(self):
+        n = len(self)
+        while i < n:
             sop_idx = i
             opcode = _bord(self[i])
             i += 1
 
             if opcode > OP_PUSHDATA4:
-                yield (opcode, None, sop_idx)
-            else:
-                datasize = None
-                pushdata_type = None
-                if opcode < OP_PUSHDATA1:
-                    pushdata_type = 'PUSHDATA(%d)' % opcode
-                    datasize = opcode
-
-                elif opcode == OP_PUSHDATA1:
-                    pushdata_type = 'PUSHDATA1'
-                    if i >= len(self):
-                        raise CScriptInvalidError('PUSHDATA1: missing data length')
-                    datasize = _bord(self[i])
-                    i += 1
-
-                elif opcode == OP_PUSHDATA2:
-                    pushdata_type = 'PUSHDATA2'
-                    if i + 1 >= len(self):
-                        raise CScriptInvalidError('PUSHDATA2: missing data length')
-                    datasize = _bord(self[i]) + (_bord(self[i+1]) << 8)
-                    i += 2
-
-                elif opcode == OP_PUSHDATA4:
-                    pushdata_type = 'PUSHDATA4'
-                    if i + 3 >= len(self):
-                        raise CScriptInvalidError('PUSHDATA4: missing data length')
-                    datasize = _bord(self[i]) + (_bord(self[i+1]) << 8) + (_bord(self[i+2]) << 16) + (_bord(self[i+3]) << 24)
-                    i += 4
+                ops.append((opcode, None, sop_idx))
+                continue
+
+            if opcode < OP_PUSHDATA1:
+                pushdata_type = 'PUSHDATA(%d)' % opcode
+                datasize = opcode
+
+            elif opcode == OP_PUSHDATA1:
+                pushdata_type = 'PUSHDATA1'
+                if i >= n:
+                    err = (CScriptInvalidError, ('PUSHDATA1: missing data length',))
+                    break
+                datasize = _bord(self[i])
+                i += 1
+
+            elif opcode == OP_PUSHDATA2:
+                pushdata_type = 'PUSHDATA2'
+                if i + 1 >= n:
+                    err = (CScriptInvalidError, ('PUSHDATA2: missing data length',))
+                    break
+                datasize = _bord(self[i]) + (_bord(self[i+1]) << 8)
+                i += 2
 
-                else:
-                    assert False # shouldn't happen
+            else:
+                pushdata_type = 'PUSHDATA4'
+                if i + 3 >= n:
+                    err = (CScriptInvalidError, ('PUSHDATA4: missing data length',))
+                    break
+                datasize = _bord(self[i]) + (_bord(self[i+1]) << 8) + (_bord(self[i+2]) << 16) + (_bord(self[i+3]) << 24)
+                i += 4
+
+            data = bytes(self[i:i+datasize])
+
+            # Check for truncation
+            if len(data) < datasize:
+                err = (CScriptTruncatedPushDataError, ('%s: truncated data' % pushdata_type, data))
+                break
 
+            i += datasize
 
-                data = bytes(self[i:i+datasize])
+            ops.append((opcode, data, sop_idx))
 
-                # Check for truncation
-                if len(data) < datasize:
-                    raise CScriptTruncatedPushDataError('%s: truncated data' % pushdata_type, data)
+        r = (tuple(ops), err)
+        if cacheable:
+            for op in ops:
+                if op[0] > OP_16:
+                    with _parsed_scripts_lock:
+                        _parsed_scripts[self] = r
+                        if len(_parsed_scripts) > _PARSED_SCRIPTS_SIZE:
+                            _parsed_scripts.popitem(last=False)
+                    break
+        return r
 
-                i += datasize
+    def raw_iter(self):
+        """Raw iteration
 
-                yield (opcode, data, sop_idx)
+        Yields tuples of (opcode, data, sop_idx) so that the different possible
+        PUSHDATA encodings can be accurately distinguished, as well as
+        determining the exact opcode byte indexes. (sop_idx)
+        """
+        (ops, err) = self._parse()
+        for op in ops:
+            yield op
+        if err is not None:
+            raise err[0](*err[1])
 
     def __iter__(self):
         """'Cooked' iteration
@@ -672,6 +724,73 @@ class CScript(bytes):
                 _bord(self[1]) == 0x14 and
                 _bord(self[22]) == OP_EQUAL)
 
+    def classify(self):
+        """Classify a scriptPubKey by standard template
+
+        Returns (type, payload) where type is one of the TX_* constants:
+
+        TX_PUBKEYHASH - payload is the 20-byte pubkey hash
+        TX_SCRIPTHASH - payload is the 20-byte script hash
+        TX_PUBKEY     - payload is the 33 or 65 byte pubkey
+        TX_MULTISIG   - payload is (m, [pubkey, ...])
+        TX_NULL_DATA  - payload is a tuple of what follows OP_RETURN, as iter()
+                        would return it; the script must be push-only
+        TX_NONSTANDARD - payload is None
+
+        Only canonical, minimal encodings of the templates are recognized.
+        Apart from the push-only check of TX_NULL_DATA scripts with more than
+        one push, this is done with fixed-offset byte checks.
+        """
+        n = len(self)
+        if n == 0:
+            return (TX_NONSTANDARD, None)
+        first = _bord(self[0])
+        last = _bord(self[-1])
+
+        if (n == 25 and first == OP_DUP and last == OP_CHECKSIG
+                and _bord(self[1]) == OP_HASH160
+                and _bord(self[2]) == 0x14
+                and _bord(self[23]) == OP_EQUALVERIFY):
+            return (TX_PUBKEYHASH, bytes(self[3:23]))
+
+        elif self.is_p2sh():
+            return (TX_SCRIPTHASH, bytes(self[2:22]))
+
+        elif (last == OP_CHECKSIG and first in (33, 65) and n == first + 2
+                and _PUBKEY_PREFIX_SIZES.get(_bord(self[1])) == first):
+            return (TX_PUBKEY, bytes(self[1:-1]))
+
+        elif last == OP_CHECKMULTISIG and OP_1 <= first <= OP_16 and n >= 37:
+            pubkeys = []
+            i = 1
+            while i < n - 2:
+                size = _bord(self[i])
+                if (size not in (33, 65) or i + 1 + size > n - 2
+                        or _PUBKEY_PREFIX_SIZES.get(_bord(self[i+1])) != size
+                        or len(pubkeys) == 16):
+                    return (TX_NONSTANDARD, None)
+                pubkeys.append(bytes(self[i+1:i+1+size]))
+                i += 1 + size
+
+            m = first - (OP_1 - 1)
+            if (i == n - 2
+                    and _bord(self[-2]) == OP_1 - 1 + len(pubkeys)
+                    and m <= len(pubkeys)):
+                return (TX_MULTISIG, (m, pubkeys))
+
+        elif first == OP_RETURN:
+            # The common case of a single push of less than 76 bytes
+            if n >= 2 and _bord(self[1]) < OP_PUSHDATA1 and n == _bord(self[1]) + 2:
+                if n == 2:
+                    return (TX_NULL_DATA, (0,))
+                return (TX_NULL_DATA, (bytes(self[2:]),))
+
+            rest = CScript(self[1:])
+            if rest.is_push_only():
+                return (TX_NULL_DATA, tuple(rest))
+
+        return (TX_NONSTANDARD, None)
+
     def is_push_only(self):
         """Test if the script only contains pushdata ops
 
@@ -680,44 +799,42 @@ class CScript(bytes):
         Scripts that contain invalid pushdata ops return False, matching the
         behavior in Bitcoin Core.
         """
-        try:
-            for (op, op_data, idx) in self.raw_iter():
-                # Note how OP_RESERVED is considered a pushdata op.
-                if op > OP_16:
-                    return False
-
-        except CScriptInvalidError:
-            return False
-        return True
+        (ops, err) = self._parse()
+        for (op, op_data, idx) in ops:
+            # Note how OP_RESERVED is considered a pushdata op.
+            if op > OP_16:
+                return False
+        return err is None
 
     def has_canonical_pushes(self):
         """Test if script only uses canonical pushes
 
         Not yet consensus critical; may be in the future.
         """
-        try:
-            for (op, data, idx) in self.raw_iter():
-                if op > OP_16:
-                    continue
+        (ops, err) = self._parse()
+        if err is not None: # Invalid pushdata
+            return False
 
-                elif op < OP_PUSHDATA1 and op > OP_0 and len(data) == 1 and _bord(data[0]) <= 16:
-                    # Could have used an OP_n code, rather than a 1-byte push.
-                    return False
+        for (op, data, idx) in ops:
+            if op > OP_16:
+                continue
 
-                elif op == OP_PUSHDATA1 and len(data) < OP_PUSHDATA1:
-                    # Could have used a normal n-byte push, rather than OP_PUSHDATA1.
-                    return False
+            elif op < OP_PUSHDATA1 and op > OP_0 and len(data) == 1 and _bord(data[0]) <= 16:
+                # Could have used an OP_n code, rather than a 1-byte push.
+                return False
 
-                elif op == OP_PUSHDATA2 and len(data) <= 0xFF:
-                    # Could have used a OP_PUSHDATA1.
-                    return False
+            elif op == OP_PUSHDATA1 and len(data) < OP_PUSHDATA1:
+                # Could have used a normal n-byte push, rather than OP_PUSHDATA1.
+                return False
 
-                elif op == OP_PUSHDATA4 and len(data) <= 0xFFFF:
-                    # Could have used a OP_PUSHDATA2.
-                    return False
+            elif op == OP_PUSHDATA2 and len(data) <= 0xFF:
+                # Could have used a OP_PUSHDATA1.
+                return False
+
+            elif op == OP_PUSHDATA4 and len(data) <= 0xFFFF:
+                # Could have used a OP_PUSHDATA2.
+                return False
 
-        except CScriptInvalidError: # Invalid pushdata
-            return False
         return True
 
     def is_unspendable(self):
@@ -731,11 +848,7 @@ class CScript(bytes):
         The script is valid if all PUSHDATA's are valid; invalid opcodes do not
         make is_valid() return False.
         """
-        try:
-            list(self)
-        except CScriptInvalidError:
-            return False
-        return True
+        return self._parse()[1] is None
 
     def to_p2sh_scriptPubKey(self, checksize=True):
         """Create P2SH scriptPubKey from this redeemScript
@@ -760,20 +873,34 @@ class CScript(bytes):
 
         Note that this is consensus-critical.
         """
+        (ops, err) = self._parse()
         n = 0
         lastOpcode = OP_INVALIDOPCODE
-        for (opcode, data, sop_idx) in self.raw_iter():
+        for (opcode, data, sop_idx) in ops:
             if opcode in (OP_CHECKSIG, OP_CHECKSIGVERIFY):
                 n += 1
             elif opcode in (OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY):
                 if fAccurate and (OP_1 <= lastOpcode <= OP_16):
-                    n += opcode.decode_op_n()
+                    n += CScriptOp(lastOpcode).decode_op_n()
                 else:
                     n += 20
             lastOpcode = opcode
+        if err is not None:
+            raise err[0](*err[1])
         return n
 
 
+# Standard scriptPubKey types returned by CScript.classify()
+TX_NONSTANDARD = 'nonstandard'
+TX_PUBKEY = 'pubkey'
+TX_PUBKEYHASH = 'pubkeyhash'
+TX_SCRIPTHASH = 'scripthash'
+TX_MULTISIG = 'multisig'
+TX_NULL_DATA = 'nulldata'
+
+# Serialized size of a standard pubkey, by prefix byte
+_PUBKEY_PREFIX_SIZES = {0x02: 33, 0x03: 33, 0x04: 65}
+
 SIGHASH_ALL = 1
 SIGHASH_NONE = 2
 SIGHASH_SINGLE = 3
@@ -781,20 +908,21 @@ SIGHASH_ANYONECANPAY = 0x80
 
 def FindAndDelete(script, sig):
     """Consensus critical, see FindAndDelete() in Satoshi codebase"""
-    r = b''
-    last_sop_idx = sop_idx = 0
-    skip = True
-    for (opcode, data, sop_idx) in script.raw_iter():
-        if not skip:
-            r += script[last_sop_idx:sop_idx]
-        last_sop_idx = sop_idx
-        if script[sop_idx:sop_idx + len(sig)] == sig:
-            skip = True
-        else:
-            skip = False
-    if not skip:
-        r += script[last_sop_idx:]
-    return CScript(r)
+    (ops, err) = script._parse()
+    if err is not None:
+        raise err[0](*err[1])
+
+    # Almost always there's nothing to delete
+    if sig not in script:
+        return script if isinstance(script, CScript) else CScript(script)
+
+    # Keep every opcode that doesn't start with sig
+    r = []
+    ends = [sop_idx for (opcode, data, sop_idx) in ops[1:]] + [len(script)]
+    for ((opcode, data, sop_idx), end) in zip(ops, ends):
+        if not script.startswith(sig, sop_idx):
+            r.append(script[sop_idx:end])
+    return CScript(b''.join(r))
 
 def IsLowDERSignature(sig):
     """
@@ -848,6 +976,8 @@ def CompareBigEndian(c1, c2):
     return 0
 
 
+_HASH_ONE = b'\x01' + b'\x00'*31
+
 def RawSignatureHash(script, txTo, inIdx, hashtype):
     """Consensus-correct SignatureHash
 
@@ -856,50 +986,70 @@ def RawSignatureHash(script, txTo, inIdx, hashtype):
 
     If you're just writing wallet software you probably want SignatureHash()
     instead.
-    """
-    HASH_ONE = b'\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
 
+    Use a SignatureHashContext instead when hashing many inputs of the same
+    transaction.
+    """
     if inIdx >= len(txTo.vin):
-        return (HASH_ONE, "inIdx %d out of range (%d)" % (inIdx, len(txTo.vin)))
-    txtmp = bitcoin.core.CMutableTransaction.from_tx(txTo)
+        return (_HASH_ONE, "inIdx %d out of range (%d)" % (inIdx, len(txTo.vin)))
 
-    for txin in txtmp.vin:
-        txin.scriptSig = b''
-    txtmp.vin[inIdx].scriptSig = FindAndDelete(script, CScript([OP_CODESEPARATOR]))
+    base_hashtype = hashtype & 0x1f
+    if base_hashtype == SIGHASH_SINGLE and inIdx >= len(txTo.vout):
+        return (_HASH_ONE, "outIdx %d out of range (%d)" % (inIdx, len(txTo.vout)))
 
-    if (hashtype & 0x1f) == SIGHASH_NONE:
-        txtmp.vout = []
+    h = hashlib.sha256()
+    _stream_signature_hash_preimage(h, script, txTo, inIdx, hashtype)
+    return (hashlib.sha256(h.digest()).digest(), None)
 
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
 
-    elif (hashtype & 0x1f) == SIGHASH_SINGLE:
-        outIdx = inIdx
-        if outIdx >= len(txtmp.vout):
-            return (HASH_ONE, "outIdx %d out of range (%d)" % (outIdx, len(txtmp.vout)))
+def _stream_signature_hash_preimage(h, script, txTo, inIdx, hashtype):
+    """Feed the data a signature hash commits to into hash object h
 
-        tmp = txtmp.vout[outIdx]
-        txtmp.vout = []
-        for i in range(outIdx):
-            txtmp.vout.append(bitcoin.core.CTxOut())
-        txtmp.vout.append(tmp)
+    Equivalent to serializing a copy of txTo with the scriptSigs, nSequences
+    and outputs modified according to hashtype, followed by hashtype, but
+    writes the fields of txTo directly. inIdx must be valid, and with
+    SIGHASH_SINGLE there must be a matching output.
+    """
+    update = h.update
+    base_hashtype = hashtype & 0x1f
+    zero_other_nSequence = base_hashtype in (SIGHASH_NONE, SIGHASH_SINGLE)
 
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
+    update(struct.pack(b"<i", txTo.nVersion))
 
     if hashtype & SIGHASH_ANYONECANPAY:
-        tmp = txtmp.vin[inIdx]
-        txtmp.vin = []
-        txtmp.vin.append(tmp)
-
-    s = txtmp.serialize()
-    s += struct.pack(b"<I", hashtype)
-
-    hash = bitcoin.core.Hash(s)
-
-    return (hash, None)
+        update(b'\x01')
+        vin = ((inIdx, txTo.vin[inIdx]),)
+    else:
+        update(bitcoin.core.serialize.VarIntSerializer.serialize(len(txTo.vin)))
+        vin = enumerate(txTo.vin)
+
+    for (i, txin) in vin:
+        update(struct.pack(b"<32sI", txin.prevout.hash, txin.prevout.n))
+        if i == inIdx:
+            update(bitcoin.core.serialize.BytesSerializer.serialize(FindAndDelete(script, CScript([OP_CODESEPARATOR]))))
+            update(struct.pack(b"<I", txin.nSequence))
+        elif zero_other_nSequence:
+            update(b'\x00\x00\x00\x00\x00')
+        else:
+            update(b'\x00' + struct.pack(b"<I", txin.nSequence))
+
+    if base_hashtype == SIGHASH_NONE:
+        update(b'\x00')
+    elif base_hashtype == SIGHASH_SINGLE:
+        # Every output before the one being signed is replaced by a null
+        # CTxOut: nValue of -1 and an empty scriptPubKey.
+        update(bitcoin.core.serialize.VarIntSerializer.serialize(inIdx + 1))
+        update(b'\xff\xff\xff\xff\xff\xff\xff\xff\x00' * inIdx)
+        txout = txTo.vout[inIdx]
+        update(struct.pack(b"<q", txout.nValue))
+        update(bitcoin.core.serialize.BytesSerializer.serialize(txout.scriptPubKey))
+    else:
+        update(bitcoin.core.serialize.VarIntSerializer.serialize(len(txTo.vout)))
+        for txout in txTo.vout:
+            update(struct.pack(b"<q", txout.nValue))
+            update(bitcoin.core.serialize.BytesSerializer.serialize(txout.scriptPubKey))
+
+    update(struct.pack(b"<II", txTo.nLockTime, hashtype))
 
 
 def SignatureHash(script, txTo, inIdx, hashtype):
@@ -915,6 +1065,141 @@ def SignatureHash(script, txTo, inIdx, hashtype):
     return h
 
 
+class SignatureHashContext(object):
+    """Signature hashes for every input of a single transaction
+
+    The signature hash of each input covers nearly the whole transaction, so
+    calculating them one by one is quadratic for transactions with many
+    inputs. A context serializes the parts of the transaction that are
+    shared between inputs once, splicing only the per-input script in, and
+    remembers the last few hashes it has calculated.
+
+    Other than the scriptSigs, which signature hashes don't cover, the
+    transaction must not be modified while the context is in use.
+    """
+    __slots__ = ['txTo', '_prefix_len', '_blanks', '_all', '_midstates', '_zero_seq_blanks', '_results']
+
+    # Serialized size of a txin with an empty scriptSig
+    _BLANK_TXIN_SIZE = 36 + 1 + 4
+
+    # Hashes remembered, enough for CHECKMULTISIG trying one signature
+    # against every key
+    _MAX_RESULTS = 32
+
+    def __init__(self, txTo):
+        self.txTo = txTo
+
+        header = struct.pack(b"<i", txTo.nVersion)
+        header += bitcoin.core.serialize.VarIntSerializer.serialize(len(txTo.vin))
+        self._prefix_len = len(header)
+
+        self._blanks = b''.join(txin.prevout.serialize() + b'\x00' + struct.pack(b"<I", txin.nSequence)
+                                for txin in txTo.vin)
+
+        self._all = (header + self._blanks +
+                     bitcoin.core.serialize.VarIntSerializer.serialize(len(txTo.vout)) +
+                     b''.join(txout.serialize() for txout in txTo.vout) +
+                     struct.pack(b"<I", txTo.nLockTime))
+
+        self._midstates = None
+        self._zero_seq_blanks = None
+        self._results = {}
+
+    def _get_midstate(self, inIdx):
+        """Hash state after everything preceding input inIdx in the SIGHASH_ALL preimage"""
+        if self._midstates is None:
+            view = memoryview(self._all)
+            h = hashlib.sha256(view[:self._prefix_len])
+            midstates = []
+            for start in range(self._prefix_len, self._prefix_len + len(self._blanks), self._BLANK_TXIN_SIZE):
+                midstates.append(h.copy())
+                h.update(view[start:start + self._BLANK_TXIN_SIZE])
+            self._midstates = midstates
+        return self._midstates[inIdx].copy()
+
+    def _calc(self, script, inIdx, hashtype):
+        txTo = self.txTo
+        base_hashtype = hashtype & 0x1f
+
+        if base_hashtype == SIGHASH_SINGLE and inIdx >= len(txTo.vout):
+            return (_HASH_ONE, "outIdx %d out of range (%d)" % (inIdx, len(txTo.vout)))
+
+        start = inIdx * self._BLANK_TXIN_SIZE
+        end = start + self._BLANK_TXIN_SIZE
+        txin = (self._blanks[start:start + 36] +
+                bitcoin.core.serialize.BytesSerializer.serialize(FindAndDelete(script, CScript([OP_CODESEPARATOR]))) +
+                self._blanks[end - 4:end])
+        suffix = struct.pack(b"<I", hashtype)
+
+        if base_hashtype == SIGHASH_NONE:
+            vout = b'\x00'
+        elif base_hashtype == SIGHASH_SINGLE:
+            vout = (bitcoin.core.serialize.VarIntSerializer.serialize(inIdx + 1) +
+                    bitcoin.core.CTxOut().serialize() * inIdx +
+                    txTo.vout[inIdx].serialize())
+        else:
+            vout = None
+
+        if hashtype & SIGHASH_ANYONECANPAY:
+            if vout is None:
+                vout = self._all[self._prefix_len + len(self._blanks):-4]
+            h = hashlib.sha256(self._all[:4] + b'\x01' + txin + vout + self._all[-4:] + suffix)
+
+        elif vout is None:
+            # SIGHASH_ALL, the common case: everything but the input being
+            # signed is shared with the other inputs.
+            h = self._get_midstate(inIdx)
+            h.update(txin)
+            h.update(memoryview(self._all)[self._prefix_len + end:])
+            h.update(suffix)
+
+        else:
+            # SIGHASH_NONE and SIGHASH_SINGLE zero the nSequence of the other
+            # inputs.
+            if self._zero_seq_blanks is None:
+                self._zero_seq_blanks = b''.join(txin.prevout.serialize() + b'\x00\x00\x00\x00\x00'
+                                                 for txin in txTo.vin)
+            blanks = memoryview(self._zero_seq_blanks)
+            h = hashlib.sha256(self._all[:self._prefix_len])
+            h.update(blanks[:start])
+            h.update(txin)
+            h.update(blanks[end:])
+            h.update(vout)
+            h.update(self._all[-4:] + suffix)
+
+        return (hashlib.sha256(h.digest()).digest(), None)
+
+    def RawSignatureHash(self, script, inIdx, hashtype):
+        """Consensus-correct signature hash of input inIdx
+
+        Same as RawSignatureHash(script, self.txTo, inIdx, hashtype)
+        """
+        key = (script, inIdx, hashtype)
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+
+        if inIdx >= len(self.txTo.vin):
+            r = (_HASH_ONE, "inIdx %d out of range (%d)" % (inIdx, len(self.txTo.vin)))
+        else:
+            r = self._calc(script, inIdx, hashtype)
+        if len(self._results) >= self._MAX_RESULTS:
+            self._results.clear()
+        self._results[key] = r
+        return r
+
+    def SignatureHash(self, script, inIdx, hashtype):
+        """Calculate the signature hash of input inIdx
+
+        Same as SignatureHash(script, self.txTo, inIdx, hashtype)
+        """
+        (h, err) = self.RawSignatureHash(script, inIdx, hashtype)
+        if err is not None:
+            raise ValueError(err)
+        return h
+
+
 __all__ = (
         'MAX_SCRIPT_SIZE',
         'MAX_SCRIPT_ELEMENT_SIZE',
@@ -1048,6 +1333,12 @@ __all__ = (
         'CScriptInvalidError',
         'CScriptTruncatedPushDataError',
         'CScript',
+        'TX_NONSTANDARD',
+        'TX_PUBKEY',
+        'TX_PUBKEYHASH',
+        'TX_SCRIPTHASH',
+        'TX_MULTISIG',
+        'TX_NULL_DATA',
         'SIGHASH_ALL',
         'SIGHASH_NONE',
         'SIGHASH_SINGLE',
@@ -1055,5 +1346,6 @@ __all__ = (
         'FindAndDelete',
         'RawSignatureHash',
         'SignatureHash',
+        'SignatureHashContext',
         'IsLowDERSignature',
 )
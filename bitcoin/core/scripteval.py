@@ -24,7 +24,10 @@ if sys.version > '3':
     long = int
     _bord = lambda x: x
 
+import collections
 import hashlib
+import threading
+import timeit
 
 import bitcoin.core
 import bitcoin.core._bignum
@@ -38,16 +41,88 @@ from bitcoin.core.script import *
 MAX_NUM_SIZE = 4
 MAX_STACK_ITEMS = 1000
 
-SCRIPT_VERIFY_P2SH = object()
-SCRIPT_VERIFY_STRICTENC = object()
-SCRIPT_VERIFY_DERSIG = object()
-SCRIPT_VERIFY_LOW_S = object()
-SCRIPT_VERIFY_NULLDUMMY = object()
-SCRIPT_VERIFY_SIGPUSHONLY = object()
-SCRIPT_VERIFY_MINIMALDATA = object()
-SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS = object()
-SCRIPT_VERIFY_CLEANSTACK = object()
-SCRIPT_VERIFY_CHECKLOCKTIMEVERIFY = object()
+_int_new = int.__new__
+
+class ScriptVerifyFlags(int):
+    """A set of SCRIPT_VERIFY_* flags, as a bitmask
+
+    Constructed from an int, a comma-separated string of names, or any
+    iterable of flags and names from SCRIPT_VERIFY_FLAGS_BY_NAME, so existing
+    code passing a tuple or set of flags keeps working. Flags combine with
+    |, & and ^, which return ScriptVerifyFlags too, and "flag in flags" tests
+    for a flag in constant time.
+
+    Modeled after enum.IntFlag, which isn't available on Python 2.
+    """
+    __slots__ = []
+
+    def __new__(cls, flags=0):
+        if type(flags) is cls:
+            return flags
+
+        elif isinstance(flags, (int, long)):
+            return super(ScriptVerifyFlags, cls).__new__(cls, flags)
+
+        elif isinstance(flags, (str, type(''))):
+            flags = [name for name in flags.split(',') if name not in ('', 'NONE')]
+
+        r = 0
+        for flag in flags:
+            if not isinstance(flag, (int, long)):
+                try:
+                    flag = SCRIPT_VERIFY_FLAGS_BY_NAME[flag]
+                except KeyError:
+                    raise ValueError('Unknown script verify flag %r' % flag)
+            r |= flag
+        return super(ScriptVerifyFlags, cls).__new__(cls, r)
+
+    def __or__(self, other):
+        if not isinstance(other, (int, long)):
+            other = ScriptVerifyFlags(other)
+        return _int_new(ScriptVerifyFlags, int.__or__(self, other))
+    __ror__ = __or__
+
+    def __and__(self, other):
+        if not isinstance(other, (int, long)):
+            other = ScriptVerifyFlags(other)
+        return _int_new(ScriptVerifyFlags, int.__and__(self, other))
+    __rand__ = __and__
+
+    def __xor__(self, other):
+        if not isinstance(other, (int, long)):
+            other = ScriptVerifyFlags(other)
+        return _int_new(ScriptVerifyFlags, int.__xor__(self, other))
+    __rxor__ = __xor__
+
+    def __contains__(self, flag):
+        flag = ScriptVerifyFlags(flag)
+        return int(self) & flag == flag
+
+    def __iter__(self):
+        for (name, flag) in sorted(SCRIPT_VERIFY_FLAGS_BY_NAME.items(), key=lambda item: item[1]):
+            if self & flag:
+                yield flag
+
+    def __len__(self):
+        return sum(1 for flag in self)
+
+    def __str__(self):
+        return ','.join(_SCRIPT_VERIFY_NAMES_BY_FLAG[flag] for flag in self) or 'NONE'
+
+    def __repr__(self):
+        return 'ScriptVerifyFlags(%r)' % str(self)
+
+SCRIPT_VERIFY_NONE = ScriptVerifyFlags(0)
+SCRIPT_VERIFY_P2SH = ScriptVerifyFlags(1 << 0)
+SCRIPT_VERIFY_STRICTENC = ScriptVerifyFlags(1 << 1)
+SCRIPT_VERIFY_DERSIG = ScriptVerifyFlags(1 << 2)
+SCRIPT_VERIFY_LOW_S = ScriptVerifyFlags(1 << 3)
+SCRIPT_VERIFY_NULLDUMMY = ScriptVerifyFlags(1 << 4)
+SCRIPT_VERIFY_SIGPUSHONLY = ScriptVerifyFlags(1 << 5)
+SCRIPT_VERIFY_MINIMALDATA = ScriptVerifyFlags(1 << 6)
+SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS = ScriptVerifyFlags(1 << 7)
+SCRIPT_VERIFY_CLEANSTACK = ScriptVerifyFlags(1 << 8)
+SCRIPT_VERIFY_CHECKLOCKTIMEVERIFY = ScriptVerifyFlags(1 << 9)
 
 SCRIPT_VERIFY_FLAGS_BY_NAME = {
     'P2SH': SCRIPT_VERIFY_P2SH,
@@ -62,6 +137,22 @@ SCRIPT_VERIFY_FLAGS_BY_NAME = {
     'CHECKLOCKTIMEVERIFY': SCRIPT_VERIFY_CHECKLOCKTIMEVERIFY,
 }
 
+_SCRIPT_VERIFY_NAMES_BY_FLAG = dict((flag, name) for (name, flag) in SCRIPT_VERIFY_FLAGS_BY_NAME.items())
+
+# Flags every transaction in a block must satisfy, and the stricter set
+# transactions must satisfy to be relayed and mined, as in Bitcoin Core's
+# MANDATORY_SCRIPT_VERIFY_FLAGS and STANDARD_SCRIPT_VERIFY_FLAGS.
+MANDATORY_SCRIPT_VERIFY_FLAGS = SCRIPT_VERIFY_P2SH
+
+STANDARD_SCRIPT_VERIFY_FLAGS = (MANDATORY_SCRIPT_VERIFY_FLAGS |
+                                SCRIPT_VERIFY_DERSIG |
+                                SCRIPT_VERIFY_STRICTENC |
+                                SCRIPT_VERIFY_MINIMALDATA |
+                                SCRIPT_VERIFY_NULLDUMMY |
+                                SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS |
+                                SCRIPT_VERIFY_CLEANSTACK |
+                                SCRIPT_VERIFY_CHECKLOCKTIMEVERIFY)
+
 class EvalScriptError(bitcoin.core.ValidationError):
     """Base class for exceptions raised when a script fails during EvalScript()
 
@@ -131,10 +222,190 @@ def _CastToBool(s):
     return False
 
 
-def _CheckSig(sig, pubkey, script, txTo, inIdx, err_raiser):
-    key = bitcoin.core.key.CECKey()
-    key.set_pubkey(pubkey)
+class SignatureCache(object):
+    """Cache of valid signatures, as in Satoshi's sigcache.cpp
+
+    Remembers (sighash, pubkey, sig) triples that passed ECDSA verification
+    so that checking the same signature again, e.g. when a transaction first
+    seen in the mempool shows up in a block, is only a lookup. Only valid
+    signatures are cached, and once max_size entries are stored the least
+    recently used are evicted. Safe to share between threads.
+    """
+
+    def __init__(self, max_size=50000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def contains(self, sighash, pubkey, sig):
+        """Return True if the signature is in the cache"""
+        key = (sighash, pubkey, sig)
+        with self._lock:
+            try:
+                self._entries[key] = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, sighash, pubkey, sig):
+        """Add a valid signature to the cache"""
+        key = (sighash, pubkey, sig)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = True
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all signatures and reset the hit and miss counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Consulted by every signature check. Replace it to change the size, or set
+# it to None to disable caching.
+signature_cache = SignatureCache()
+
+
+_timer = timeit.default_timer
+
+class ScriptTracer(object):
+    """Receives events from script evaluation
+
+    Pass one as the tracer argument of EvalScript() or VerifyScript(). The
+    methods here do nothing, so subclasses only need to override the events
+    they are interested in. All times are in seconds. Without a tracer the
+    interpreter doesn't time anything.
+    """
+
+    def opcode(self, sop, sop_data, sop_pc, stack, altstack, elapsed):
+        """Called after every opcode, including pushes and opcodes skipped in
+        unexecuted IF branches; stack and altstack are as the opcode left
+        them
+        """
+
+    def sighash(self, elapsed):
+        """Called after every signature hash calculation"""
+
+    def checksig(self, elapsed, ok):
+        """Called after every signature verification, signature cache lookup
+        included
+        """
+
+    def script(self, scriptIn, elapsed):
+        """Called after every script evaluated, whether it failed or not"""
+
+
+def _OpcodeClass(sop):
+    # Sections as in Satoshi's script.h
+    if sop <= OP_16:
+        return 'push'
+    elif sop <= OP_RETURN:
+        return 'control'
+    elif sop <= OP_TUCK:
+        return 'stack'
+    elif sop <= OP_SIZE:
+        return 'splice'
+    elif sop <= OP_EQUALVERIFY:
+        return 'bitwise'
+    elif sop <= OP_WITHIN:
+        return 'numeric'
+    elif sop <= OP_CHECKMULTISIGVERIFY:
+        return 'crypto'
+    elif sop <= OP_NOP10:
+        return 'expansion'
+    else:
+        return 'invalid'
+
+class ScriptProfiler(ScriptTracer):
+    """ScriptTracer collecting execution statistics
+
+    opcode_counts   - Number of times each opcode was seen, by CScriptOp
+
+    opcode_times    - Total time spent in each class of opcode; classes are
+                      push, control, stack, splice, bitwise, numeric, crypto,
+                      expansion and invalid
+
+    max_stack_depth - Most items ever on the stack and altstack combined
+
+    sighash_count, sighash_time   - Signature hashes calculated
+
+    checksig_count, checksig_time - Signatures verified
+
+    script_count, script_time     - Scripts evaluated
+
+    slowest_script  - (elapsed, script) for the slowest script evaluated, or
+                      None
+
+    Not thread-safe; use one profiler per thread.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clear all statistics"""
+        self.opcode_counts = collections.defaultdict(int)
+        self.opcode_times = collections.defaultdict(float)
+        self.max_stack_depth = 0
+        self.sighash_count = 0
+        self.sighash_time = 0.0
+        self.checksig_count = 0
+        self.checksig_time = 0.0
+        self.script_count = 0
+        self.script_time = 0.0
+        self.slowest_script = None
+
+    def opcode(self, sop, sop_data, sop_pc, stack, altstack, elapsed):
+        self.opcode_counts[CScriptOp(sop)] += 1
+        self.opcode_times[_OpcodeClass(sop)] += elapsed
+        depth = len(stack) + len(altstack)
+        if depth > self.max_stack_depth:
+            self.max_stack_depth = depth
+
+    def sighash(self, elapsed):
+        self.sighash_count += 1
+        self.sighash_time += elapsed
+
+    def checksig(self, elapsed, ok):
+        self.checksig_count += 1
+        self.checksig_time += elapsed
+
+    def script(self, scriptIn, elapsed):
+        self.script_count += 1
+        self.script_time += elapsed
+        if self.slowest_script is None or elapsed > self.slowest_script[0]:
+            self.slowest_script = (elapsed, scriptIn)
+
+
+def _VerifySig(sighash, pubkey, sig):
+    cache = signature_cache
+    if cache is not None and cache.contains(sighash, pubkey, sig):
+        return True
+
+    if not bitcoin.core.key.CPubKey(pubkey).verify(sighash, sig):
+        return False
+
+    if cache is not None:
+        cache.add(sighash, pubkey, sig)
+    return True
+
+
+def _SignatureHash(script, txTo, inIdx, hashtype, sighash_context):
+    if sighash_context is None:
+        return RawSignatureHash(script, txTo, inIdx, hashtype)
+    return sighash_context.RawSignatureHash(script, inIdx, hashtype)
+
 
+def _CheckSig(sig, pubkey, script, txTo, inIdx, err_raiser, tracer=None, sighash_context=None):
     if len(sig) == 0:
         return False
     hashtype = _bord(sig[-1])
@@ -148,11 +419,22 @@ def _CheckSig(sig, pubkey, script, txTo, inIdx, err_raiser):
     # imply the scriptSig being checked doesn't correspond to a valid txout -
     # that should cause other validation machinery to fail long before we ever
     # got here.
-    (h, err) = RawSignatureHash(script, txTo, inIdx, hashtype)
-    return key.verify(h, sig)
+    if tracer is None:
+        (h, err) = _SignatureHash(script, txTo, inIdx, hashtype, sighash_context)
+        return _VerifySig(h, pubkey, sig)
 
+    start = _timer()
+    (h, err) = _SignatureHash(script, txTo, inIdx, hashtype, sighash_context)
+    tracer.sighash(_timer() - start)
 
-def _CheckMultiSig(opcode, script, stack, txTo, inIdx, flags, err_raiser, nOpCount):
+    start = _timer()
+    ok = _VerifySig(h, pubkey, sig)
+    tracer.checksig(_timer() - start, ok)
+    return ok
+
+
+def _CheckMultiSig(opcode, script, stack, txTo, inIdx, flags, err_raiser, nOpCount, tracer=None,
+                   sighash_context=None):
     i = 1
     if len(stack) < i:
         err_raiser(MissingOpArgumentsError, opcode, stack, i)
@@ -195,7 +477,7 @@ def _CheckMultiSig(opcode, script, stack, txTo, inIdx, flags, err_raiser, nOpCou
         sig = stack[-isig]
         pubkey = stack[-ikey]
 
-        if _CheckSig(sig, pubkey, script, txTo, inIdx, err_raiser):
+        if _CheckSig(sig, pubkey, script, txTo, inIdx, err_raiser, tracer, sighash_context):
             isig += 1
             sigs_count -= 1
 
@@ -215,7 +497,7 @@ def _CheckMultiSig(opcode, script, stack, txTo, inIdx, flags, err_raiser, nOpCou
 
     # Note how Bitcoin Core duplicates the len(stack) check, rather than
     # letting pop() handle it; maybe that's wrong?
-    if len(stack) and SCRIPT_VERIFY_NULLDUMMY in flags:
+    if len(stack) and flags & SCRIPT_VERIFY_NULLDUMMY:
         if stack[-1] != b'':
             raise err_raiser(ArgumentsInvalidError, opcode, "dummy value not OP_0")
 
@@ -230,142 +512,423 @@ def _CheckMultiSig(opcode, script, stack, txTo, inIdx, flags, err_raiser, nOpCou
             stack.append(b"\x00")
 
 
-# OP_2MUL and OP_2DIV are *not* included in this list as they are disabled
-_ISA_UNOP = {
-    OP_1ADD,
-    OP_1SUB,
-    OP_NEGATE,
-    OP_ABS,
-    OP_NOT,
-    OP_0NOTEQUAL,
-}
-
-def _UnaryOp(opcode, stack, err_raiser):
-    if len(stack) < 1:
-        err_raiser(MissingOpArgumentsError, opcode, stack, 1)
-    bn = _CastToBigNum(stack[-1], err_raiser)
-    stack.pop()
-
-    if opcode == OP_1ADD:
-        bn += 1
-
-    elif opcode == OP_1SUB:
-        bn -= 1
+class _EvalScriptState(object):
+    """Execution state shared by the opcode handlers of _EvalScript()"""
+    __slots__ = ['stack', 'altstack', 'vfExec', 'pbegincodehash', 'nOpCount',
+                 'scriptIn', 'txTo', 'inIdx', 'flags', 'tracer',
+                 'sighash_context', 'sop', 'sop_data', 'sop_pc']
 
-    elif opcode == OP_NEGATE:
-        bn = -bn
+    def __init__(self, stack, scriptIn, txTo, inIdx, flags, tracer=None,
+                 sighash_context=None):
+        self.stack = stack
+        self.altstack = []
+        self.vfExec = []
+        self.pbegincodehash = 0
+        self.nOpCount = [0]
+        self.scriptIn = scriptIn
+        self.txTo = txTo
+        self.inIdx = inIdx
+        self.flags = flags
+        self.tracer = tracer
+        self.sighash_context = sighash_context
+        self.sop = None
+        self.sop_data = None
+        self.sop_pc = None
+
+    def err_raiser(self, cls, *args):
+        """Helper function for raising EvalScriptError exceptions
+
+        cls   - subclass you want to raise
+
+        *args - arguments
+
+        Fills in the state of execution for you.
+        """
+        raise cls(*args,
+                sop=self.sop,
+                sop_data=self.sop_data,
+                sop_pc=self.sop_pc,
+                stack=self.stack, scriptIn=self.scriptIn, txTo=self.txTo, inIdx=self.inIdx, flags=self.flags,
+                altstack=self.altstack, vfExec=self.vfExec, pbegincodehash=self.pbegincodehash,
+                nOpCount=self.nOpCount[0])
+
+    def check_args(self, n):
+        if len(self.stack) < n:
+            self.err_raiser(MissingOpArgumentsError, self.sop, self.stack, n)
+
+
+# Opcode handlers, indexed by opcode. Each is called with the
+# _EvalScriptState after the opcode has been counted and its push data, if
+# any, dealt with.
+def _OpUnsupported(s):
+    s.err_raiser(EvalScriptError, 'unsupported opcode 0x%x' % s.sop)
+
+_OPCODE_HANDLERS = [_OpUnsupported] * 256
+
+def _opcode_handler(*opcodes):
+    """Decorator registering the handler of opcodes"""
+    def register(f):
+        for opcode in opcodes:
+            _OPCODE_HANDLERS[opcode] = f
+        return f
+    return register
+
+
+def _MakeSmallIntHandler(vch):
+    def handler(s):
+        s.stack.append(vch)
+    return handler
+
+for _opcode in [OP_1NEGATE] + list(range(OP_1, OP_16 + 1)):
+    _OPCODE_HANDLERS[_opcode] = _MakeSmallIntHandler(bitcoin.core._bignum.bn2vch(_opcode - (OP_1 - 1)))
+
+
+def _MakeUnaryOpHandler(f):
+    def handler(s):
+        stack = s.stack
+        if len(stack) < 1:
+            s.err_raiser(MissingOpArgumentsError, s.sop, stack, 1)
+        bn = f(_CastToBigNum(stack[-1], s.err_raiser))
+        stack.pop()
+        stack.append(bitcoin.core._bignum.bn2vch(bn))
+    return handler
 
-    elif opcode == OP_ABS:
-        if bn < 0:
-            bn = -bn
+# OP_2MUL and OP_2DIV are *not* included in this list as they are disabled
+for (_opcode, _f) in ((OP_1ADD, lambda bn: bn + 1),
+                      (OP_1SUB, lambda bn: bn - 1),
+                      (OP_NEGATE, lambda bn: -bn),
+                      (OP_ABS, abs),
+                      (OP_NOT, lambda bn: long(bn == 0)),
+                      (OP_0NOTEQUAL, lambda bn: long(bn != 0))):
+    _OPCODE_HANDLERS[_opcode] = _MakeUnaryOpHandler(_f)
 
-    elif opcode == OP_NOT:
-        bn = long(bn == 0)
 
-    elif opcode == OP_0NOTEQUAL:
-        bn = long(bn != 0)
+def _MakeBinOpHandler(f):
+    def handler(s):
+        stack = s.stack
+        if len(stack) < 2:
+            s.err_raiser(MissingOpArgumentsError, s.sop, stack, 2)
 
-    else:
-        raise AssertionError("Unknown unary opcode encountered; this should not happen")
-
-    stack.append(bitcoin.core._bignum.bn2vch(bn))
+        bn2 = _CastToBigNum(stack[-1], s.err_raiser)
+        bn1 = _CastToBigNum(stack[-2], s.err_raiser)
+        bn = f(bn1, bn2)
 
+        stack.pop()
+        stack.pop()
+        stack.append(bitcoin.core._bignum.bn2vch(bn))
+    return handler
 
 # OP_LSHIFT and OP_RSHIFT are *not* included in this list as they are disabled
-_ISA_BINOP = {
-    OP_ADD,
-    OP_SUB,
-    OP_BOOLAND,
-    OP_BOOLOR,
-    OP_NUMEQUAL,
-    OP_NUMEQUALVERIFY,
-    OP_NUMNOTEQUAL,
-    OP_LESSTHAN,
-    OP_GREATERTHAN,
-    OP_LESSTHANOREQUAL,
-    OP_GREATERTHANOREQUAL,
-    OP_MIN,
-    OP_MAX,
-}
-
-def _BinOp(opcode, stack, err_raiser):
+for (_opcode, _f) in ((OP_ADD, lambda bn1, bn2: bn1 + bn2),
+                      (OP_SUB, lambda bn1, bn2: bn1 - bn2),
+                      (OP_BOOLAND, lambda bn1, bn2: long(bn1 != 0 and bn2 != 0)),
+                      (OP_BOOLOR, lambda bn1, bn2: long(bn1 != 0 or bn2 != 0)),
+                      (OP_NUMEQUAL, lambda bn1, bn2: long(bn1 == bn2)),
+                      (OP_NUMNOTEQUAL, lambda bn1, bn2: long(bn1 != bn2)),
+                      (OP_LESSTHAN, lambda bn1, bn2: long(bn1 < bn2)),
+                      (OP_GREATERTHAN, lambda bn1, bn2: long(bn1 > bn2)),
+                      (OP_LESSTHANOREQUAL, lambda bn1, bn2: long(bn1 <= bn2)),
+                      (OP_GREATERTHANOREQUAL, lambda bn1, bn2: long(bn1 >= bn2)),
+                      (OP_MIN, min),
+                      (OP_MAX, max)):
+    _OPCODE_HANDLERS[_opcode] = _MakeBinOpHandler(_f)
+
+@_opcode_handler(OP_NUMEQUALVERIFY)
+def _OpNumEqualVerify(s):
+    stack = s.stack
     if len(stack) < 2:
-        err_raiser(MissingOpArgumentsError, opcode, stack, 2)
-
-    bn2 = _CastToBigNum(stack[-1], err_raiser)
-    bn1 = _CastToBigNum(stack[-2], err_raiser)
-
-    # We don't pop the stack yet so that OP_NUMEQUALVERIFY can raise
-    # VerifyOpFailedError with a correct stack.
+        s.err_raiser(MissingOpArgumentsError, s.sop, stack, 2)
 
-    if opcode == OP_ADD:
-        bn = bn1 + bn2
+    bn2 = _CastToBigNum(stack[-1], s.err_raiser)
+    bn1 = _CastToBigNum(stack[-2], s.err_raiser)
 
-    elif opcode == OP_SUB:
-        bn = bn1 - bn2
-
-    elif opcode == OP_BOOLAND:
-        bn = long(bn1 != 0 and bn2 != 0)
-
-    elif opcode == OP_BOOLOR:
-        bn = long(bn1 != 0 or bn2 != 0)
-
-    elif opcode == OP_NUMEQUAL:
-        bn = long(bn1 == bn2)
-
-    elif opcode == OP_NUMEQUALVERIFY:
-        bn = long(bn1 == bn2)
-        if not bn:
-            err_raiser(VerifyOpFailedError, opcode)
-        else:
-            # No exception, so time to pop the stack
-            stack.pop()
-            stack.pop()
-            return
-
-    elif opcode == OP_NUMNOTEQUAL:
-        bn = long(bn1 != bn2)
+    # The stack isn't popped until the comparison succeeds so that
+    # VerifyOpFailedError is raised with a correct stack.
+    if bn1 != bn2:
+        s.err_raiser(VerifyOpFailedError, s.sop)
+    stack.pop()
+    stack.pop()
 
-    elif opcode == OP_LESSTHAN:
-        bn = long(bn1 < bn2)
 
-    elif opcode == OP_GREATERTHAN:
-        bn = long(bn1 > bn2)
+@_opcode_handler(OP_2DROP)
+def _Op2Drop(s):
+    s.check_args(2)
+    s.stack.pop()
+    s.stack.pop()
+
+@_opcode_handler(OP_2DUP)
+def _Op2Dup(s):
+    s.check_args(2)
+    s.stack.extend(s.stack[-2:])
+
+@_opcode_handler(OP_2OVER)
+def _Op2Over(s):
+    s.check_args(4)
+    s.stack.extend(s.stack[-4:-2])
+
+@_opcode_handler(OP_2ROT)
+def _Op2Rot(s):
+    s.check_args(6)
+    stack = s.stack
+    v1 = stack[-6]
+    v2 = stack[-5]
+    del stack[-6]
+    del stack[-5]
+    stack.append(v1)
+    stack.append(v2)
+
+@_opcode_handler(OP_2SWAP)
+def _Op2Swap(s):
+    s.check_args(4)
+    stack = s.stack
+    stack[-4], stack[-3], stack[-2], stack[-1] = stack[-2], stack[-1], stack[-4], stack[-3]
+
+@_opcode_handler(OP_3DUP)
+def _Op3Dup(s):
+    s.check_args(3)
+    s.stack.extend(s.stack[-3:])
+
+@_opcode_handler(OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY)
+def _OpCheckMultiSig(s):
+    tmpScript = CScript(s.scriptIn[s.pbegincodehash:])
+    _CheckMultiSig(s.sop, tmpScript, s.stack, s.txTo, s.inIdx, s.flags, s.err_raiser, s.nOpCount,
+                   s.tracer, s.sighash_context)
+
+@_opcode_handler(OP_CHECKSIG, OP_CHECKSIGVERIFY)
+def _OpCheckSig(s):
+    s.check_args(2)
+    stack = s.stack
+    vchPubKey = stack[-1]
+    vchSig = stack[-2]
+    tmpScript = CScript(s.scriptIn[s.pbegincodehash:])
 
-    elif opcode == OP_LESSTHANOREQUAL:
-        bn = long(bn1 <= bn2)
+    # Drop the signature, since there's no way for a signature to sign itself
+    #
+    # Of course, this can only come up in very contrived cases now that
+    # scriptSig and scriptPubKey are processed separately.
+    tmpScript = FindAndDelete(tmpScript, CScript([vchSig]))
 
-    elif opcode == OP_GREATERTHANOREQUAL:
-        bn = long(bn1 >= bn2)
+    ok = _CheckSig(vchSig, vchPubKey, tmpScript, s.txTo, s.inIdx,
+                   s.err_raiser, s.tracer, s.sighash_context)
+    if not ok and s.sop == OP_CHECKSIGVERIFY:
+        s.err_raiser(VerifyOpFailedError, s.sop)
 
-    elif opcode == OP_MIN:
-        if bn1 < bn2:
-            bn = bn1
-        else:
-            bn = bn2
+    else:
+        stack.pop()
+        stack.pop()
 
-    elif opcode == OP_MAX:
-        if bn1 > bn2:
-            bn = bn1
+        if ok:
+            if s.sop != OP_CHECKSIGVERIFY:
+                stack.append(b"\x01")
         else:
-            bn = bn2
+            # FIXME: this is incorrect, but not caught by existing
+            # test cases
+            stack.append(b"\x00")
 
+@_opcode_handler(OP_CODESEPARATOR)
+def _OpCodeSeparator(s):
+    s.pbegincodehash = s.sop_pc
+
+@_opcode_handler(OP_DEPTH)
+def _OpDepth(s):
+    s.stack.append(bitcoin.core._bignum.bn2vch(len(s.stack)))
+
+@_opcode_handler(OP_DROP)
+def _OpDrop(s):
+    s.check_args(1)
+    s.stack.pop()
+
+@_opcode_handler(OP_DUP)
+def _OpDup(s):
+    s.check_args(1)
+    s.stack.append(s.stack[-1])
+
+@_opcode_handler(OP_ELSE)
+def _OpElse(s):
+    if len(s.vfExec) == 0:
+        s.err_raiser(EvalScriptError, 'ELSE found without prior IF')
+    s.vfExec[-1] = not s.vfExec[-1]
+
+@_opcode_handler(OP_ENDIF)
+def _OpEndIf(s):
+    if len(s.vfExec) == 0:
+        s.err_raiser(EvalScriptError, 'ENDIF found without prior IF')
+    s.vfExec.pop()
+
+@_opcode_handler(OP_EQUAL)
+def _OpEqual(s):
+    s.check_args(2)
+    v1 = s.stack.pop()
+    v2 = s.stack.pop()
+
+    if v1 == v2:
+        s.stack.append(b"\x01")
+    else:
+        s.stack.append(b"")
+
+@_opcode_handler(OP_EQUALVERIFY)
+def _OpEqualVerify(s):
+    s.check_args(2)
+    if s.stack[-1] == s.stack[-2]:
+        s.stack.pop()
+        s.stack.pop()
     else:
-        raise AssertionError("Unknown binop opcode encountered; this should not happen")
+        s.err_raiser(VerifyOpFailedError, s.sop)
+
+@_opcode_handler(OP_FROMALTSTACK)
+def _OpFromAltStack(s):
+    if len(s.altstack) < 1:
+        s.err_raiser(MissingOpArgumentsError, s.sop, s.altstack, 1)
+    s.stack.append(s.altstack.pop())
+
+@_opcode_handler(OP_HASH160)
+def _OpHash160(s):
+    s.check_args(1)
+    s.stack.append(bitcoin.core.serialize.Hash160(s.stack.pop()))
+
+@_opcode_handler(OP_HASH256)
+def _OpHash256(s):
+    s.check_args(1)
+    s.stack.append(bitcoin.core.serialize.Hash(s.stack.pop()))
+
+@_opcode_handler(OP_IF, OP_NOTIF)
+def _OpIf(s):
+    val = False
+
+    if False not in s.vfExec:
+        s.check_args(1)
+        val = _CastToBool(s.stack.pop())
+        if s.sop == OP_NOTIF:
+            val = not val
+
+    s.vfExec.append(val)
+
+@_opcode_handler(OP_IFDUP)
+def _OpIfDup(s):
+    s.check_args(1)
+    vch = s.stack[-1]
+    if _CastToBool(vch):
+        s.stack.append(vch)
+
+@_opcode_handler(OP_NIP)
+def _OpNip(s):
+    s.check_args(2)
+    del s.stack[-2]
+
+@_opcode_handler(OP_NOP)
+def _OpNop(s):
+    pass
 
+@_opcode_handler(*range(OP_NOP1, OP_NOP10 + 1))
+def _OpUpgradableNop(s):
+    if s.flags & SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS:
+        s.err_raiser(EvalScriptError, "%s reserved for soft-fork upgrades" % OPCODE_NAMES[s.sop])
+
+@_opcode_handler(OP_OVER)
+def _OpOver(s):
+    s.check_args(2)
+    s.stack.append(s.stack[-2])
+
+@_opcode_handler(OP_PICK, OP_ROLL)
+def _OpPickRoll(s):
+    s.check_args(2)
+    stack = s.stack
+    n = _CastToBigNum(stack.pop(), s.err_raiser)
+    if n < 0 or n >= len(stack):
+        s.err_raiser(EvalScriptError, "Argument for %s out of bounds" % OPCODE_NAMES[s.sop])
+    vch = stack[-n-1]
+    if s.sop == OP_ROLL:
+        del stack[-n-1]
+    stack.append(vch)
+
+@_opcode_handler(OP_RETURN)
+def _OpReturn(s):
+    s.err_raiser(EvalScriptError, "OP_RETURN called")
+
+@_opcode_handler(OP_RIPEMD160)
+def _OpRipemd160(s):
+    s.check_args(1)
+
+    h = hashlib.new('ripemd160')
+    h.update(s.stack.pop())
+    s.stack.append(h.digest())
+
+@_opcode_handler(OP_ROT)
+def _OpRot(s):
+    s.check_args(3)
+    stack = s.stack
+    stack[-3], stack[-2], stack[-1] = stack[-2], stack[-1], stack[-3]
+
+@_opcode_handler(OP_SIZE)
+def _OpSize(s):
+    s.check_args(1)
+    s.stack.append(bitcoin.core._bignum.bn2vch(len(s.stack[-1])))
+
+@_opcode_handler(OP_SHA1)
+def _OpSha1(s):
+    s.check_args(1)
+    s.stack.append(hashlib.sha1(s.stack.pop()).digest())
+
+@_opcode_handler(OP_SHA256)
+def _OpSha256(s):
+    s.check_args(1)
+    s.stack.append(hashlib.sha256(s.stack.pop()).digest())
+
+@_opcode_handler(OP_SWAP)
+def _OpSwap(s):
+    s.check_args(2)
+    stack = s.stack
+    stack[-2], stack[-1] = stack[-1], stack[-2]
+
+@_opcode_handler(OP_TOALTSTACK)
+def _OpToAltStack(s):
+    s.check_args(1)
+    s.altstack.append(s.stack.pop())
+
+@_opcode_handler(OP_TUCK)
+def _OpTuck(s):
+    s.check_args(2)
+    s.stack.insert(len(s.stack) - 2, s.stack[-1])
+
+@_opcode_handler(OP_VERIFY)
+def _OpVerify(s):
+    s.check_args(1)
+    if _CastToBool(s.stack[-1]):
+        s.stack.pop()
+    else:
+        s.err_raiser(VerifyOpFailedError, s.sop)
+
+@_opcode_handler(OP_WITHIN)
+def _OpWithin(s):
+    s.check_args(3)
+    stack = s.stack
+    bn3 = _CastToBigNum(stack[-1], s.err_raiser)
+    bn2 = _CastToBigNum(stack[-2], s.err_raiser)
+    bn1 = _CastToBigNum(stack[-3], s.err_raiser)
     stack.pop()
     stack.pop()
-    stack.append(bitcoin.core._bignum.bn2vch(bn))
+    stack.pop()
+    if (bn2 <= bn1) and (bn1 < bn3):
+        stack.append(b"\x01")
+    else:
+        # FIXME: this is incorrect, but not caught by existing
+        # test cases
+        stack.append(b"\x00")
 
 
-def _CheckExec(vfExec):
-    for b in vfExec:
-        if not b:
-            return False
-    return True
+def _TraceOps(ops, s, tracer):
+    """Yield ops to the interpreter loop, reporting each to the tracer
+
+    An op is reported when the loop asks for the next one, that is once it has
+    been fully executed; an op that raises is never reported.
+    """
+    for (sop, sop_data, sop_pc) in ops:
+        start = _timer()
+        yield (sop, sop_data, sop_pc)
+        tracer.opcode(sop, sop_data, sop_pc, s.stack, s.altstack, _timer() - start)
 
 
-def _EvalScript(stack, scriptIn, txTo, inIdx, flags=()):
+def _EvalScript(stack, scriptIn, txTo, inIdx, flags=(), tracer=None, sighash_context=None):
     """Evaluate a script
 
     """
@@ -378,332 +941,49 @@ def _EvalScript(stack, scriptIn, txTo, inIdx, flags=()):
                               inIdx=inIdx,
                               flags=flags)
 
-    altstack = []
-    vfExec = []
-    pbegincodehash = 0
-    nOpCount = [0]
-    for (sop, sop_data, sop_pc) in scriptIn.raw_iter():
-        fExec = _CheckExec(vfExec)
-
-        def err_raiser(cls, *args):
-            """Helper function for raising EvalScriptError exceptions
-
-            cls   - subclass you want to raise
-
-            *args - arguments
-
-            Fills in the state of execution for you.
-            """
-            raise cls(*args,
-                    sop=sop,
-                    sop_data=sop_data,
-                    sop_pc=sop_pc,
-                    stack=stack, scriptIn=scriptIn, txTo=txTo, inIdx=inIdx, flags=flags,
-                    altstack=altstack, vfExec=vfExec, pbegincodehash=pbegincodehash, nOpCount=nOpCount[0])
-
-
-        if sop in DISABLED_OPCODES:
-            err_raiser(EvalScriptError, 'opcode %s is disabled' % OPCODE_NAMES[sop])
-
-        if sop > OP_16:
-            nOpCount[0] += 1
-            if nOpCount[0] > MAX_SCRIPT_OPCODES:
-                err_raiser(MaxOpCountError)
-
-        def check_args(n):
-            if len(stack) < n:
-                err_raiser(MissingOpArgumentsError, sop, stack, n)
-
+    s = _EvalScriptState(stack, scriptIn, txTo, inIdx, flags, tracer, sighash_context)
+    altstack = s.altstack
+    vfExec = s.vfExec
+    nOpCount = s.nOpCount
+    handlers = _OPCODE_HANDLERS
+    (ops, parse_err) = scriptIn._parse()
+    if tracer is not None:
+        ops = _TraceOps(ops, s, tracer)
+    for (sop, sop_data, sop_pc) in ops:
+        s.sop = sop
+        s.sop_data = sop_data
+        s.sop_pc = sop_pc
 
         if sop <= OP_PUSHDATA4:
             if len(sop_data) > MAX_SCRIPT_ELEMENT_SIZE:
-                err_raiser(EvalScriptError,
-                           'PUSHDATA of length %d; maximum allowed is %d' %
-                                (len(sop_data), MAX_SCRIPT_ELEMENT_SIZE))
+                s.err_raiser(EvalScriptError,
+                             'PUSHDATA of length %d; maximum allowed is %d' %
+                                  (len(sop_data), MAX_SCRIPT_ELEMENT_SIZE))
 
-            elif fExec:
+            elif False not in vfExec:
                 stack.append(sop_data)
                 continue
 
-        elif fExec or (OP_IF <= sop <= OP_ENDIF):
-
-            if sop == OP_1NEGATE or ((sop >= OP_1) and (sop <= OP_16)):
-                v = sop - (OP_1 - 1)
-                stack.append(bitcoin.core._bignum.bn2vch(v))
-
-            elif sop in _ISA_BINOP:
-                _BinOp(sop, stack, err_raiser)
-
-            elif sop in _ISA_UNOP:
-                _UnaryOp(sop, stack, err_raiser)
-
-            elif sop == OP_2DROP:
-                check_args(2)
-                stack.pop()
-                stack.pop()
-
-            elif sop == OP_2DUP:
-                check_args(2)
-                v1 = stack[-2]
-                v2 = stack[-1]
-                stack.append(v1)
-                stack.append(v2)
-
-            elif sop == OP_2OVER:
-                check_args(4)
-                v1 = stack[-4]
-                v2 = stack[-3]
-                stack.append(v1)
-                stack.append(v2)
-
-            elif sop == OP_2ROT:
-                check_args(6)
-                v1 = stack[-6]
-                v2 = stack[-5]
-                del stack[-6]
-                del stack[-5]
-                stack.append(v1)
-                stack.append(v2)
-
-            elif sop == OP_2SWAP:
-                check_args(4)
-                tmp = stack[-4]
-                stack[-4] = stack[-2]
-                stack[-2] = tmp
-
-                tmp = stack[-3]
-                stack[-3] = stack[-1]
-                stack[-1] = tmp
-
-            elif sop == OP_3DUP:
-                check_args(3)
-                v1 = stack[-3]
-                v2 = stack[-2]
-                v3 = stack[-1]
-                stack.append(v1)
-                stack.append(v2)
-                stack.append(v3)
-
-            elif sop == OP_CHECKMULTISIG or sop == OP_CHECKMULTISIGVERIFY:
-                tmpScript = CScript(scriptIn[pbegincodehash:])
-                _CheckMultiSig(sop, tmpScript, stack, txTo, inIdx, flags, err_raiser, nOpCount)
-
-            elif sop == OP_CHECKSIG or sop == OP_CHECKSIGVERIFY:
-                check_args(2)
-                vchPubKey = stack[-1]
-                vchSig = stack[-2]
-                tmpScript = CScript(scriptIn[pbegincodehash:])
-
-                # Drop the signature, since there's no way for a signature to sign itself
-                #
-                # Of course, this can only come up in very contrived cases now that
-                # scriptSig and scriptPubKey are processed separately.
-                tmpScript = FindAndDelete(tmpScript, CScript([vchSig]))
-
-                ok = _CheckSig(vchSig, vchPubKey, tmpScript, txTo, inIdx,
-                               err_raiser)
-                if not ok and sop == OP_CHECKSIGVERIFY:
-                    err_raiser(VerifyOpFailedError, sop)
-
-                else:
-                    stack.pop()
-                    stack.pop()
-
-                    if ok:
-                        if sop != OP_CHECKSIGVERIFY:
-                            stack.append(b"\x01")
-                    else:
-                        # FIXME: this is incorrect, but not caught by existing
-                        # test cases
-                        stack.append(b"\x00")
-
-            elif sop == OP_CODESEPARATOR:
-                pbegincodehash = sop_pc
-
-            elif sop == OP_DEPTH:
-                bn = len(stack)
-                stack.append(bitcoin.core._bignum.bn2vch(bn))
-
-            elif sop == OP_DROP:
-                check_args(1)
-                stack.pop()
-
-            elif sop == OP_DUP:
-                check_args(1)
-                v = stack[-1]
-                stack.append(v)
-
-            elif sop == OP_ELSE:
-                if len(vfExec) == 0:
-                    err_raiser(EvalScriptError, 'ELSE found without prior IF')
-                vfExec[-1] = not vfExec[-1]
-
-            elif sop == OP_ENDIF:
-                if len(vfExec) == 0:
-                    err_raiser(EvalScriptError, 'ENDIF found without prior IF')
-                vfExec.pop()
-
-            elif sop == OP_EQUAL:
-                check_args(2)
-                v1 = stack.pop()
-                v2 = stack.pop()
-
-                if v1 == v2:
-                    stack.append(b"\x01")
-                else:
-                    stack.append(b"")
-
-            elif sop == OP_EQUALVERIFY:
-                check_args(2)
-                v1 = stack[-1]
-                v2 = stack[-2]
-
-                if v1 == v2:
-                    stack.pop()
-                    stack.pop()
-                else:
-                    err_raiser(VerifyOpFailedError, sop)
-
-            elif sop == OP_FROMALTSTACK:
-                if len(altstack) < 1:
-                    err_raiser(MissingOpArgumentsError, sop, altstack, 1)
-                v = altstack.pop()
-                stack.append(v)
-
-            elif sop == OP_HASH160:
-                check_args(1)
-                stack.append(bitcoin.core.serialize.Hash160(stack.pop()))
-
-            elif sop == OP_HASH256:
-                check_args(1)
-                stack.append(bitcoin.core.serialize.Hash(stack.pop()))
-
-            elif sop == OP_IF or sop == OP_NOTIF:
-                val = False
-
-                if fExec:
-                    check_args(1)
-                    vch = stack.pop()
-                    val = _CastToBool(vch)
-                    if sop == OP_NOTIF:
-                        val = not val
-
-                vfExec.append(val)
-
-
-            elif sop == OP_IFDUP:
-                check_args(1)
-                vch = stack[-1]
-                if _CastToBool(vch):
-                    stack.append(vch)
-
-            elif sop == OP_NIP:
-                check_args(2)
-                del stack[-2]
-
-            elif sop == OP_NOP:
-                pass
-
-            elif sop >= OP_NOP1 and sop <= OP_NOP10:
-                if SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS in flags:
-                    err_raiser(EvalScriptError, "%s reserved for soft-fork upgrades" % OPCODE_NAMES[sop])
-                else:
-                    pass
-
-            elif sop == OP_OVER:
-                check_args(2)
-                vch = stack[-2]
-                stack.append(vch)
-
-            elif sop == OP_PICK or sop == OP_ROLL:
-                check_args(2)
-                n = _CastToBigNum(stack.pop(), err_raiser)
-                if n < 0 or n >= len(stack):
-                    err_raiser(EvalScriptError, "Argument for %s out of bounds" % OPCODE_NAMES[sop])
-                vch = stack[-n-1]
-                if sop == OP_ROLL:
-                    del stack[-n-1]
-                stack.append(vch)
-
-            elif sop == OP_RETURN:
-                err_raiser(EvalScriptError, "OP_RETURN called")
-
-            elif sop == OP_RIPEMD160:
-                check_args(1)
-
-                h = hashlib.new('ripemd160')
-                h.update(stack.pop())
-                stack.append(h.digest())
-
-            elif sop == OP_ROT:
-                check_args(3)
-                tmp = stack[-3]
-                stack[-3] = stack[-2]
-                stack[-2] = tmp
-
-                tmp = stack[-2]
-                stack[-2] = stack[-1]
-                stack[-1] = tmp
-
-            elif sop == OP_SIZE:
-                check_args(1)
-                bn = len(stack[-1])
-                stack.append(bitcoin.core._bignum.bn2vch(bn))
-
-            elif sop == OP_SHA1:
-                check_args(1)
-                stack.append(hashlib.sha1(stack.pop()).digest())
-
-            elif sop == OP_SHA256:
-                check_args(1)
-                stack.append(hashlib.sha256(stack.pop()).digest())
-
-            elif sop == OP_SWAP:
-                check_args(2)
-                tmp = stack[-2]
-                stack[-2] = stack[-1]
-                stack[-1] = tmp
-
-            elif sop == OP_TOALTSTACK:
-                check_args(1)
-                v = stack.pop()
-                altstack.append(v)
-
-            elif sop == OP_TUCK:
-                check_args(2)
-                vch = stack[-1]
-                stack.insert(len(stack) - 2, vch)
-
-            elif sop == OP_VERIFY:
-                check_args(1)
-                v = _CastToBool(stack[-1])
-                if v:
-                    stack.pop()
-                else:
-                    raise err_raiser(VerifyOpFailedError, sop)
-
-            elif sop == OP_WITHIN:
-                check_args(3)
-                bn3 = _CastToBigNum(stack[-1], err_raiser)
-                bn2 = _CastToBigNum(stack[-2], err_raiser)
-                bn1 = _CastToBigNum(stack[-3], err_raiser)
-                stack.pop()
-                stack.pop()
-                stack.pop()
-                v = (bn2 <= bn1) and (bn1 < bn3)
-                if v:
-                    stack.append(b"\x01")
-                else:
-                    # FIXME: this is incorrect, but not caught by existing
-                    # test cases
-                    stack.append(b"\x00")
-
-            else:
-                err_raiser(EvalScriptError, 'unsupported opcode 0x%x' % sop)
+        else:
+            if sop > OP_16:
+                if sop in DISABLED_OPCODES:
+                    s.err_raiser(EvalScriptError, 'opcode %s is disabled' % OPCODE_NAMES[sop])
+
+                nOpCount[0] += 1
+                if nOpCount[0] > MAX_SCRIPT_OPCODES:
+                    s.err_raiser(MaxOpCountError)
+
+            # Conditionals are evaluated even in unexecuted branches
+            if OP_IF <= sop <= OP_ENDIF or False not in vfExec:
+                handlers[sop](s)
 
         # size limits
         if len(stack) + len(altstack) > MAX_STACK_ITEMS:
-            err_raiser(EvalScriptError, 'max stack items limit reached')
+            s.err_raiser(EvalScriptError, 'max stack items limit reached')
+
+    # Invalid pushdata following the opcodes executed above
+    if parse_err is not None:
+        raise parse_err[0](*parse_err[1])
 
     # Unterminated IF/NOTIF/ELSE block
     if len(vfExec):
@@ -715,7 +995,7 @@ def _EvalScript(stack, scriptIn, txTo, inIdx, flags=()):
                               flags=flags)
 
 
-def EvalScript(stack, scriptIn, txTo, inIdx, flags=()):
+def EvalScript(stack, scriptIn, txTo, inIdx, flags=(), tracer=None, sighash_context=None):
     """Evaluate a script
 
     stack    - Initial stack
@@ -727,10 +1007,26 @@ def EvalScript(stack, scriptIn, txTo, inIdx, flags=()):
     inIdx    - txin index of the scriptSig
 
     flags    - SCRIPT_VERIFY_* flags to apply
+
+    tracer   - Optional ScriptTracer told about every opcode and signature
+               check
+
+    sighash_context - Optional SignatureHashContext of txTo, to share
+                      signature hash work between the inputs of txTo
     """
+    flags = ScriptVerifyFlags(flags)
 
     try:
-        _EvalScript(stack, scriptIn, txTo, inIdx, flags=flags)
+        if tracer is None:
+            _EvalScript(stack, scriptIn, txTo, inIdx, flags=flags,
+                        sighash_context=sighash_context)
+        else:
+            start = _timer()
+            try:
+                _EvalScript(stack, scriptIn, txTo, inIdx, flags=flags, tracer=tracer,
+                            sighash_context=sighash_context)
+            finally:
+                tracer.script(scriptIn, _timer() - start)
     except CScriptInvalidError as err:
         raise EvalScriptError(repr(err),
                               stack=stack,
@@ -742,7 +1038,7 @@ def EvalScript(stack, scriptIn, txTo, inIdx, flags=()):
 class VerifyScriptError(bitcoin.core.ValidationError):
     pass
 
-def VerifyScript(scriptSig, scriptPubKey, txTo, inIdx, flags=()):
+def VerifyScript(scriptSig, scriptPubKey, txTo, inIdx, flags=(), tracer=None, sighash_context=None):
     """Verify a scriptSig satisfies a scriptPubKey
 
     scriptSig    - Signature
@@ -753,20 +1049,30 @@ def VerifyScript(scriptSig, scriptPubKey, txTo, inIdx, flags=()):
 
     inIdx        - Index of the transaction input containing scriptSig
 
+    flags        - SCRIPT_VERIFY_* flags to apply
+
+    tracer       - Optional ScriptTracer, passed to every EvalScript() call
+
+    sighash_context - Optional SignatureHashContext of txTo, passed to every
+                      EvalScript() call
+
     Raises a ValidationError subclass if the validation fails.
     """
+    flags = ScriptVerifyFlags(flags)
     stack = []
-    EvalScript(stack, scriptSig, txTo, inIdx, flags=flags)
-    if SCRIPT_VERIFY_P2SH in flags:
+    EvalScript(stack, scriptSig, txTo, inIdx, flags=flags, tracer=tracer,
+               sighash_context=sighash_context)
+    if flags & SCRIPT_VERIFY_P2SH:
         stackCopy = list(stack)
-    EvalScript(stack, scriptPubKey, txTo, inIdx, flags=flags)
+    EvalScript(stack, scriptPubKey, txTo, inIdx, flags=flags, tracer=tracer,
+               sighash_context=sighash_context)
     if len(stack) == 0:
         raise VerifyScriptError("scriptPubKey left an empty stack")
     if not _CastToBool(stack[-1]):
         raise VerifyScriptError("scriptPubKey returned false")
 
     # Additional validation for spend-to-script-hash transactions
-    if SCRIPT_VERIFY_P2SH in flags and scriptPubKey.is_p2sh():
+    if flags & SCRIPT_VERIFY_P2SH and scriptPubKey.is_p2sh():
         if not scriptSig.is_push_only():
             raise VerifyScriptError("P2SH scriptSig not is_push_only()")
 
@@ -780,7 +1086,8 @@ def VerifyScript(scriptSig, scriptPubKey, txTo, inIdx, flags=()):
 
         pubKey2 = CScript(stack.pop())
 
-        EvalScript(stack, pubKey2, txTo, inIdx, flags=flags)
+        EvalScript(stack, pubKey2, txTo, inIdx, flags=flags, tracer=tracer,
+                   sighash_context=sighash_context)
 
         if not len(stack):
             raise VerifyScriptError("P2SH inner scriptPubKey left an empty stack")
@@ -788,8 +1095,8 @@ def VerifyScript(scriptSig, scriptPubKey, txTo, inIdx, flags=()):
         if not _CastToBool(stack[-1]):
             raise VerifyScriptError("P2SH inner scriptPubKey returned false")
 
-    if SCRIPT_VERIFY_CLEANSTACK in flags:
-        assert SCRIPT_VERIFY_P2SH in flags
+    if flags & SCRIPT_VERIFY_CLEANSTACK:
+        assert flags & SCRIPT_VERIFY_P2SH
 
         if len(stack) != 1:
             raise VerifyScriptError("scriptPubKey left extra items on stack")
@@ -822,8 +1129,185 @@ def VerifySignature(txFrom, txTo, inIdx):
     VerifyScript(txin.scriptSig, txout.scriptPubKey, txTo, inIdx)
 
 
+class VerifyTransactionError(bitcoin.core.ValidationError):
+    pass
+
+def _VerifyInput(tx, inIdx, scriptPubKey, flags, sighash_context=None):
+    """Verify a single input, returning None or the error message"""
+    try:
+        VerifyScript(tx.vin[inIdx].scriptSig, scriptPubKey, tx, inIdx, flags,
+                     sighash_context=sighash_context)
+    except bitcoin.core.ValidationError as err:
+        return str(err)
+    return None
+
+def _VerifyInputs(jobs, flags):
+    """VerifyTransaction() worker
+
+    jobs is a list of (serialized_tx, [(inIdx, scriptPubKey), ...]). Returns
+    the _VerifyInput() results of every input in order.
+    """
+    flags = ScriptVerifyFlags(flags)
+    r = []
+    for (serialized_tx, inputs) in jobs:
+        tx = bitcoin.core.CTransaction.deserialize(serialized_tx)
+        sighash_context = SignatureHashContext(tx)
+        for (inIdx, scriptPubKey) in inputs:
+            r.append(_VerifyInput(tx, inIdx, CScript(scriptPubKey), flags, sighash_context))
+    return r
+
+def _VerifyWorkerInitArgs():
+    """Arguments of _InitVerifyWorker() for a pool created now"""
+    cache = signature_cache
+    if cache is None:
+        return (bitcoin.core.key.backend.name, None, [])
+    with cache._lock:
+        entries = list(cache._entries)
+    return (bitcoin.core.key.backend.name, cache.max_size, entries)
+
+def _InitVerifyWorker(backend_name, cache_max_size, cache_entries):
+    """Process pool initializer
+
+    Selects the parent's ECDSA backend and gives the worker a signature cache
+    of the same size, seeded with the parent's entries as they were when the
+    pool was created; cache_max_size is None if the parent's cache is
+    disabled. Entries a worker adds aren't sent back to the parent.
+    """
+    global signature_cache
+    bitcoin.core.key.SelectBackend(backend_name)
+    if cache_max_size is None:
+        signature_cache = None
+    else:
+        signature_cache = SignatureCache(cache_max_size)
+        for (sighash, pubkey, sig) in cache_entries:
+            signature_cache.add(sighash, pubkey, sig)
+
+_VERIFY_CHUNK_SIZE = 16
+
+def _VerifyInputsResults(inputs, flags, executor):
+    """Yield the _VerifyInput() results for a list of (tx, inIdx, scriptPubKey)"""
+    if executor is None:
+        prev_tx = None
+        for (tx, inIdx, scriptPubKey) in inputs:
+            if tx is not prev_tx:
+                sighash_context = SignatureHashContext(tx)
+                prev_tx = tx
+            yield _VerifyInput(tx, inIdx, scriptPubKey, flags, sighash_context)
+        return
+
+    serialized_txs = {}
+    futures = []
+    for i in range(0, len(inputs), _VERIFY_CHUNK_SIZE):
+        jobs = []
+        prev_tx = None
+        for (tx, inIdx, scriptPubKey) in inputs[i:i + _VERIFY_CHUNK_SIZE]:
+            if tx is not prev_tx:
+                if id(tx) not in serialized_txs:
+                    serialized_txs[id(tx)] = tx.serialize()
+                jobs.append((serialized_txs[id(tx)], []))
+                prev_tx = tx
+            jobs[-1][1].append((inIdx, bytes(scriptPubKey)))
+        futures.append(executor.submit(_VerifyInputs, jobs, int(flags)))
+
+    try:
+        for future in futures:
+            for r in future.result():
+                yield r
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _VerifyInputsList(inputs, flags, workers, executor, fail_fast):
+    shutdown = False
+    if executor is None and workers is not None and workers > 1:
+        import concurrent.futures
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_InitVerifyWorker,
+                                                          initargs=_VerifyWorkerInitArgs())
+        shutdown = True
+
+    try:
+        results = []
+        results_iter = _VerifyInputsResults(inputs, flags, executor)
+        try:
+            for ((tx, inIdx, scriptPubKey), err) in zip(inputs, results_iter):
+                if err is not None:
+                    err = VerifyTransactionError('%s input %d: %s' % (bitcoin.core.b2lx(tx.GetHash()), inIdx, err))
+                    if fail_fast:
+                        raise err
+                results.append(err)
+        finally:
+            results_iter.close()
+        return results
+    finally:
+        if shutdown:
+            executor.shutdown()
+
+def VerifyTransaction(tx, spent_outputs, flags=(), workers=None, executor=None, fail_fast=True):
+    """Verify the scripts of every input of a transaction
+
+    tx            - Spending transaction
+
+    spent_outputs - The CTxOut spent by each input, in order
+
+    flags         - Script verification flags
+
+    workers       - Verify the inputs in a process pool of this many workers,
+                    created for the call.
+
+    executor      - Alternatively an existing concurrent.futures.Executor.
+                    Inputs are sent to the workers in chunks, with the
+                    transaction in serialized form, so a ProcessPoolExecutor
+                    works.
+
+    If fail_fast is true a VerifyTransactionError is raised for the first
+    invalid input, by index; the same input fails first with or without
+    workers. Otherwise a list is returned with None for every valid input and
+    a VerifyTransactionError for every invalid one.
+    """
+    flags = ScriptVerifyFlags(flags)
+    if len(spent_outputs) != len(tx.vin):
+        raise ValueError('%d spent outputs for %d inputs' % (len(spent_outputs), len(tx.vin)))
+    inputs = [(tx, inIdx, txout.scriptPubKey) for (inIdx, txout) in enumerate(spent_outputs)]
+    return _VerifyInputsList(inputs, flags, workers, executor, fail_fast)
+
+def VerifyBlockScripts(block, spent_outputs, flags=(), workers=None, executor=None):
+    """Verify the scripts of every input of every transaction in a block
+
+    spent_outputs - Mapping of COutPoint to the CTxOut it refers to. Outputs
+                    created earlier in the block itself are found
+                    automatically.
+
+    The coinbase has no scripts to verify and is skipped. See
+    VerifyTransaction() for the other arguments; a VerifyTransactionError is
+    raised for the first invalid input in block order.
+    """
+    flags = ScriptVerifyFlags(flags)
+    created_outputs = {}
+    inputs = []
+    for tx in block.vtx:
+        if not tx.is_coinbase():
+            for (inIdx, txin) in enumerate(tx.vin):
+                try:
+                    txout = created_outputs[txin.prevout]
+                except KeyError:
+                    try:
+                        txout = spent_outputs[txin.prevout]
+                    except KeyError:
+                        raise VerifyTransactionError('%s input %d: spent output %r not found' %
+                                                     (bitcoin.core.b2lx(tx.GetHash()), inIdx, txin.prevout))
+                inputs.append((tx, inIdx, txout.scriptPubKey))
+
+        txid = tx.GetHash()
+        for (n, txout) in enumerate(tx.vout):
+            created_outputs[bitcoin.core.COutPoint(txid, n)] = txout
+
+    _VerifyInputsList(inputs, flags, workers, executor, True)
+
+
 __all__ = (
         'MAX_STACK_ITEMS',
+        'ScriptVerifyFlags',
+        'SCRIPT_VERIFY_NONE',
         'SCRIPT_VERIFY_P2SH',
         'SCRIPT_VERIFY_STRICTENC',
         'SCRIPT_VERIFY_DERSIG',
@@ -835,6 +1319,11 @@ __all__ = (
         'SCRIPT_VERIFY_CLEANSTACK',
         'SCRIPT_VERIFY_CHECKLOCKTIMEVERIFY',
         'SCRIPT_VERIFY_FLAGS_BY_NAME',
+        'MANDATORY_SCRIPT_VERIFY_FLAGS',
+        'STANDARD_SCRIPT_VERIFY_FLAGS',
+        'SignatureCache',
+        'ScriptTracer',
+        'ScriptProfiler',
         'EvalScriptError',
         'MaxOpCountError',
         'MissingOpArgumentsError',
@@ -845,4 +1334,7 @@ __all__ = (
         'VerifyScript',
         'VerifySignatureError',
         'VerifySignature',
+        'VerifyTransactionError',
+        'VerifyTransaction',
+        'VerifyBlockScripts',
 )
@@ -17,6 +17,7 @@ You probabably don't need to use these directly.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import hashlib
+import mmap
 import struct
 
 # Py3 compatibility
@@ -26,11 +27,17 @@ if sys.version > '3':
     _bchr = lambda x: bytes([x])
     _bord = lambda x: x[0]
     from io import BytesIO as _BytesIO
+
+    # Buffer types that Serializable.deserialize() parses in place via
+    # view_deserialize(); indexing a memoryview only returns ints on py3.
+    _VIEW_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
 else:
     _bchr = chr
     _bord = ord
     from cStringIO import StringIO as _BytesIO
 
+    _VIEW_TYPES = ()
+
 MAX_SIZE = 0x02000000
 
 
@@ -38,6 +45,42 @@ def Hash(msg):
     """SHA256^2)(msg) -> bytes"""
     return hashlib.sha256(hashlib.sha256(msg).digest()).digest()
 
+def Hash_many(msgs, executor=None):
+    """SHA256^2 of every message in msgs -> list of bytes
+
+    Cheaper than calling Hash() in a loop for large numbers of messages.
+
+    executor - Optional concurrent.futures.Executor to spread the work over.
+               hashlib only releases the GIL for messages larger than about
+               2KiB, so this only pays off for large messages such as whole
+               transactions.
+    """
+    sha256 = hashlib.sha256
+    if executor is None:
+        return [sha256(sha256(msg).digest()).digest() for msg in msgs]
+
+    msgs = list(msgs)
+    chunks = [msgs[i:i+_HASH_MANY_CHUNK_SIZE] for i in range(0, len(msgs), _HASH_MANY_CHUNK_SIZE)]
+    r = []
+    for hashes in executor.map(Hash_many, chunks):
+        r.extend(hashes)
+    return r
+
+_HASH_MANY_CHUNK_SIZE = 64
+
+def hash_pairs(level):
+    """Hash adjacent pairs of 32 byte hashes -> list of bytes
+
+    Computes the next level of a merkle tree: Hash(level[0] + level[1]),
+    Hash(level[2] + level[3]), and so on. If level has an odd number of
+    hashes the last one is paired with itself.
+    """
+    sha256 = hashlib.sha256
+    if len(level) % 2:
+        level = list(level) + [level[-1]]
+    i = iter(level)
+    return [sha256(sha256(a + b).digest()).digest() for (a, b) in zip(i, i)]
+
 def Hash160(msg):
     """RIPEME160(SHA256(msg)) -> bytes"""
     h = hashlib.new('ripemd160')
@@ -81,6 +124,60 @@ def ser_read(f, n):
         raise SerializationTruncationError('Asked to read %i bytes, but only got %i' % (n, len(r)))
     return r
 
+def view_read(view, offset, n):
+    """Read from a memoryview safely
+
+    Returns (data, offset) where data is a memoryview slice of length n and
+    offset points just past it; call bytes() on data if you need to keep it.
+    Raises SerializationError and SerializationTruncationError exactly like
+    ser_read() does. Use this in your classes view_deserialize() functions.
+    """
+    if n > MAX_SIZE:
+        raise SerializationError('Asked to read 0x%x bytes; MAX_SIZE exceeded' % n)
+    end = offset + n
+    if end > len(view):
+        raise view_truncation_error(view, offset, n)
+    return (view[offset:end], end)
+
+def view_truncation_error(view, offset, n):
+    """Return the SerializationTruncationError for a short memoryview read
+
+    Fixed-size fields are read with struct.Struct.unpack_from(), which raises
+    struct.error when the view is too short; catch that and raise this
+    instead.
+    """
+    return SerializationTruncationError('Asked to read %i bytes, but only got %i' % (n, max(len(view) - offset, 0)))
+
+
+def _stream_view_deserialize(cls, view, offset):
+    """view_deserialize() in terms of cls.stream_deserialize()"""
+    f = _BytesIO(view[offset:])
+    r = cls.stream_deserialize(f)
+    return (r, offset + f.tell())
+
+_has_view_deserialize = {}
+
+def _uses_view_deserialize(cls):
+    """True if cls.view_deserialize() can be used instead of stream_deserialize()
+
+    That's the case only if view_deserialize() is defined in the same class as
+    stream_deserialize(), or a subclass of it. A subclass that overrides just
+    stream_deserialize(), say to read an extra field, would otherwise be
+    parsed by an inherited view_deserialize() that knows nothing about it.
+    """
+    try:
+        return _has_view_deserialize[cls]
+    except KeyError:
+        pass
+    mro = cls.__mro__
+    def depth(name):
+        for (i, base) in enumerate(mro):
+            if name in base.__dict__:
+                return i
+        return len(mro)
+    r = _has_view_deserialize[cls] = depth('view_deserialize') <= depth('stream_deserialize')
+    return r
+
 
 class Serializable(object):
     """Base class for serializable objects"""
@@ -96,12 +193,34 @@ class Serializable(object):
         """Deserialize from a stream"""
         raise NotImplementedError
 
+    @classmethod
+    def view_deserialize(cls, view, offset=0):
+        """Deserialize from a memoryview, starting at offset
+
+        Returns (instance, offset) with offset pointing just past the last
+        byte consumed.
+
+        Classes that are parsed in bulk override this to read fields straight
+        out of the view; the default falls back to stream_deserialize().
+        Subclasses overriding stream_deserialize() must override this too, or
+        deserialize() will ignore it in favour of stream_deserialize().
+        """
+        return _stream_view_deserialize(cls, view, offset)
+
     def serialize(self):
         """Serialize, returning bytes"""
         f = _BytesIO()
         self.stream_serialize(f)
         return f.getvalue()
 
+    def get_serialize_size(self):
+        """Return the length of the serialized object in bytes
+
+        Subclasses override this to compute the size arithmetically; the
+        default serializes the object and measures the result.
+        """
+        return len(self.serialize())
+
     @classmethod
     def deserialize(cls, buf, allow_padding=False):
         """Deserialize bytes, returning an instance
@@ -110,7 +229,19 @@ class Serializable(object):
 
         If allow_padding is False and not all bytes are consumed during
         deserialization DeserializationExtraDataError will be raised.
+
+        bytes, bytearray, memoryview and mmap buffers are parsed in place with
+        view_deserialize() rather than being copied into a stream, unless the
+        class overrides stream_deserialize() but not view_deserialize().
         """
+        if isinstance(buf, _VIEW_TYPES) and _uses_view_deserialize(cls):
+            with memoryview(buf) as view:
+                (r, offset) = cls.view_deserialize(view, 0)
+                if not allow_padding and offset != len(view):
+                    raise DeserializationExtraDataError('Not all bytes consumed during deserialization',
+                                                        r, view[offset:].tobytes())
+            return r
+
         fd = _BytesIO(buf)
         r = cls.stream_deserialize(fd)
         if not allow_padding:
@@ -139,7 +270,7 @@ class Serializable(object):
 class ImmutableSerializable(Serializable):
     """Immutable serializable object"""
 
-    __slots__ = ['_cached_GetHash', '_cached__hash__']
+    __slots__ = ['_cached_GetHash', '_cached__hash__', '_cached_serialize']
 
     def __setattr__(self, name, value):
         raise AttributeError('Object is immutable')
@@ -147,6 +278,20 @@ class ImmutableSerializable(Serializable):
     def __delattr__(self, name):
         raise AttributeError('Object is immutable')
 
+    def serialize(self):
+        """Serialize, returning bytes
+
+        The result is cached. Subclasses may also fill the cache with the
+        original bytes when deserializing, in which case the object is never
+        re-encoded at all.
+        """
+        try:
+            return self._cached_serialize
+        except AttributeError:
+            _cached_serialize = super(ImmutableSerializable, self).serialize()
+            object.__setattr__(self, '_cached_serialize', _cached_serialize)
+            return _cached_serialize
+
     def GetHash(self):
         """Return the hash of the serialized object"""
         try:
@@ -177,6 +322,14 @@ class Serializer(object):
     def stream_deserialize(cls, f):
         raise NotImplementedError
 
+    @classmethod
+    def view_deserialize(cls, view, offset):
+        raise NotImplementedError
+
+    @classmethod
+    def get_serialize_size(cls, obj):
+        return len(cls.serialize(obj))
+
     @classmethod
     def serialize(cls, obj):
         f = _BytesIO()
@@ -190,6 +343,14 @@ class Serializer(object):
         return cls.stream_deserialize(buf)
 
 
+_uint16 = struct.Struct(b'<H')
+_uint32 = struct.Struct(b'<I')
+_uint64 = struct.Struct(b'<Q')
+_varint16 = struct.Struct(b'<BH')
+_varint32 = struct.Struct(b'<BI')
+_varint64 = struct.Struct(b'<BQ')
+
+
 class VarIntSerializer(Serializer):
     """Serialization of variable length ints"""
     @classmethod
@@ -199,14 +360,11 @@ class VarIntSerializer(Serializer):
         elif i < 0xfd:
             f.write(_bchr(i))
         elif i <= 0xffff:
-            f.write(_bchr(0xfd))
-            f.write(struct.pack(b'<H', i))
+            f.write(_varint16.pack(0xfd, i))
         elif i <= 0xffffffff:
-            f.write(_bchr(0xfe))
-            f.write(struct.pack(b'<I', i))
+            f.write(_varint32.pack(0xfe, i))
         else:
-            f.write(_bchr(0xff))
-            f.write(struct.pack(b'<Q', i))
+            f.write(_varint64.pack(0xff, i))
 
     @classmethod
     def stream_deserialize(cls, f):
@@ -214,11 +372,41 @@ class VarIntSerializer(Serializer):
         if r < 0xfd:
             return r
         elif r == 0xfd:
-            return struct.unpack(b'<H', ser_read(f, 2))[0]
+            return _uint16.unpack(ser_read(f, 2))[0]
         elif r == 0xfe:
-            return struct.unpack(b'<I', ser_read(f, 4))[0]
+            return _uint32.unpack(ser_read(f, 4))[0]
         else:
-            return struct.unpack(b'<Q', ser_read(f, 8))[0]
+            return _uint64.unpack(ser_read(f, 8))[0]
+
+    @classmethod
+    def view_deserialize(cls, view, offset):
+        try:
+            r = view[offset]
+            if r < 0xfd:
+                return (r, offset + 1)
+            elif r == 0xfd:
+                return (_uint16.unpack_from(view, offset + 1)[0], offset + 3)
+            elif r == 0xfe:
+                return (_uint32.unpack_from(view, offset + 1)[0], offset + 5)
+            else:
+                return (_uint64.unpack_from(view, offset + 1)[0], offset + 9)
+        except IndexError:
+            raise view_truncation_error(view, offset, 1)
+        except struct.error:
+            raise view_truncation_error(view, offset + 1, {0xfd: 2, 0xfe: 4, 0xff: 8}[r])
+
+    @classmethod
+    def get_serialize_size(cls, i):
+        if i < 0:
+            raise ValueError('varint must be non-negative integer')
+        elif i < 0xfd:
+            return 1
+        elif i <= 0xffff:
+            return 3
+        elif i <= 0xffffffff:
+            return 5
+        else:
+            return 9
 
 
 class BytesSerializer(Serializer):
@@ -233,6 +421,16 @@ class BytesSerializer(Serializer):
         l = VarIntSerializer.stream_deserialize(f)
         return ser_read(f, l)
 
+    @classmethod
+    def view_deserialize(cls, view, offset):
+        (l, offset) = VarIntSerializer.view_deserialize(view, offset)
+        (data, offset) = view_read(view, offset, l)
+        return (data.tobytes(), offset)
+
+    @classmethod
+    def get_serialize_size(cls, b):
+        return VarIntSerializer.get_serialize_size(len(b)) + len(b)
+
 
 class VectorSerializer(Serializer):
     """Base class for serializers of object vectors"""
@@ -255,6 +453,26 @@ class VectorSerializer(Serializer):
             r.append(inner_cls.stream_deserialize(f))
         return r
 
+    @classmethod
+    def view_deserialize(cls, inner_cls, view, offset):
+        (n, offset) = VarIntSerializer.view_deserialize(view, offset)
+        if _uses_view_deserialize(inner_cls):
+            inner_view_deserialize = inner_cls.view_deserialize
+        else:
+            inner_view_deserialize = lambda view, offset: _stream_view_deserialize(inner_cls, view, offset)
+        r = []
+        for i in range(n):
+            (obj, offset) = inner_view_deserialize(view, offset)
+            r.append(obj)
+        return (r, offset)
+
+    @classmethod
+    def get_serialize_size(cls, inner_cls, objs):
+        r = VarIntSerializer.get_serialize_size(len(objs))
+        for obj in objs:
+            r += inner_cls.get_serialize_size(obj)
+        return r
+
 
 class uint256VectorSerializer(Serializer):
     """Serialize vectors of uint256"""
@@ -273,6 +491,17 @@ class uint256VectorSerializer(Serializer):
             r.append(ser_read(f, 32))
         return r
 
+    @classmethod
+    def view_deserialize(cls, view, offset):
+        (n, offset) = VarIntSerializer.view_deserialize(view, offset)
+        (data, end) = view_read(view, offset, 32 * n)
+        data = data.tobytes()
+        return ([data[i:i+32] for i in range(0, len(data), 32)], end)
+
+    @classmethod
+    def get_serialize_size(cls, uints):
+        return VarIntSerializer.get_serialize_size(len(uints)) + 32 * len(uints)
+
 
 class intVectorSerializer(Serializer):
 
@@ -291,6 +520,10 @@ class intVectorSerializer(Serializer):
             ints.append(struct.unpack(b"<i", ser_read(f, 4))[0])
         return ints
 
+    @classmethod
+    def get_serialize_size(cls, ints):
+        return VarIntSerializer.get_serialize_size(len(ints)) + 4 * len(ints)
+
 
 class VarStringSerializer(Serializer):
     """Serialize variable length strings"""
@@ -305,6 +538,14 @@ class VarStringSerializer(Serializer):
         l = VarIntSerializer.stream_deserialize(f)
         return ser_read(f, l)
 
+    @classmethod
+    def view_deserialize(cls, view, offset):
+        return BytesSerializer.view_deserialize(view, offset)
+
+    @classmethod
+    def get_serialize_size(cls, s):
+        return BytesSerializer.get_serialize_size(s)
+
 
 def uint256_from_str(s):
     """Convert bytes to uint256"""
@@ -359,11 +600,15 @@ def uint256_to_shortstr(u):
 __all__ = (
         'MAX_SIZE',
         'Hash',
+        'Hash_many',
+        'hash_pairs',
         'Hash160',
         'SerializationError',
         'SerializationTruncationError',
         'DeserializationExtraDataError',
         'ser_read',
+        'view_read',
+        'view_truncation_error',
         'Serializable',
         'ImmutableSerializable',
         'Serializer',
@@ -109,6 +109,20 @@ class MsgSerializable(Serializable):
         data = self.to_bytes()
         f.write(data)
 
+    def msg_ser_size(self):
+        """Return the length of the message body in bytes
+
+        Subclasses override this to avoid serializing the body; the default
+        serializes it with msg_ser() and measures the result.
+        """
+        f = _BytesIO()
+        self.msg_ser(f)
+        return len(f.getvalue())
+
+    def get_serialize_size(self):
+        # magic, command, length and checksum, followed by the body
+        return 4 + 12 + 4 + 4 + self.msg_ser_size()
+
 
 class msg_version(MsgSerializable):
     command = b"version"
@@ -177,6 +191,9 @@ class msg_verack(MsgSerializable):
     def msg_ser(self, f):
         f.write(b"")
 
+    def msg_ser_size(self):
+        return 0
+
     def __repr__(self):
         return "msg_verack()"
 
@@ -217,6 +234,9 @@ class msg_alert(MsgSerializable):
     def msg_ser(self, f):
         self.alert.stream_serialize(f)
 
+    def msg_ser_size(self):
+        return self.alert.get_serialize_size()
+
     def __repr__(self):
         return "msg_alert(alert=%s)" % (repr(self.alert), )
 
@@ -237,6 +257,9 @@ class msg_inv(MsgSerializable):
     def msg_ser(self, f):
         VectorSerializer.stream_serialize(CInv, self.inv, f)
 
+    def msg_ser_size(self):
+        return VectorSerializer.get_serialize_size(CInv, self.inv)
+
     def __repr__(self):
         return "msg_inv(inv=%s)" % (repr(self.inv))
 
@@ -257,6 +280,9 @@ class msg_getdata(MsgSerializable):
     def msg_ser(self, f):
         VectorSerializer.stream_serialize(CInv, self.inv, f)
 
+    def msg_ser_size(self):
+        return VectorSerializer.get_serialize_size(CInv, self.inv)
+
     def __repr__(self):
         return "msg_getdata(inv=%s)" % (repr(self.inv))
 
@@ -276,6 +302,9 @@ class msg_notfound(MsgSerializable):
     def msg_ser(self, f):
         VectorSerializer.stream_serialize(CInv, self.inv, f)
 
+    def msg_ser_size(self):
+        return VectorSerializer.get_serialize_size(CInv, self.inv)
+
     def __repr__(self):
         return "msg_notfound(inv=%s)" % (repr(self.inv))
 
@@ -299,6 +328,9 @@ class msg_getblocks(MsgSerializable):
         self.locator.stream_serialize(f)
         f.write(self.hashstop)
 
+    def msg_ser_size(self):
+        return self.locator.get_serialize_size() + 32
+
     def __repr__(self):
         return "msg_getblocks(locator=%s hashstop=%s)" % (repr(self.locator), b2x(self.hashstop))
 
@@ -322,6 +354,9 @@ class msg_getheaders(MsgSerializable):
         self.locator.stream_serialize(f)
         f.write(self.hashstop)
 
+    def msg_ser_size(self):
+        return self.locator.get_serialize_size() + 32
+
     def __repr__(self):
         return "msg_getheaders(locator=%s hashstop=%s)" % (repr(self.locator), b2x(self.hashstop))
 
@@ -342,6 +377,9 @@ class msg_headers(MsgSerializable):
     def msg_ser(self, f):
         VectorSerializer.stream_serialize(CBlock, self.headers, f)
 
+    def msg_ser_size(self):
+        return VectorSerializer.get_serialize_size(CBlock, self.headers)
+
     def __repr__(self):
         return "msg_headers(headers=%s)" % (repr(self.headers))
 
@@ -362,6 +400,9 @@ class msg_tx(MsgSerializable):
     def msg_ser(self, f):
         self.tx.stream_serialize(f)
 
+    def msg_ser_size(self):
+        return self.tx.get_serialize_size()
+
     def __repr__(self):
         return "msg_tx(tx=%s)" % (repr(self.tx))
 
@@ -382,6 +423,9 @@ class msg_block(MsgSerializable):
     def msg_ser(self, f):
         self.block.stream_serialize(f)
 
+    def msg_ser_size(self):
+        return self.block.get_serialize_size()
+
     def __repr__(self):
         return "msg_block(block=%s)" % (repr(self.block))
 
@@ -399,6 +443,9 @@ class msg_getaddr(MsgSerializable):
     def msg_ser(self, f):
         pass
 
+    def msg_ser_size(self):
+        return 0
+
     def __repr__(self):
         return "msg_getaddr()"
 
@@ -419,6 +466,9 @@ class msg_ping(MsgSerializable):
     def msg_ser(self, f):
         f.write(struct.pack(b"<Q", self.nonce))
 
+    def msg_ser_size(self):
+        return 8
+
     def __repr__(self):
         return "msg_ping(0x%x)" % (self.nonce,)
 
@@ -439,6 +489,9 @@ class msg_pong(MsgSerializable):
     def msg_ser(self, f):
         f.write(struct.pack(b"<Q", self.nonce))
 
+    def msg_ser_size(self):
+        return 8
+
     def __repr__(self):
         return "msg_pong(0x%x)" % (self.nonce,)
 
@@ -482,6 +535,9 @@ class msg_mempool(MsgSerializable):
     def msg_ser(self, f):
         pass
 
+    def msg_ser_size(self):
+        return 0
+
     def __repr__(self):
         return "msg_mempool()"
 
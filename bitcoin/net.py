@@ -93,6 +93,9 @@ class CInv(Serializable):
         f.write(struct.pack(b"<i", self.type))
         f.write(self.hash)
 
+    def get_serialize_size(self):
+        return 4 + 32
+
     def __repr__(self):
         return "CInv(type=%s hash=%s)" % (self.typemap[self.type], b2lx(self.hash))
 
@@ -113,6 +116,9 @@ class CBlockLocator(Serializable):
         f.write(struct.pack(b"<i", self.nVersion))
         uint256VectorSerializer.stream_serialize(self.vHave, f)
 
+    def get_serialize_size(self):
+        return 4 + uint256VectorSerializer.get_serialize_size(self.vHave)
+
     def __repr__(self):
         return "CBlockLocator(nVersion=%i vHave=%s)" % (self.nVersion, repr(self.vHave))
 
@@ -186,6 +192,10 @@ class CAlert(Serializable):
         VarStringSerializer.stream_serialize(self.vchMsg, f)
         VarStringSerializer.stream_serialize(self.vchSig, f)
 
+    def get_serialize_size(self):
+        return (VarStringSerializer.get_serialize_size(self.vchMsg) +
+                VarStringSerializer.get_serialize_size(self.vchSig))
+
     def __repr__(self):
         return "CAlert(vchMsg.sz %d, vchSig.sz %d)" % (len(self.vchMsg), len(self.vchSig))
 
@@ -16,6 +16,7 @@ import unittest
 import os
 
 from bitcoin.core import *
+from bitcoin.core.script import CScript
 
 def load_test_vectors(name):
     with open(os.path.dirname(__file__) + '/data/' + name, 'r') as fd:
@@ -58,3 +59,37 @@ class Test_CheckBlock(unittest.TestCase):
                 continue
 
             self.fail('Invalid block "%s" passed checks' % comment)
+
+    def test_checkblock_executor(self):
+        try:
+            from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        except ImportError:
+            return
+
+        def check(blk, fCheckPoW, cur_time, executor=None):
+            try:
+                CheckBlock(blk, fCheckPoW=fCheckPoW, cur_time=cur_time, executor=executor)
+            except ValidationError as err:
+                return (err.__class__, str(err))
+
+        # Several errors spread over more than one chunk; the first in block
+        # order must win.
+        coinbase = CTransaction([CTxIn(COutPoint(), CScript([1, 2]))], [CTxOut(50*COIN, CScript())])
+        txs = [CTransaction([CTxIn(COutPoint(Hash(x('%04x' % i)), 0))], [CTxOut(COIN, CScript())])
+               for i in range(200)]
+        txs[100] = txs[99]
+        txs[150] = CTransaction([], [CTxOut(COIN, CScript())])
+        multi_err_blk = CBlock(vtx=[coinbase] + txs)
+
+        for executor in (ThreadPoolExecutor(2), ProcessPoolExecutor(2)):
+            with executor:
+                self.assertEqual(check(multi_err_blk, False, 0, executor),
+                                 (CheckBlockError, 'CheckBlock() : duplicate transaction'))
+
+                for name in ('checkblock_valid.json', 'checkblock_invalid.json'):
+                    for comment, fHeader, fCheckPoW, cur_time, blk in load_test_vectors(name):
+                        if fHeader:
+                            continue
+                        self.assertEqual(check(blk, fCheckPoW, cur_time, executor),
+                                         check(blk, fCheckPoW, cur_time),
+                                         comment)
@@ -0,0 +1,320 @@
+# Copyright (C) 2013-2014 The python-bitcoinlib developers
+#
+# This file is part of python-bitcoinlib.
+#
+# It is subject to the license terms in the LICENSE file found in the top-level
+# directory of this distribution.
+#
+# No part of python-bitcoinlib, including this file, may be copied, modified,
+# propagated, or distributed except according to the terms contained in the
+# LICENSE file.
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bitcoin.core import *
+from bitcoin.core.headers import *
+from bitcoin.core.serialize import compact_from_uint256, uint256_from_compact, uint256_from_str
+
+class RetargetParams(CoreRegTestParams):
+    # Regtest, but retargeting every four blocks
+    POW_NO_RETARGETING = False
+    POW_TARGET_TIMESPAN = 4 * 10 * 60
+
+class MinDifficultyParams(RetargetParams):
+    POW_ALLOW_MIN_DIFFICULTY_BLOCKS = True
+
+def mine(prev, nTime, nBits=0x207fffff, nVersion=2):
+    """Mine a header on top of prev"""
+    target = uint256_from_compact(nBits)
+    nNonce = 0
+    while True:
+        header = CBlockHeader(nVersion=nVersion, hashPrevBlock=prev.GetHash(), nTime=nTime, nBits=nBits, nNonce=nNonce)
+        if uint256_from_str(header.GetHash()) <= target:
+            return header
+        nNonce += 1
+
+def mine_chain(prev, n, spacing=600, nBits=0x207fffff, nVersion=2):
+    r = []
+    for i in range(n):
+        prev = mine(prev, prev.nTime + spacing, nBits, nVersion)
+        r.append(prev)
+    return r
+
+
+class Test_CalculateNextWorkRequired(unittest.TestCase):
+    def test(self):
+        def T(nFirstBlockTime, nLastBlockTime, nBits, expected):
+            actual = CalculateNextWorkRequired(nBits, nFirstBlockTime, nLastBlockTime, CoreMainParams())
+            self.assertEqual(actual, expected)
+        T(1261130161, 1262152739, 0x1d00ffff, 0x1d00d86a) # block #32256
+        T(1231006505, 1233061996, 0x1d00ffff, 0x1d00ffff) # limited by PROOF_OF_WORK_LIMIT
+        T(1279008237, 1279297671, 0x1c05a3f4, 0x1c0168fd) # lower limit of actual timespan
+        T(1263163443, 1269211443, 0x1c387f6f, 0x1d00e1fd) # upper limit of actual timespan
+
+class Test_GetBlockProof(unittest.TestCase):
+    def test(self):
+        self.assertEqual(GetBlockProof(0x1d00ffff), 0x100010001)
+        self.assertEqual(GetBlockProof(0x207fffff), 2)
+        self.assertEqual(GetBlockProof(0), 0)
+
+def linked_headers(n, prev_hash=b'\x00'*32):
+    r = []
+    for i in range(n):
+        header = CBlockHeader(hashPrevBlock=prev_hash, nTime=i, nBits=0x207fffff, nNonce=i)
+        prev_hash = header.GetHash()
+        r.append(header)
+    return r
+
+class Test_HeaderStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'headers.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_store(self, store, headers):
+        self.assertEqual(len(store), len(headers))
+        self.assertEqual(store.tip_hash, headers[-1].GetHash() if headers else None)
+        for (height, header) in enumerate(headers):
+            self.assertEqual(store[height], header)
+            self.assertEqual(store.get_hash(height), header.GetHash())
+            self.assertEqual(store.get_height(header.GetHash()), height)
+            self.assertEqual(store.get_time_bits(height), (header.nTime, header.nBits))
+
+    def test_memory(self):
+        store = HeaderStore()
+        headers = linked_headers(600)
+        for header in headers:
+            store.append(header.serialize())
+        self.check_store(store, headers)
+        self.assertEqual(list(store), headers)
+        self.assertNotIn(b'\x00'*32, store)
+        with self.assertRaises(KeyError):
+            store.get_height(b'\x00'*32)
+        with self.assertRaises(IndexError):
+            store[600]
+
+        with self.assertRaises(ValueError):
+            store.append(headers[0].serialize())
+
+        store.truncate(300)
+        self.check_store(store, headers[:300])
+        self.assertNotIn(headers[300].GetHash(), store)
+
+        others = linked_headers(400, headers[299].GetHash())
+        for header in others:
+            store.append(header.serialize())
+        self.check_store(store, headers[:300] + others)
+
+    def test_file(self):
+        headers = linked_headers(2000)
+        with HeaderStore(self.path) as store:
+            for header in headers[:1500]:
+                store.append(header.serialize())
+        self.assertEqual(os.path.getsize(self.path), 1500 * 80)
+
+        with HeaderStore(self.path) as store:
+            self.check_store(store, headers[:1500])
+            store.truncate(1000)
+            for header in headers[1000:]:
+                store.append(header.serialize())
+            self.check_store(store, headers)
+
+            # Unclean shutdown, leaving preallocated space in the file
+            store.flush()
+            self.assertGreater(os.path.getsize(self.path), 2000 * 80)
+            self.check_store(HeaderStore(self.path), headers)
+
+    def test_closed(self):
+        for store in (HeaderStore(), HeaderStore(self.path)):
+            header = linked_headers(1)[0]
+            store.append(header.serialize())
+            store.close()
+            store.close()
+
+            for f in (lambda: len(store), lambda: store[0], lambda: header.GetHash() in store,
+                      lambda: store.tip_hash, lambda: store.get_hash(0), lambda: store.get_height(header.GetHash()),
+                      lambda: store.get_time_bits(0), lambda: store.append(header.serialize()),
+                      lambda: store.truncate(0), store.flush):
+                with self.assertRaises(ValueError):
+                    f()
+        self.assertEqual(os.path.getsize(self.path), 80)
+
+class Test_HeaderChain(unittest.TestCase):
+    def setUp(self):
+        self.params = CoreRegTestParams()
+        self.genesis = self.params.GENESIS_BLOCK.get_header()
+
+    def test_genesis(self):
+        chain = HeaderChain(params=CoreMainParams())
+        self.assertEqual(len(chain), 1)
+        self.assertEqual(chain.height, 0)
+        self.assertEqual(chain.tip_hash, lx('000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f'))
+        self.assertEqual(chain.tip, CoreMainParams.GENESIS_BLOCK.get_header())
+        self.assertEqual(chain.chainwork, 0x100010001)
+
+    def test_add_headers(self):
+        chain = HeaderChain(params=self.params)
+        headers = mine_chain(self.genesis, 20)
+
+        self.assertEqual(chain.add_headers(headers[:10]), 10)
+        self.assertEqual(chain.add_headers(headers), 10)
+        self.assertEqual(chain.add_headers(headers), 0)
+
+        self.assertEqual(chain.height, 20)
+        self.assertEqual(chain.tip, headers[-1])
+        self.assertEqual(chain.chainwork, 2 * 21)
+        for (height, header) in enumerate([self.genesis] + headers):
+            self.assertEqual(chain[height], header)
+            self.assertEqual(chain.get_hash(height), header.GetHash())
+            self.assertEqual(chain.get_height(header.GetHash()), height)
+            self.assertIn(header.GetHash(), chain)
+        self.assertEqual(chain[-1], headers[-1])
+
+        with self.assertRaises(IndexError):
+            chain[21]
+        with self.assertRaises(KeyError):
+            chain.get_height(b'\x00'*32)
+
+        locator = chain.get_locator()
+        self.assertEqual(locator[:10], [h.GetHash() for h in reversed(headers[-10:])])
+        self.assertEqual(locator[-1], self.genesis.GetHash())
+
+    def test_invalid_headers(self):
+        chain = HeaderChain(params=self.params)
+        headers = mine_chain(self.genesis, 3)
+        chain.add_headers(headers)
+
+        with self.assertRaises(HeaderChainError):
+            chain.add_headers(mine_chain(mine(self.genesis, 12345), 1))
+
+        # Timestamp not after the median of the previous blocks
+        with self.assertRaises(HeaderChainError):
+            chain.add_headers([mine(headers[-1], headers[0].nTime)])
+
+        with self.assertRaises(HeaderChainError):
+            chain.add_headers([mine(headers[-1], headers[-1].nTime + 600, nBits=0x2000ffff)])
+
+        with self.assertRaises(CheckProofOfWorkError):
+            chain.add_headers([CBlockHeader(hashPrevBlock=headers[-1].GetHash(), nTime=headers[-1].nTime + 600,
+                                            nBits=0x1d00ffff)])
+
+        with self.assertRaises(CheckBlockHeaderError):
+            chain.add_headers([mine(headers[-1], headers[-1].nTime + 600)], cur_time=0)
+
+        self.assertEqual(chain.tip, headers[-1])
+
+    def test_store(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'headers.dat')
+            headers = mine_chain(self.genesis, 10)
+            with HeaderStore(path) as store:
+                chain = HeaderChain(params=self.params, store=store)
+                chain.add_headers(headers)
+
+            with HeaderStore(path) as store:
+                chain = HeaderChain(params=self.params, store=store)
+                self.assertEqual(chain.tip, headers[-1])
+                self.assertEqual(chain.chainwork, 2 * 11)
+
+                with self.assertRaises(ValueError):
+                    HeaderChain(params=CoreMainParams(), store=store)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_reorganize(self):
+        chain = HeaderChain(params=self.params)
+        a = mine_chain(self.genesis, 5)
+        b = mine_chain(a[1], 3, nVersion=3)
+        chain.add_headers(a)
+
+        # Equal work doesn't cause a reorg
+        chain.add_headers(b)
+        self.assertEqual(chain.tip, a[-1])
+        self.assertEqual(chain.chainwork, 2 * 6)
+
+        b += mine_chain(b[-1], 1, nVersion=3)
+        chain.add_headers(b[-1:])
+        self.assertEqual(chain.tip, b[-1])
+        self.assertEqual(chain.height, 6)
+        self.assertEqual(chain.chainwork, 2 * 7)
+        self.assertEqual(chain[2], a[1])
+        self.assertEqual(chain[3], b[0])
+        self.assertNotIn(a[2].GetHash(), chain)
+
+        # Back to the original branch
+        a += mine_chain(a[-1], 2)
+        chain.add_headers(a)
+        self.assertEqual(chain.tip, a[-1])
+        self.assertEqual(chain.height, 7)
+        for (height, header) in enumerate([self.genesis] + a):
+            self.assertEqual(chain[height], header)
+            self.assertEqual(chain.get_height(header.GetHash()), height)
+        self.assertNotIn(b[0].GetHash(), chain)
+
+    def test_side_branches(self):
+        chain = HeaderChain(params=self.params, max_reorg_depth=5)
+        a = mine_chain(self.genesis, 10)
+        chain.add_headers(a)
+
+        with self.assertRaises(HeaderChainError):
+            chain.add_headers(mine_chain(a[3], 1, nVersion=3))
+
+        b = mine_chain(a[4], 3, nVersion=3)
+        self.assertEqual(chain.add_headers(b), 3)
+        self.assertEqual(chain.tip, a[-1])
+
+        # b has the work the best chain had at height 8, so it's kept until
+        # the tip is more than five headers past that
+        a += mine_chain(a[-1], 3)
+        chain.add_headers(a)
+        self.assertEqual(chain.add_headers(b), 0)
+
+        a += mine_chain(a[-1], 1)
+        chain.add_headers(a)
+        self.assertEqual(chain._side, {})
+        with self.assertRaises(HeaderChainError):
+            chain.add_headers(b[-1:])
+        self.assertEqual(chain.tip, a[-1])
+
+    def test_retarget(self):
+        params = RetargetParams()
+        chain = HeaderChain(params=params)
+
+        # Blocks faster than the target spacing lower the target
+        headers = mine_chain(self.genesis, 3, spacing=300)
+        chain.add_headers(headers)
+
+        nBits = CalculateNextWorkRequired(0x207fffff, self.genesis.nTime, headers[-1].nTime, params)
+        self.assertEqual(nBits, compact_from_uint256(uint256_from_compact(0x207fffff) * 900 // 2400))
+        with self.assertRaises(HeaderChainError):
+            chain.add_headers([mine(headers[-1], headers[-1].nTime + 300)])
+
+        headers = mine_chain(headers[-1], 3, spacing=300, nBits=nBits)
+        chain.add_headers(headers)
+        self.assertEqual(chain.height, 6)
+        self.assertEqual(chain.chainwork, 2 * 4 + 3 * GetBlockProof(nBits))
+
+    def test_min_difficulty_blocks(self):
+        params = MinDifficultyParams()
+        chain = HeaderChain(params=params)
+        headers = mine_chain(self.genesis, 3, spacing=300)
+        nBits = CalculateNextWorkRequired(0x207fffff, self.genesis.nTime, headers[-1].nTime, params)
+        headers += mine_chain(headers[-1], 1, spacing=300, nBits=nBits)
+
+        # More than twice the target spacing allows minimum difficulty...
+        headers += mine_chain(headers[-1], 1, spacing=1201)
+        # ...after which the last regular difficulty applies again
+        headers += mine_chain(headers[-1], 1, spacing=300, nBits=nBits)
+        chain.add_headers(headers)
+        self.assertEqual(chain.height, 6)
+
+        with self.assertRaises(HeaderChainError):
+            chain.add_headers([mine(headers[-1], headers[-1].nTime + 300)])
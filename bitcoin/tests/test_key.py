@@ -13,11 +13,30 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import unittest
 
+import bitcoin.core.key
 from bitcoin.core.key import *
-from bitcoin.core import x
+from bitcoin.core import x, Hash
+from bitcoin.core.script import IsLowDERSignature
+
+def backends():
+    """Run the body of the loop once with each available ECDSA backend"""
+    prev_backend = bitcoin.core.key.backend
+    try:
+        for name in ('openssl', 'secp256k1'):
+            try:
+                SelectBackend(name)
+            except ValueError:
+                continue
+            yield name
+    finally:
+        bitcoin.core.key.backend = prev_backend
 
 class Test_CPubKey(unittest.TestCase):
     def test(self):
+        for name in backends():
+            self.check_validity()
+
+    def check_validity(self):
         def T(hex_pubkey, is_valid, is_fullyvalid, is_compressed):
             key = CPubKey(x(hex_pubkey))
             self.assertEqual(key.is_valid, is_valid)
@@ -39,3 +58,180 @@ class Test_CPubKey(unittest.TestCase):
 
         T('0478d430274f8c5ec1321338151e9f27f4c676a008bdf8638d07c0b6be9ab35c71a1518063243acd4dfe96b66e3f2ec8013c8e072cd09b3834a19f81f659cc3455',
           True, True, False)
+
+    def test_sign_verify(self):
+        from bitcoin.wallet import CKey
+
+        sigs = []
+        for name in backends():
+            key = CKey(Hash(b'backend'))
+            self.assertEqual(key.pub, x('02f3fd9d4dd4987c4d00ed2948bbc05c77ebc44b5ef0dba4adb538add4a1b00de5'))
+            sig = key.sign(Hash(b'msg'))
+            self.assertTrue(IsLowDERSignature(sig))
+            sigs.append(sig)
+
+            (compact_sig, recid) = key.sign_compact(Hash(b'msg'))
+            self.assertEqual(CPubKey.recover_compact(Hash(b'msg'), bytes(bytearray([31 + recid])) + compact_sig), key.pub)
+            self.assertNotEqual(CPubKey.recover_compact(Hash(b'other'), bytes(bytearray([31 + recid])) + compact_sig), key.pub)
+
+        # Signatures from any backend verify with every other
+        for name in backends():
+            pub = CPubKey(key.pub)
+            for sig in sigs:
+                self.assertTrue(pub.verify(Hash(b'msg'), sig))
+                self.assertFalse(pub.verify(Hash(b'other'), sig))
+            self.assertFalse(pub.verify(Hash(b'msg'), b''))
+            self.assertFalse(pub.verify(Hash(b'msg'), b'\x30\x00'))
+
+            # Excess R padding isn't DER, but was valid before BIP66
+            sig = bytearray(sigs[0])
+            padded_sig = bytes(bytearray([0x30, sig[1] + 1, 0x02, sig[3] + 1, 0x00]) + sig[4:])
+            self.assertTrue(pub.verify(Hash(b'msg'), padded_sig))
+            self.assertFalse(CPubKey(b'').verify(Hash(b'msg'), sigs[0]))
+
+    def test_cec_key(self):
+        from bitcoin.wallet import CKey
+
+        for name in backends():
+            key = CKey(Hash(b'backend'))
+            self.assertIsInstance(key._cec_key, CECKey)
+            self.assertEqual(key._cec_key.get_pubkey(), key.pub)
+            self.assertIsInstance(key.pub._cec_key, CECKey)
+            self.assertTrue(key.pub._cec_key.verify(Hash(b'msg'), key.sign(Hash(b'msg'))))
+            with self.assertRaises(AttributeError):
+                key.pub._cec_key = CECKey()
+
+            # Modifying it doesn't affect the cached key other CPubKeys share
+            key.pub._cec_key.set_compressed(False)
+            self.assertIsNot(key.pub._cec_key, key.pub._cec_key)
+            self.assertEqual(CPubKey(key.pub)._cec_key.get_pubkey(), key.pub)
+            if name == 'openssl':
+                self.assertEqual(CPubKey(key.pub)._key.get_pubkey(), key.pub)
+
+    def test_select_backend(self):
+        with self.assertRaises(ValueError):
+            SelectBackend('foo')
+        self.assertIn(bitcoin.core.key.backend.name, ('openssl', 'secp256k1'))
+
+    def test_parse_der_lax(self):
+        from bitcoin.core.key import _ParseDERSignatureLax as T
+
+        self.assertEqual(T(x('3006020101020102')), b'\x00'*31 + b'\x01' + b'\x00'*31 + b'\x02')
+        # Long-form lengths and excess padding, accepted before BIP66
+        self.assertEqual(T(x('308106028101010203000002')), b'\x00'*31 + b'\x01' + b'\x00'*31 + b'\x02')
+        # Too-large integers parse, but as a signature nothing verifies
+        self.assertEqual(T(x('3026022101' + '01'*32 + '020102')), b'\x00'*64)
+        self.assertIsNone(T(b''))
+        self.assertIsNone(T(x('3006020501')))
+
+
+class Test_CECKey(unittest.TestCase):
+    def test_threads(self):
+        import threading
+
+        # Each thread has its own BN_CTX
+        errors = []
+        def T(n):
+            try:
+                k = CECKey()
+                k.set_secretbytes(Hash(x('%02x' % n)))
+                k.set_compressed(True)
+                for i in range(20):
+                    h = Hash(x('%02x%02x' % (n, i)))
+                    (sig, recid) = k.sign_compact(h)
+                    recovered = CECKey()
+                    recovered.set_compressed(True)
+                    self.assertEqual(recovered.recover(sig[0:32], sig[32:64], h, 32, recid, 1), 1)
+                    self.assertEqual(recovered.get_pubkey(), k.get_pubkey())
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=T, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_sign_compact(self):
+        for compressed in (True, False):
+            k = CECKey()
+            k.set_secretbytes(Hash(b'sign_compact'))
+            k.set_compressed(compressed)
+            for i in range(20):
+                h = Hash(x('%02x' % i))
+                (sig, recid) = k.sign_compact(h)
+                self.assertEqual(len(sig), 64)
+                self.assertIn(recid, (0, 1))
+                meta = 27 + recid + (4 if compressed else 0)
+                self.assertEqual(CPubKey.recover_compact(h, bytes(bytearray([meta])) + sig), k.get_pubkey())
+
+    def test_signature_to_low_s(self):
+        k = CECKey()
+        sig = k.signature_to_low_s(x('3006020101020102'))
+        self.assertEqual(sig, x('3006020101020102'))
+        # s = order - 2
+        sig = k.signature_to_low_s(x('3026020101022100fffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd036413f'))
+        self.assertEqual(sig, x('3006020101020102'))
+
+
+class Test_PubKeyCache(unittest.TestCase):
+    def test(self):
+        prev_cache = bitcoin.core.key.pubkey_cache
+        cache = bitcoin.core.key.pubkey_cache = PubKeyCache(max_size=2)
+        try:
+            a = x('0378d430274f8c5ec1321338151e9f27f4c676a008bdf8638d07c0b6be9ab35c71')
+            b = x('02f3fd9d4dd4987c4d00ed2948bbc05c77ebc44b5ef0dba4adb538add4a1b00de5')
+            c = x('02' + 'ff'*32)
+
+            self.assertIs(CPubKey(a)._key, CPubKey(a)._key)
+            CPubKey(b)
+            self.assertEqual((len(cache), cache.hits, cache.misses), (2, 1, 2))
+
+            # Well-formed but invalid pubkeys are cached too, evicting b, the
+            # least recently used
+            self.assertTrue(CPubKey(a).is_fullyvalid)
+            self.assertFalse(CPubKey(c).is_fullyvalid)
+            self.assertFalse(CPubKey(c).is_fullyvalid)
+            self.assertTrue(CPubKey(a).is_fullyvalid)
+            self.assertEqual((len(cache), cache.hits, cache.misses), (2, 4, 3))
+            CPubKey(b)
+            self.assertEqual((len(cache), cache.hits, cache.misses), (2, 4, 4))
+
+            cache.clear()
+            self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+            bitcoin.core.key.pubkey_cache = None
+            self.assertIsNot(CPubKey(a)._key, CPubKey(a)._key)
+            self.assertEqual(len(cache), 0)
+        finally:
+            bitcoin.core.key.pubkey_cache = prev_cache
+
+
+class Test_verify_batch(unittest.TestCase):
+    def test(self):
+        import concurrent.futures
+        from bitcoin.wallet import CKey
+
+        keys = [CKey(Hash(b'verify_batch' + x('%02x' % i))) for i in range(3)]
+        items = []
+        for i in range(200):
+            key = keys[i % 3]
+            h = Hash(x('%04x' % i))
+            sig = key.sign(h)
+            if i in (77, 150):
+                h = Hash(h)
+            items.append((key.pub, h, sig))
+        items.append((b'\x02', Hash(b''), items[0][2]))
+        expected = [i not in (77, 150, 200) for i in range(201)]
+
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            for name in backends():
+                for kwargs in ({}, {'workers': 2}, {'executor': executor}):
+                    self.assertEqual(verify_batch(items, **kwargs), expected)
+                    self.assertFalse(verify_batch(items, all_valid=True, **kwargs))
+                    self.assertTrue(verify_batch(items[:77], all_valid=True, **kwargs))
+                    self.assertTrue(verify_batch(iter(items[:77]), all_valid=True, **kwargs))
+
+        self.assertEqual(verify_batch([]), [])
+        self.assertTrue(verify_batch([], all_valid=True))
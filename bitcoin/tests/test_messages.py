@@ -27,6 +27,7 @@ class MessageTestCase(unittest.TestCase):
     def serialization_test(self, cls):
         m = cls()
         mSerialized = m.to_bytes()
+        self.assertEqual(m.get_serialize_size(), len(mSerialized))
         mDeserialzed = cls.from_bytes(mSerialized)
         mSerialzedTwice = mDeserialzed.to_bytes()
         self.assertEqual(mSerialized, mSerialzedTwice)
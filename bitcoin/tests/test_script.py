@@ -14,6 +14,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import unittest
 import os
 
+import bitcoin.core.script
 from bitcoin.core import b2x,x
 from bitcoin.core.script import *
 
@@ -410,6 +411,73 @@ class Test_CScript(unittest.TestCase):
         # invalid opcodes do not by themselves make a script invalid
         T('ff', True)
 
+    def test_parse(self):
+        s = CScript([OP_DUP, x('0011'), OP_CHECKSIG])
+        (ops, err) = s._parse()
+        self.assertEqual(ops, ((OP_DUP, None, 0), (0x02, x('0011'), 1), (OP_CHECKSIG, None, 4)))
+        self.assertIsNone(err)
+
+        # Parsed once per script bytes
+        self.assertIs(CScript(x(b2x(s)))._parse(), s._parse())
+
+        # ...but push-only scripts, like scriptSigs, and long scripts are
+        # never cached
+        for s in (CScript([x('00'*71), x('00'*33)]),
+                  CScript([x('00'*520), OP_DROP])):
+            self.assertIsNot(CScript(s)._parse(), s._parse())
+            self.assertNotIn(s, bitcoin.core.script._parsed_scripts)
+
+        # Invalid pushdata is raised after the preceding opcodes
+        s = CScript(x('76ac4c'))
+        i = s.raw_iter()
+        self.assertEqual(next(i), (OP_DUP, None, 0))
+        self.assertEqual(next(i), (OP_CHECKSIG, None, 1))
+        with self.assertRaises(CScriptInvalidError):
+            next(i)
+        with self.assertRaises(CScriptTruncatedPushDataError):
+            list(CScript(x('ac0300')).raw_iter())
+
+    def test_GetSigOpCount(self):
+        s = CScript([OP_2, x('00'*33), x('00'*33), x('00'*33), OP_3, OP_CHECKMULTISIG, OP_CHECKSIG])
+        self.assertEqual(s.GetSigOpCount(False), 21)
+        self.assertEqual(s.GetSigOpCount(True), 4)
+        with self.assertRaises(CScriptInvalidError):
+            CScript(x('ac4c')).GetSigOpCount(False)
+
+    def test_classify(self):
+        def T(script, expected_type, expected_payload=None):
+            self.assertEqual(CScript(script).classify(), (expected_type, expected_payload))
+
+        h = x('11'*20)
+        cpub = x('02' + '22'*32)
+        upub = x('04' + '33'*64)
+        T(CScript([OP_DUP, OP_HASH160, h, OP_EQUALVERIFY, OP_CHECKSIG]), TX_PUBKEYHASH, h)
+        T(CScript([OP_HASH160, h, OP_EQUAL]), TX_SCRIPTHASH, h)
+        T(CScript([cpub, OP_CHECKSIG]), TX_PUBKEY, cpub)
+        T(CScript([upub, OP_CHECKSIG]), TX_PUBKEY, upub)
+        T(CScript([1, cpub, upub, 2, OP_CHECKMULTISIG]), TX_MULTISIG, (1, [cpub, upub]))
+        T(CScript([OP_RETURN]), TX_NULL_DATA, ())
+        T(CScript([OP_RETURN, b'hello']), TX_NULL_DATA, (b'hello',))
+        T(CScript([OP_RETURN, b'a'*80, 3]), TX_NULL_DATA, (b'a'*80, 3))
+
+        T(b'', TX_NONSTANDARD)
+        T(CScript([OP_DUP, OP_HASH160, h, OP_EQUALVERIFY, OP_CHECKSIG, OP_NOP]), TX_NONSTANDARD)
+        # non-canonical pushes aren't recognized
+        T(x('76a94c14' + '11'*20 + '88ac'), TX_NONSTANDARD)
+        T(CScript([cpub + b'\x00', OP_CHECKSIG]), TX_NONSTANDARD)
+        T(CScript([3, cpub, upub, 2, OP_CHECKMULTISIG]), TX_NONSTANDARD)
+        T(CScript([1, cpub, upub, 3, OP_CHECKMULTISIG]), TX_NONSTANDARD)
+        T(CScript([1, cpub, h, 2, OP_CHECKMULTISIG]), TX_NONSTANDARD)
+        T(CScript([1] + [cpub]*16 + [16, OP_CHECKMULTISIG]), TX_MULTISIG, (1, [cpub]*16))
+        T(CScript([1] + [cpub]*17 + [OP_NOP, OP_CHECKMULTISIG]), TX_NONSTANDARD)
+        T(CScript([2, cpub, 1, OP_CHECKMULTISIG]), TX_NONSTANDARD)
+        T(CScript([1, b'\x04' + cpub[1:], 1, OP_CHECKMULTISIG]), TX_NONSTANDARD)
+        T(CScript([1, b'\x02' + upub[1:], 1, OP_CHECKMULTISIG]), TX_NONSTANDARD)
+        T(CScript([b'\x05' + cpub[1:], OP_CHECKSIG]), TX_NONSTANDARD)
+        T(CScript([b'\x03' + upub[1:], OP_CHECKSIG]), TX_NONSTANDARD)
+        T(CScript([OP_RETURN, OP_NOP]), TX_NONSTANDARD)
+        T(x('6a4c'), TX_NONSTANDARD)
+
     def test_to_p2sh_scriptPubKey(self):
         def T(redeemScript, expected_hex_bytes):
             redeemScript = CScript(redeemScript)
@@ -435,3 +503,70 @@ class Test_IsLowDERSignature(unittest.TestCase):
     def test_low_s_value(self):
         sig = x('3045022100b135074e08cc93904a1712b2600d3cb01899a5b1cc7498caa4b8585bcf5f27e7022074ab544045285baef0a63f0fb4c95e577dcbf5c969c0bf47c7da8e478909d669')
         self.assertTrue(IsLowDERSignature(sig))
+
+class Test_SignatureHash(unittest.TestCase):
+    def setUp(self):
+        from bitcoin.core import CTransaction, CTxIn, CTxOut, COutPoint, Hash
+        self.tx = CTransaction([CTxIn(COutPoint(Hash(x('%02x' % i)), i), CScript([x('00'*71)]), nSequence=i)
+                                for i in range(5)],
+                               [CTxOut(i, CScript([OP_RETURN, x('%02x' % i)])) for i in range(3)],
+                               nLockTime=1234)
+        self.script = CScript([OP_DUP, OP_CODESEPARATOR, OP_CHECKSIG])
+
+    def test_known_hashes(self):
+        from bitcoin.core import CMutableTransaction
+        mtx = CMutableTransaction.from_tx(self.tx)
+        for (hashtype, expected) in ((SIGHASH_ALL, 'ac693d4cc9b2bc3dd407cc54dad2da043800fe2c31eb270b2b30df9cecfa5d13'),
+                                     (SIGHASH_NONE, '73bbbfc8de9858587fd4b165e4a91f8d93ca6a01619a24998ad1e5b2e28011b0'),
+                                     (SIGHASH_SINGLE | SIGHASH_ANYONECANPAY,
+                                      '7cb3b04551165d852badc144d7b4f022e84c8d8430d110076afe323438d32371')):
+            self.assertEqual(b2x(SignatureHash(self.script, mtx, 1, hashtype)), expected)
+            self.assertEqual(b2x(SignatureHash(self.script, self.tx, 1, hashtype)), expected)
+
+    def test_context(self):
+        from bitcoin.core import CMutableTransaction
+        mtx = CMutableTransaction.from_tx(self.tx)
+        ctx = SignatureHashContext(self.tx)
+        for hashtype in (0, SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, 4, 0x41,
+                         SIGHASH_ALL | SIGHASH_ANYONECANPAY,
+                         SIGHASH_NONE | SIGHASH_ANYONECANPAY,
+                         SIGHASH_SINGLE | SIGHASH_ANYONECANPAY):
+            for inIdx in range(6):
+                expected = RawSignatureHash(self.script, mtx, inIdx, hashtype)
+                self.assertEqual(ctx.RawSignatureHash(self.script, inIdx, hashtype), expected)
+                self.assertEqual(RawSignatureHash(self.script, self.tx, inIdx, hashtype), expected)
+
+        # Only the last few hashes are remembered
+        self.assertLessEqual(len(ctx._results), SignatureHashContext._MAX_RESULTS)
+
+    def test_hash_one(self):
+        ctx = SignatureHashContext(self.tx)
+        hash_one = x('01' + '00'*31)
+        self.assertEqual(ctx.RawSignatureHash(self.script, 5, SIGHASH_ALL)[0], hash_one)
+        self.assertEqual(ctx.RawSignatureHash(self.script, 3, SIGHASH_SINGLE)[0], hash_one)
+        self.assertIsNone(ctx.RawSignatureHash(self.script, 2, SIGHASH_SINGLE)[1])
+        with self.assertRaises(ValueError):
+            ctx.SignatureHash(self.script, 3, SIGHASH_SINGLE)
+
+class Test_FindAndDelete(unittest.TestCase):
+    def test(self):
+        def T(script, sig, expected):
+            self.assertEqual(FindAndDelete(CScript(x(script)), CScript(x(sig))), CScript(x(expected)))
+
+        T('', 'ab', '')
+        T('ab', 'ab', '')
+        T('abac', 'ab', 'ac')
+        T('acabacab', 'ab', 'acac')
+        T('0302ff03', '0302ff03', '')
+        T('02ff0302ff03', '0302ff03', '02ff0302ff03')
+        T('0302ff030302ff03', '0302ff03', '')
+        T('0302ff03ab0302ff03', '0302ff03', 'ab')
+        # Only matches starting on an opcode boundary are deleted
+        T('02abab', 'ab', '02abab')
+        T('4c01ab', '01ab', '4c01ab')
+
+        script = CScript([OP_DUP, OP_CHECKSIG])
+        self.assertIs(FindAndDelete(script, CScript([OP_CODESEPARATOR])), script)
+
+        with self.assertRaises(CScriptInvalidError):
+            FindAndDelete(CScript(x('ac4c')), CScript([OP_CODESEPARATOR]))
@@ -113,3 +113,269 @@ class Test_EvalScript(unittest.TestCase):
                 continue
 
             self.fail('Expected %r to fail' % test_case)
+
+    def test_error_state(self):
+        scriptPubKey = CScript([OP_1, OP_DUP, OP_TOALTSTACK, OP_2, OP_EQUALVERIFY])
+        (txCredit, txSpend) = self.create_test_txs(CScript(), scriptPubKey)
+        with self.assertRaises(VerifyOpFailedError) as cm:
+            EvalScript([], scriptPubKey, txSpend, 0)
+        err = cm.exception
+        self.assertEqual((err.sop, err.sop_pc), (OP_EQUALVERIFY, 4))
+        self.assertEqual(err.stack, [b'\x01', b'\x02'])
+        self.assertEqual(err.altstack, [b'\x01'])
+        self.assertEqual(err.nOpCount, 3)
+
+
+class Test_ScriptVerifyFlags(unittest.TestCase):
+    def test(self):
+        flags = SCRIPT_VERIFY_P2SH | SCRIPT_VERIFY_NULLDUMMY
+        self.assertIsInstance(flags, ScriptVerifyFlags)
+        self.assertEqual(flags, 0x11)
+        self.assertIn(SCRIPT_VERIFY_P2SH, flags)
+        self.assertNotIn(SCRIPT_VERIFY_DERSIG, flags)
+        self.assertEqual(list(flags), [SCRIPT_VERIFY_P2SH, SCRIPT_VERIFY_NULLDUMMY])
+        self.assertEqual(len(flags), 2)
+        self.assertEqual(str(flags), 'P2SH,NULLDUMMY')
+        self.assertEqual(str(SCRIPT_VERIFY_NONE), 'NONE')
+
+        # Iterables of flags and names, as well as comma-separated names
+        for f in ((SCRIPT_VERIFY_P2SH, SCRIPT_VERIFY_NULLDUMMY),
+                  set(['P2SH', SCRIPT_VERIFY_NULLDUMMY]),
+                  'NULLDUMMY,P2SH',
+                  flags,
+                  0x11):
+            self.assertEqual(ScriptVerifyFlags(f), flags)
+        self.assertEqual(ScriptVerifyFlags(()), SCRIPT_VERIFY_NONE)
+        self.assertEqual(ScriptVerifyFlags('NONE'), SCRIPT_VERIFY_NONE)
+        with self.assertRaises(ValueError):
+            ScriptVerifyFlags('P2SH,FOO')
+
+        # Bitwise operators keep the type, either way around
+        for (r, expected) in ((flags & SCRIPT_VERIFY_P2SH, 'P2SH'),
+                              (0x1 & flags, 'P2SH'),
+                              (flags & MANDATORY_SCRIPT_VERIFY_FLAGS, 'P2SH'),
+                              (flags & ('NULLDUMMY',), 'NULLDUMMY'),
+                              (flags ^ SCRIPT_VERIFY_P2SH, 'NULLDUMMY'),
+                              (0x10 ^ flags, 'P2SH'),
+                              (0x4 | flags, 'P2SH,DERSIG,NULLDUMMY'),
+                              (flags & 0, 'NONE')):
+            self.assertIsInstance(r, ScriptVerifyFlags)
+            self.assertEqual(str(r), expected)
+        self.assertEqual(repr(flags & SCRIPT_VERIFY_NULLDUMMY), "ScriptVerifyFlags('NULLDUMMY')")
+
+        self.assertIn(MANDATORY_SCRIPT_VERIFY_FLAGS, STANDARD_SCRIPT_VERIFY_FLAGS)
+        self.assertIn(SCRIPT_VERIFY_CLEANSTACK, STANDARD_SCRIPT_VERIFY_FLAGS)
+
+    def test_verify_script(self):
+        # CLEANSTACK only applies with the flag set, whichever way it's given
+        scriptSig = CScript([1, 1])
+        scriptPubKey = CScript([OP_NOP])
+        (txCredit, txSpend) = Test_EvalScript().create_test_txs(scriptSig, scriptPubKey)
+        VerifyScript(scriptSig, scriptPubKey, txSpend, 0, SCRIPT_VERIFY_P2SH)
+        for flags in (SCRIPT_VERIFY_P2SH | SCRIPT_VERIFY_CLEANSTACK,
+                      (SCRIPT_VERIFY_P2SH, SCRIPT_VERIFY_CLEANSTACK),
+                      'P2SH,CLEANSTACK'):
+            with self.assertRaises(VerifyScriptError):
+                VerifyScript(scriptSig, scriptPubKey, txSpend, 0, flags)
+
+
+class Test_SignatureCache(unittest.TestCase):
+    def test_lru(self):
+        cache = SignatureCache(max_size=2)
+        cache.add(b'a', b'pub', b'sig')
+        cache.add(b'b', b'pub', b'sig')
+        self.assertTrue(cache.contains(b'a', b'pub', b'sig'))
+        cache.add(b'c', b'pub', b'sig')
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(cache.contains(b'b', b'pub', b'sig'))
+        self.assertTrue(cache.contains(b'a', b'pub', b'sig'))
+        self.assertFalse(cache.contains(b'a', b'pub', b'other'))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+    def test_verify_script(self):
+        import bitcoin.core.scripteval
+        from bitcoin.core.key import CECKey, CPubKey
+
+        k = CECKey()
+        k.set_secretbytes(Hash(b'signature cache'))
+        k.set_compressed(True)
+        pubkey = CPubKey(k.get_pubkey())
+        scriptPubKey = CScript([pubkey, OP_CHECKSIG])
+
+        txFrom = CTransaction([CTxIn()], [CTxOut(0, scriptPubKey)])
+        txTo = CMutableTransaction([CMutableTxIn(COutPoint(txFrom.GetHash(), 0))], [CTxOut(0, CScript())])
+        sighash = SignatureHash(scriptPubKey, txTo, 0, SIGHASH_ALL)
+        txTo.vin[0].scriptSig = CScript([k.sign(sighash) + b'\x01'])
+
+        prev_cache = bitcoin.core.scripteval.signature_cache
+        cache = bitcoin.core.scripteval.signature_cache = SignatureCache()
+        try:
+            VerifySignature(txFrom, txTo, 0)
+            self.assertEqual((len(cache), cache.hits, cache.misses), (1, 0, 1))
+            VerifySignature(txFrom, txTo, 0)
+            self.assertEqual((len(cache), cache.hits, cache.misses), (1, 1, 1))
+
+            # Invalid signatures aren't cached
+            txTo.vin[0].scriptSig = CScript([k.sign(Hash(b'')) + b'\x01'])
+            with self.assertRaises(ValidationError):
+                VerifySignature(txFrom, txTo, 0)
+            self.assertEqual((len(cache), cache.hits, cache.misses), (1, 1, 2))
+        finally:
+            bitcoin.core.scripteval.signature_cache = prev_cache
+
+
+class Test_ScriptProfiler(unittest.TestCase):
+    def test_eval_script(self):
+        profiler = ScriptProfiler()
+        script = CScript([1, 2, OP_2DUP, OP_TOALTSTACK, OP_TOALTSTACK, OP_ADD, 3, OP_EQUAL,
+                          OP_IF, 4, OP_HASH160, OP_ELSE, OP_RETURN, OP_ENDIF])
+        stack = []
+        EvalScript(stack, script, None, 0, tracer=profiler)
+        self.assertEqual(len(stack), 1)
+
+        self.assertEqual(profiler.opcode_counts[OP_TOALTSTACK], 2)
+        self.assertEqual(profiler.opcode_counts[OP_HASH160], 1)
+        self.assertEqual(profiler.opcode_counts[OP_RETURN], 1)
+        self.assertEqual(sum(profiler.opcode_counts.values()), 14)
+        self.assertEqual(set(profiler.opcode_times),
+                         set(('push', 'control', 'stack', 'numeric', 'bitwise', 'crypto')))
+        self.assertEqual(profiler.max_stack_depth, 4)
+        self.assertEqual(profiler.script_count, 1)
+        self.assertEqual(profiler.slowest_script[1], script)
+        self.assertEqual(profiler.sighash_count, 0)
+
+        # Failed scripts are still counted, but not the opcode that failed
+        with self.assertRaises(EvalScriptError):
+            EvalScript([], CScript([1, OP_RETURN]), None, 0, tracer=profiler)
+        self.assertEqual(profiler.script_count, 2)
+        self.assertEqual(profiler.opcode_counts[OP_RETURN], 1)
+
+        profiler.reset()
+        self.assertEqual((len(profiler.opcode_counts), profiler.script_count), (0, 0))
+
+    def test_verify_script(self):
+        from bitcoin.core.key import CECKey, CPubKey
+
+        k = CECKey()
+        k.set_secretbytes(Hash(b'script profiler'))
+        k.set_compressed(True)
+        scriptPubKey = CScript([1, CPubKey(k.get_pubkey()), 1, OP_CHECKMULTISIG])
+
+        txFrom = CTransaction([CTxIn()], [CTxOut(0, scriptPubKey)])
+        txTo = CMutableTransaction([CMutableTxIn(COutPoint(txFrom.GetHash(), 0))], [CTxOut(0, CScript())])
+        sighash = SignatureHash(scriptPubKey, txTo, 0, SIGHASH_ALL)
+        txTo.vin[0].scriptSig = CScript([OP_0, k.sign(sighash) + b'\x01'])
+
+        events = []
+        class Tracer(ScriptTracer):
+            def checksig(self, elapsed, ok):
+                events.append(ok)
+
+        VerifyScript(txTo.vin[0].scriptSig, scriptPubKey, txTo, 0, tracer=Tracer())
+        self.assertEqual(events, [True])
+
+        profiler = ScriptProfiler()
+        VerifyScript(txTo.vin[0].scriptSig, scriptPubKey, txTo, 0, tracer=profiler)
+        self.assertEqual(profiler.script_count, 2)
+        self.assertEqual((profiler.sighash_count, profiler.checksig_count), (1, 1))
+        self.assertEqual(profiler.opcode_counts[OP_CHECKMULTISIG], 1)
+
+
+class Test_VerifyTransaction(unittest.TestCase):
+    def setUp(self):
+        from bitcoin.core.key import CECKey, CPubKey
+
+        self.key = CECKey()
+        self.key.set_secretbytes(Hash(b'VerifyTransaction'))
+        self.key.set_compressed(True)
+        self.scriptPubKey = CScript([CPubKey(self.key.get_pubkey()), OP_CHECKSIG])
+
+    def spend(self, prevouts, spent_outputs, bad=()):
+        """Spend prevouts, with invalid signatures for the inputs in bad"""
+        tx = CMutableTransaction([CMutableTxIn(prevout) for prevout in prevouts],
+                                 [CTxOut(1, self.scriptPubKey)])
+        for (inIdx, txout) in enumerate(spent_outputs):
+            sighash = SignatureHash(txout.scriptPubKey, tx, inIdx, SIGHASH_ALL)
+            if inIdx in bad:
+                sighash = Hash(sighash)
+            tx.vin[inIdx].scriptSig = CScript([self.key.sign(sighash) + b'\x01'])
+        return CTransaction.from_tx(tx)
+
+    def test_verify_transaction(self):
+        import concurrent.futures
+
+        txFrom = CTransaction([CTxIn()], [CTxOut(i, self.scriptPubKey) for i in range(40)])
+        spent_outputs = txFrom.vout
+        prevouts = [COutPoint(txFrom.GetHash(), i) for i in range(40)]
+        good = self.spend(prevouts, spent_outputs)
+        bad = self.spend(prevouts, spent_outputs, bad=(17, 33))
+
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            for kwargs in ({}, {'executor': executor}, {'workers': 2}):
+                self.assertEqual(VerifyTransaction(good, spent_outputs, **kwargs), [None]*40)
+
+                with self.assertRaises(VerifyTransactionError) as cm:
+                    VerifyTransaction(bad, spent_outputs, **kwargs)
+                self.assertIn(' input 17: ', str(cm.exception))
+
+                results = VerifyTransaction(bad, spent_outputs, fail_fast=False, **kwargs)
+                self.assertEqual([i for (i, err) in enumerate(results) if err is not None], [17, 33])
+                self.assertIsInstance(results[33], VerifyTransactionError)
+
+        with self.assertRaises(ValueError):
+            VerifyTransaction(good, spent_outputs[1:])
+
+    def test_init_worker(self):
+        import bitcoin.core.key
+        import bitcoin.core.scripteval
+        from bitcoin.core.scripteval import _InitVerifyWorker, _VerifyWorkerInitArgs
+
+        prev_cache = bitcoin.core.scripteval.signature_cache
+        prev_backend = bitcoin.core.key.backend
+        try:
+            cache = bitcoin.core.scripteval.signature_cache = SignatureCache(max_size=10)
+            cache.add(b'h'*32, b'p'*33, b's'*71)
+            args = _VerifyWorkerInitArgs()
+            self.assertEqual(args, (prev_backend.name, 10, [(b'h'*32, b'p'*33, b's'*71)]))
+
+            # What a worker does with them
+            bitcoin.core.scripteval.signature_cache = None
+            _InitVerifyWorker(*args)
+            worker_cache = bitcoin.core.scripteval.signature_cache
+            self.assertIsNot(worker_cache, cache)
+            self.assertEqual(worker_cache.max_size, 10)
+            self.assertTrue(worker_cache.contains(b'h'*32, b'p'*33, b's'*71))
+            self.assertIs(bitcoin.core.key.backend, prev_backend)
+
+            bitcoin.core.scripteval.signature_cache = None
+            _InitVerifyWorker(*_VerifyWorkerInitArgs())
+            self.assertIsNone(bitcoin.core.scripteval.signature_cache)
+        finally:
+            bitcoin.core.scripteval.signature_cache = prev_cache
+            bitcoin.core.key.backend = prev_backend
+
+    def test_verify_block_scripts(self):
+        txFrom = CTransaction([CTxIn()], [CTxOut(i, self.scriptPubKey) for i in range(2)])
+        spent_outputs = {COutPoint(txFrom.GetHash(), 0): txFrom.vout[0],
+                         COutPoint(txFrom.GetHash(), 1): txFrom.vout[1]}
+        tx1 = self.spend([COutPoint(txFrom.GetHash(), 0)], [txFrom.vout[0]])
+        # Spends an output created earlier in the same block
+        tx2 = self.spend([COutPoint(tx1.GetHash(), 0), COutPoint(txFrom.GetHash(), 1)],
+                         [tx1.vout[0], txFrom.vout[1]])
+        coinbase = CTransaction([CTxIn(COutPoint(), CScript([1]))], [CTxOut(0, CScript())])
+
+        VerifyBlockScripts(CBlock(vtx=[coinbase, tx1, tx2]), spent_outputs)
+        VerifyBlockScripts(CBlock(vtx=[coinbase, tx1, tx2]), spent_outputs, workers=2)
+
+        tx2_bad = self.spend([txin.prevout for txin in tx2.vin], [tx1.vout[0], txFrom.vout[1]], bad=(1,))
+        with self.assertRaises(VerifyTransactionError) as cm:
+            VerifyBlockScripts(CBlock(vtx=[coinbase, tx1, tx2_bad]), spent_outputs, workers=2)
+        self.assertIn(' input 1: ', str(cm.exception))
+
+        # Spending an unknown output
+        with self.assertRaises(VerifyTransactionError) as cm:
+            VerifyBlockScripts(CBlock(vtx=[coinbase, tx2]), spent_outputs)
+        self.assertIn('not found', str(cm.exception))
@@ -11,6 +11,7 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import struct
 import unittest, random
 
 from binascii import unhexlify
@@ -40,12 +41,57 @@ class Test_Serializable(unittest.TestCase):
 
         FooSerializable.deserialize(b'\x00', allow_padding=True)
 
+    def test_buffer_types(self):
+        """Serializable.deserialize() accepts any contiguous buffer"""
+
+        class FooSerializable(Serializable):
+            def __init__(self, v):
+                self.v = v
+
+            @classmethod
+            def stream_deserialize(cls, f):
+                return cls(VarIntSerializer.stream_deserialize(f))
+
+            def stream_serialize(self, f):
+                VarIntSerializer.stream_serialize(self.v, f)
+
+        buf = FooSerializable(0x1234).serialize()
+        for b in (buf, bytearray(buf), memoryview(buf)):
+            self.assertEqual(FooSerializable.deserialize(b).v, 0x1234)
+
+        with self.assertRaises(DeserializationExtraDataError) as cm:
+            FooSerializable.deserialize(bytearray(buf + b'\xff'))
+        self.assertEqual(cm.exception.padding, b'\xff')
+
+    def test_stream_deserialize_override(self):
+        """Subclasses overriding only stream_deserialize() aren't parsed with an inherited view_deserialize()"""
+        from bitcoin.core import CBlockHeader
+
+        class AltHeader(CBlockHeader):
+            __slots__ = ['nExtra']
+
+            @classmethod
+            def stream_deserialize(cls, f):
+                self = super(AltHeader, cls).stream_deserialize(f)
+                object.__setattr__(self, 'nExtra', struct.unpack(b'<I', ser_read(f, 4))[0])
+                return self
+
+        raw = CBlockHeader(nTime=1234).serialize() + b'\x2a\x00\x00\x00'
+        for buf in (raw, bytearray(raw), memoryview(raw)):
+            header = AltHeader.deserialize(buf)
+            self.assertEqual((header.nTime, header.nExtra), (1234, 42))
+
+        (headers, offset) = VectorSerializer.view_deserialize(AltHeader, memoryview(b'\x02' + raw * 2), 0)
+        self.assertEqual([h.nExtra for h in headers], [42, 42])
+        self.assertEqual(offset, 1 + len(raw) * 2)
+
 class Test_VarIntSerializer(unittest.TestCase):
     def test(self):
         def T(value, expected):
             expected = unhexlify(expected)
             actual = VarIntSerializer.serialize(value)
             self.assertEqual(actual, expected)
+            self.assertEqual(VarIntSerializer.get_serialize_size(value), len(expected))
             roundtrip = VarIntSerializer.deserialize(actual)
             self.assertEqual(value, roundtrip)
         T(0x0, b'00')
@@ -69,6 +115,17 @@ class Test_VarIntSerializer(unittest.TestCase):
         T(b'ff0000000000000000', 0)
         T(b'ffefcdab8967452301', 0x123456789abcdef)
 
+    def test_view_deserialize(self):
+        def T(serialized, expected_value):
+            serialized = unhexlify(serialized)
+            (actual_value, offset) = VarIntSerializer.view_deserialize(memoryview(b'\xaa' + serialized), 1)
+            self.assertEqual(actual_value, expected_value)
+            self.assertEqual(offset, len(serialized) + 1)
+        T(b'fc', 0xfc)
+        T(b'fd3412', 0x1234)
+        T(b'fe67452301', 0x1234567)
+        T(b'ffefcdab8967452301', 0x123456789abcdef)
+
     def test_truncated(self):
         def T(serialized):
             serialized = unhexlify(serialized)
@@ -84,6 +141,16 @@ class Test_VarIntSerializer(unittest.TestCase):
         T(b'ff')
         T(b'ff00000000000000')
 
+    def test_view_truncated(self):
+        def T(serialized):
+            serialized = unhexlify(serialized)
+            with self.assertRaises(SerializationTruncationError):
+                VarIntSerializer.view_deserialize(memoryview(serialized), 0)
+        T(b'')
+        T(b'fd00')
+        T(b'fe000000')
+        T(b'ff00000000000000')
+
 class Test_BytesSerializer(unittest.TestCase):
     def test(self):
         def T(value, expected):
@@ -91,6 +158,7 @@ class Test_BytesSerializer(unittest.TestCase):
             expected = unhexlify(expected)
             actual = BytesSerializer.serialize(value)
             self.assertEqual(actual, expected)
+            self.assertEqual(BytesSerializer.get_serialize_size(value), len(expected))
             roundtrip = BytesSerializer.deserialize(actual)
             self.assertEqual(value, roundtrip)
         T(b'', b'00')
@@ -107,6 +175,16 @@ class Test_BytesSerializer(unittest.TestCase):
         T(b'0200')
         T(b'ff00000000000000ff11223344', SerializationError) # > max_size
 
+    def test_view_truncated(self):
+        def T(serialized, ex_cls=SerializationTruncationError):
+            serialized = unhexlify(serialized)
+            with self.assertRaises(ex_cls):
+                BytesSerializer.view_deserialize(memoryview(serialized), 0)
+        T(b'')
+        T(b'01')
+        T(b'0200')
+        T(b'ff00000000000000ff11223344', SerializationError) # > max_size
+
 class Test_Compact(unittest.TestCase):
     def test_from_compact_zero(self):
         self.assertEqual(uint256_from_compact(0x00123456), 0)
@@ -134,6 +212,29 @@ class Test_Compact(unittest.TestCase):
         self.assertEqual(compact_from_uint256(0x92340000), 0x05009234)
         self.assertEqual(compact_from_uint256(0x1234560000000000000000000000000000000000000000000000000000000000), 0x20123456)
 
+class Test_Hash(unittest.TestCase):
+    def test_Hash_many(self):
+        msgs = [b'', b'a', b'\x00'*3000] + [unhexlify('%04x' % i) for i in range(200)]
+        expected = [Hash(msg) for msg in msgs]
+        self.assertEqual(Hash_many(msgs), expected)
+        self.assertEqual(Hash_many(iter(msgs)), expected)
+        self.assertEqual(Hash_many([]), [])
+
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            return
+        with ThreadPoolExecutor(4) as executor:
+            self.assertEqual(Hash_many(msgs, executor), expected)
+
+    def test_hash_pairs(self):
+        level = [Hash(unhexlify('%02x' % i)) for i in range(5)]
+        self.assertEqual(hash_pairs(level),
+                         [Hash(level[0] + level[1]), Hash(level[2] + level[3]), Hash(level[4] + level[4])])
+        self.assertEqual(hash_pairs(level[:2]), [Hash(level[0] + level[1])])
+        self.assertEqual(hash_pairs(level[:1]), [Hash(level[0] + level[0])])
+        self.assertEqual(hash_pairs([]), [])
+
 class Test_Uint256_Serialize(unittest.TestCase):
     def test_fixed(self):
         values = []
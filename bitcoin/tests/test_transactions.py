@@ -103,6 +103,16 @@ class Test_CMutableTxIn(unittest.TestCase):
 
         self.assertNotEqual(h1, txin.GetHash())
 
+class Test_CMutableTransaction(unittest.TestCase):
+    def test_serialize(self):
+        """CMutableTransaction.serialize() is not cached"""
+        tx = CMutableTransaction.deserialize(CTransaction([CTxIn()], [CTxOut()]).serialize())
+
+        s1 = tx.serialize()
+        tx.nLockTime = 1
+
+        self.assertNotEqual(s1, tx.serialize())
+
 class Test_CTransaction(unittest.TestCase):
     def test_is_coinbase(self):
         tx = CMutableTransaction()
@@ -120,6 +130,33 @@ class Test_CTransaction(unittest.TestCase):
         tx.vin.append(CTxIn())
         self.assertFalse(tx.is_coinbase())
 
+    def test_serialize_cached(self):
+        """CTransaction.serialize() returns the original bytes"""
+        raw = x('01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff0704ffff001d0104ffffffff0100f2052a0100000043410496b538e853519c726a2c91e61ec11600ae1390813a627c66fb8be7947be63c52da7589379515d4e0a604f8141781e62294721166bf621e73a82cbf2342c858eeac00000000')
+        tx = CTransaction.deserialize(raw)
+        self.assertIs(tx.serialize(), tx.serialize())
+        self.assertEqual(tx.serialize(), raw)
+
+        tx2 = CTransaction(tx.vin, tx.vout, tx.nLockTime, tx.nVersion)
+        self.assertEqual(tx2.serialize(), raw)
+        self.assertIs(tx2.serialize(), tx2.serialize())
+
+    def test_non_canonical_varints(self):
+        """Varints that aren't minimally encoded don't change the txid"""
+        import io
+        raw = x('01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff0704ffff001d0104ffffffff0100f2052a0100000043410496b538e853519c726a2c91e61ec11600ae1390813a627c66fb8be7947be63c52da7589379515d4e0a604f8141781e62294721166bf621e73a82cbf2342c858eeac00000000')
+        txid = CTransaction.deserialize(raw).GetHash()
+
+        # vin count, then scriptSig length
+        for nc in (raw[:4] + x('fd0100') + raw[5:],
+                   raw[:41] + x('fd0700') + raw[42:]):
+            for tx in (CTransaction.deserialize(nc),
+                       CTransaction.stream_deserialize(io.BytesIO(nc)),
+                       CBlock.deserialize(CBlockHeader().serialize() + b'\x01' + nc, lazy=True).vtx[0]):
+                self.assertEqual(tx.serialize(), raw)
+                self.assertEqual(tx.GetHash(), txid)
+                self.assertEqual(tx.get_serialize_size(), len(raw))
+
     def test_tx_valid(self):
         for prevouts, tx, enforceP2SH in load_test_vectors('tx_valid.json'):
             try:
@@ -58,11 +58,14 @@ class CBitcoinAddress(bitcoin.base58.CBase58Data):
         P2PKHBitcoinAddress. If the scriptPubKey is not recognized
         CBitcoinAddressError will be raised.
         """
-        try:
-            return P2SHBitcoinAddress.from_scriptPubKey(scriptPubKey)
-        except CBitcoinAddressError:
-            pass
-
+        scriptPubKey = script.CScript(scriptPubKey)
+        (script_type, payload) = scriptPubKey.classify()
+        if script_type == script.TX_SCRIPTHASH:
+            return P2SHBitcoinAddress.from_bytes(payload)
+        elif script_type == script.TX_PUBKEYHASH:
+            return P2PKHBitcoinAddress.from_bytes(payload)
+
+        # Non-canonical and bare checksig scriptPubKeys
         try:
             return P2PKHBitcoinAddress.from_scriptPubKey(scriptPubKey)
         except CBitcoinAddressError:
@@ -156,42 +159,33 @@ class P2PKHBitcoinAddress(CBitcoinAddress):
 
         accept_bare_checksig          - Treat bare-checksig as P2PKH scriptPubKeys (default True)
         """
-        if accept_non_canonical_pushdata:
-            # Canonicalize script pushes
-            scriptPubKey = script.CScript(scriptPubKey) # in case it's not a CScript instance yet
+        scriptPubKey = script.CScript(scriptPubKey) # in case it's not a CScript instance yet
+        (script_type, payload) = scriptPubKey.classify()
 
+        if (accept_non_canonical_pushdata
+                and script_type not in (script.TX_PUBKEYHASH, script.TX_PUBKEY)):
+            # Canonicalize script pushes and try again; classify() only
+            # recognizes canonical encodings.
             try:
                 scriptPubKey = script.CScript(tuple(scriptPubKey)) # canonicalize
             except bitcoin.core.script.CScriptInvalidError:
                 raise CBitcoinAddressError('not a P2PKH scriptPubKey: script is invalid')
-
-        if (len(scriptPubKey) == 25
-                and _bord(scriptPubKey[0])  == script.OP_DUP
-                and _bord(scriptPubKey[1])  == script.OP_HASH160
-                and _bord(scriptPubKey[2])  == 0x14
-                and _bord(scriptPubKey[23]) == script.OP_EQUALVERIFY
-                and _bord(scriptPubKey[24]) == script.OP_CHECKSIG):
-            return cls.from_bytes(scriptPubKey[3:23], bitcoin.params.BASE58_PREFIXES['PUBKEY_ADDR'])
-
-        elif accept_bare_checksig:
-            pubkey = None
-
-            # We can operate on the raw bytes directly because we've
-            # canonicalized everything above.
-            if (len(scriptPubKey) == 35 # compressed
-                  and _bord(scriptPubKey[0])  == 0x21
-                  and _bord(scriptPubKey[34]) == script.OP_CHECKSIG):
-
-                pubkey = scriptPubKey[1:34]
-
-            elif (len(scriptPubKey) == 67 # uncompressed
-                    and _bord(scriptPubKey[0]) == 0x41
-                    and _bord(scriptPubKey[66]) == script.OP_CHECKSIG):
-
-                pubkey = scriptPubKey[1:65]
-
-            if pubkey is not None:
-                return cls.from_pubkey(pubkey, accept_invalid=True)
+            (script_type, payload) = scriptPubKey.classify()
+
+        if script_type == script.TX_PUBKEYHASH:
+            return cls.from_bytes(payload, bitcoin.params.BASE58_PREFIXES['PUBKEY_ADDR'])
+
+        elif (accept_bare_checksig and len(scriptPubKey) in (35, 67)
+                and _bord(scriptPubKey[0]) == len(scriptPubKey) - 2
+                and _bord(scriptPubKey[-1]) == script.OP_CHECKSIG):
+            # Any 33 or 65 byte push, not just the valid pubkey encodings
+            # classify() recognizes as TX_PUBKEY. For compatibility,
+            # uncompressed pubkeys have always been hashed without their last
+            # byte here.
+            pubkey = scriptPubKey[1:-1]
+            if len(pubkey) == 65:
+                pubkey = pubkey[:64]
+            return cls.from_pubkey(pubkey, accept_invalid=True)
 
         raise CBitcoinAddressError('not a P2PKH scriptPubKey')
 
@@ -211,21 +205,28 @@ class CKey(object):
 
     """
     def __init__(self, secret, compressed=True):
-        self._cec_key = bitcoin.core.key.CECKey()
-        self._cec_key.set_secretbytes(secret)
-        self._cec_key.set_compressed(compressed)
-
-        self.pub = bitcoin.core.key.CPubKey(self._cec_key.get_pubkey(), self._cec_key)
+        self._key = bitcoin.core.key.backend.new_key(secret, compressed)
+        self.pub = bitcoin.core.key.CPubKey(self._key.get_pubkey())
 
     @property
     def is_compressed(self):
         return self.pub.is_compressed
 
+    @property
+    def _cec_key(self):
+        """OpenSSL CECKey for this key
+
+        Kept for code written before the libsecp256k1 backend.
+        """
+        if isinstance(self._key, bitcoin.core.key.CECKey):
+            return self._key
+        return self._key._cec_key
+
     def sign(self, hash):
-        return self._cec_key.sign(hash)
+        return self._key.sign(hash)
 
     def sign_compact(self, hash):
-        return self._cec_key.sign_compact(hash)
+        return self._key.sign_compact(hash)
 
 class CBitcoinSecretError(bitcoin.base58.Base58Error):
     pass